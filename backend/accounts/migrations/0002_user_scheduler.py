@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 10:29
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='user',
+            name='scheduler',
+            field=models.CharField(choices=[('knards', 'Knards'), ('sm2', 'SM-2'), ('fsrs', 'FSRS')], default='knards', max_length=10),
+        ),
+    ]
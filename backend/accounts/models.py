@@ -4,6 +4,7 @@ from django.contrib.auth.models import (
     PermissionsMixin,
     BaseUserManager
 )
+from knards.schedulers import DEFAULT_SCHEDULER, SCHEDULER_CHOICES
 
 
 class UserManager(BaseUserManager):
@@ -19,7 +20,7 @@ class UserManager(BaseUserManager):
         )
 
         user.set_password(password)
-        user.save()
+        user.save(using=self._db)
 
         return user
 
@@ -41,6 +42,12 @@ class User(AbstractBaseUser, PermissionsMixin):
     is_active = models.BooleanField(default=True)
     is_staff = models.BooleanField(default=False)
     is_admin = models.BooleanField(default=False)
+    # the spaced repetition algorithm scheduling the revisions
+    scheduler = models.CharField(
+        max_length=10,
+        choices=SCHEDULER_CHOICES,
+        default=DEFAULT_SCHEDULER
+    )
 
     USERNAME_FIELD = 'email'
     REQUIRED_FIELDS = ['username']
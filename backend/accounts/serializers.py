@@ -16,4 +16,12 @@ class UserSerializer(UserSerializer):
 
     class Meta(UserSerializer.Meta):
         model = get_user_model()
-        fields = ['id', 'username', 'email', 'password', 'card_series', 'cards']
\ No newline at end of file
+        fields = [
+            'id',
+            'username',
+            'email',
+            'password',
+            'scheduler',
+            'card_series',
+            'cards'
+        ]
\ No newline at end of file
@@ -1,9 +1,10 @@
 from rest_framework import viewsets
 from django.contrib.auth import get_user_model
+from knards.replicas import ReplicaReadMixin
 from .serializers import UserSerializer
 
 
-class UserViewSet(viewsets.ModelViewSet):
+class UserViewSet(ReplicaReadMixin, viewsets.ModelViewSet):
     serializer_class = UserSerializer
     queryset = get_user_model().objects.order_by('pk')
     lookup_field = 'pk'
\ No newline at end of file
@@ -1,5 +1,14 @@
 from django.contrib import admin
-from .models import CardSeries, Tag, Card, CardPartial, CardScore
+from .models import (
+    CardSeries,
+    Tag,
+    Card,
+    CardPartial,
+    CardScore,
+    TagSet,
+    TagSetStatistics,
+    ContentVersion
+)
 
 
 class CardSeriesAdmin(admin.ModelAdmin):
@@ -25,10 +34,28 @@ class CardPartialAdmin(admin.ModelAdmin):
 class CardScoreAdmin(admin.ModelAdmin):
     list_display = ['card', 'owner', 'score', 'last_revised_at']
     list_per_page = 25
+
+class TagSetAdmin(admin.ModelAdmin):
+    list_display = ['name', 'key']
+    search_fields = ['name',]
+    list_per_page = 25
+
+class TagSetStatisticsAdmin(admin.ModelAdmin):
+    list_display = ['owner', 'tags_set_str', 'total']
+    list_select_related = ['owner', 'tag_set']
+    list_per_page = 25
+
+class ContentVersionAdmin(admin.ModelAdmin):
+    list_display = ['key', 'version']
+    search_fields = ['key',]
+    list_per_page = 25
     
     
 admin.site.register(CardSeries, CardSeriesAdmin)
 admin.site.register(Tag, TagAdmin)
 admin.site.register(Card, CardAdmin)
 admin.site.register(CardPartial, CardPartialAdmin)
-admin.site.register(CardScore, CardScoreAdmin)
\ No newline at end of file
+admin.site.register(CardScore, CardScoreAdmin)
+admin.site.register(TagSet, TagSetAdmin)
+admin.site.register(TagSetStatistics, TagSetStatisticsAdmin)
+admin.site.register(ContentVersion, ContentVersionAdmin)
\ No newline at end of file
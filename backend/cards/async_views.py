@@ -0,0 +1,172 @@
+import functools
+from asgiref.sync import sync_to_async
+from django.http import HttpResponse, HttpResponseNotAllowed
+from django.utils.http import parse_etags
+from rest_framework import exceptions
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from rest_framework.settings import api_settings
+from knards.replicas import read_alias, get_read_alias
+from .models import Tag, CardPartial
+from .serializers import TagSerializer, CardPartialSerializer
+from .stats import (
+    aget_cached_home_statistics,
+    aget_cached_revision_queue_and_statistics,
+    get_home_info
+)
+from .versions import (
+    TAGS_KEY,
+    user_key,
+    card_key,
+    aget_versions,
+    format_etag
+)
+from .views import (
+    get_cardset_by_query_params,
+    get_order_seed,
+    cardset_randomize_and_group_by_weights_and_series
+)
+
+
+def render(data, status=200):
+    # the same bytes as the JSON renderer of the sync views
+    return HttpResponse(
+        JSONRenderer().render(data),
+        status=status,
+        content_type='application/json'
+    )
+
+def get_error_response(request, exception):
+    data = exception.detail \
+        if isinstance(exception.detail, (list, dict)) \
+        else {'detail': exception.detail}
+    response = render(data, exception.status_code)
+    if isinstance(
+        exception,
+        (exceptions.NotAuthenticated, exceptions.AuthenticationFailed)
+    ):
+        # like APIView, a 403 unless the first authenticator has a challenge
+        header = request.authenticators[0].authenticate_header(request) \
+            if request.authenticators else None
+        if header:
+            response['WWW-Authenticate'] = header
+        else:
+            response.status_code = 403
+    return response
+
+def async_api_view(view):
+    """
+    Turns a coroutine function of a DRF request into a read-only Django
+    view authenticated and routed to the replicas like the DRF views. The
+    authenticators hit the database, so they run in a thread.
+    """
+
+    @functools.wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        if request.method != 'GET':
+            return HttpResponseNotAllowed(['GET'])
+
+        request = Request(request, authenticators=[
+            authenticator()
+            for authenticator in api_settings.DEFAULT_AUTHENTICATION_CLASSES
+        ])
+        try:
+            user = await sync_to_async(lambda: request.user)()
+            if not user.is_authenticated:
+                raise exceptions.NotAuthenticated
+            token = read_alias.set(await sync_to_async(get_read_alias)(user))
+            try:
+                return await view(request, *args, **kwargs)
+            finally:
+                read_alias.reset(token)
+        except exceptions.APIException as e:
+            return get_error_response(request, e)
+
+    return wrapper
+
+async def get_conditional_response(request, version_keys, get_response):
+    # see VersionedETagMixin
+    etag = format_etag(
+        request.get_full_path(),
+        request.user.pk,
+        'json',
+        await aget_versions(version_keys)
+    )
+    if etag in parse_etags(request.headers.get('If-None-Match', '')):
+        response = HttpResponse(status=304)
+    else:
+        response = await get_response()
+        if response.status_code != 200:
+            return response
+
+    response['ETag'] = etag
+    response['Cache-Control'] = 'private, no-cache'
+    return response
+
+@async_api_view
+async def home_info(request):
+    return render(get_home_info(
+        await aget_cached_home_statistics(request.user)
+    ))
+
+@async_api_view
+async def revision_queue(request):
+    cardset = get_cardset_by_query_params(
+        request.query_params,
+        request.user
+    )
+
+    seed = get_order_seed(request.query_params)
+    params = request.query_params.dict()
+    params.pop('seed', None)
+
+    modified_cardset, cards_total_by_tags, cards_total \
+        = await aget_cached_revision_queue_and_statistics(
+            cardset,
+            request.user,
+            params
+        )
+
+    return render({
+        'cardset': cardset_randomize_and_group_by_weights_and_series(
+            modified_cardset,
+            seed
+        ),
+        'cards_total': cards_total,
+        'cards_total_by_tags': cards_total_by_tags
+    })
+
+@async_api_view
+async def card_partials_list(request):
+    card = request.query_params.get('card', None)
+    if card:
+        try:
+            card = int(card)
+        except ValueError:
+            raise exceptions.ValidationError({'card': 'expected an id'})
+        queryset = CardPartial.objects.filter(card=card)
+        version_keys = [card_key(card)]
+    else:
+        queryset = CardPartial.objects.filter(card__owner=request.user)
+        version_keys = [user_key(request.user.pk)]
+
+    async def get_response():
+        card_partials = [
+            card_partial
+            async for card_partial in queryset.order_by('position')
+        ]
+        return render(CardPartialSerializer(card_partials, many=True).data)
+
+    return await get_conditional_response(
+        request,
+        version_keys,
+        get_response
+    )
+
+@async_api_view
+async def tags_list(request):
+    async def get_response():
+        tags = [tag async for tag in Tag.objects.order_by('name')]
+        return render(TagSerializer(tags, many=True).data)
+
+    return await get_conditional_response(request, [TAGS_KEY], get_response)
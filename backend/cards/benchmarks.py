@@ -0,0 +1,579 @@
+import asyncio, datetime, io, json, math, os, random, statistics, sys, time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from django.contrib.auth import get_user_model
+from django.core.handlers.asgi import ASGIHandler
+from django.core.handlers.wsgi import WSGIHandler
+from django.db import connection, connections, DEFAULT_DB_ALIAS
+from django.test.utils import override_settings
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import AccessToken
+from knards.metrics import count_queries
+from .caching import invalidate_statistics
+from .models import Tag, CardScore
+from .scheduler import (
+    ALGORITHMS,
+    get_due_at,
+    get_unscored_due_at,
+    get_revision_schedule,
+    review_card_scores
+)
+from .seeding import seed
+from .stats import rollup_cards_total_by_tags
+from .views import cardset_randomize_and_group_by_weights_and_series
+
+TIERS = {'1k': 1000, '10k': 10000, '100k': 100000}
+
+# most queries a request may run, whatever the size of the library; the
+# statistics of the user are invalidated before every request so these are
+# cold runs
+QUERY_BUDGETS = {
+    'get_home_info': 2,
+    'get_cardset_and_statistics_by_query_params': 5,
+    'get_cards_from_series': 3,
+    'list': 4,
+    'list_keyset': 3,
+    'reorder_cards_in_series': 8,
+}
+
+
+def get_benchmark_user(tier, n_cards, seed_value=0):
+    # generated once per tier and reused by the later runs
+    username_prefix = f'bench-{tier}-'
+    user = get_user_model().objects \
+        .filter(username=f'{username_prefix}0') \
+        .first()
+    if user is None:
+        user = seed(
+            n_users=1,
+            n_cards=n_cards,
+            seed=seed_value,
+            username_prefix=username_prefix
+        )[0]
+    return user
+
+def get_scenarios(user):
+    card_series = user.card_series.order_by('-pk').first()
+    cards_from_series = list(
+        card_series.cards.order_by('n_in_series').values('id', 'n_in_series')
+    ) if card_series else []
+
+    def reorder_data():
+        # reverses the series on every run
+        cards_from_series.reverse()
+        return {'cards_from_series': [
+            {'id': card['id'], 'n_in_series': index}
+            for index, card in enumerate(cards_from_series)
+        ]}
+
+    url = '/api/cards/cards/'
+    return [
+        ('get_home_info', 'get', f'{url}get_home_info/', None),
+        (
+            'get_cardset_and_statistics_by_query_params',
+            'get',
+            f'{url}get_cardset_and_statistics_by_query_params/',
+            None
+        ),
+        (
+            'get_cards_from_series',
+            'get',
+            f'{url}get_cards_from_series/',
+            lambda: {'series': card_series.pk if card_series else 0}
+        ),
+        ('list', 'get', url, None),
+        ('list_keyset', 'get', url, lambda: {'pagination': 'keyset'}),
+        (
+            'reorder_cards_in_series',
+            'post',
+            f'{url}reorder_cards_in_series/',
+            reorder_data
+        ),
+    ]
+
+def is_benchmark_database(alias=DEFAULT_DB_ALIAS):
+    # the bench users are seeded into the database, so it must be one of
+    # its own: a test or bench database, or a throwaway one in memory
+    database = connections[alias]
+    if database.vendor == 'sqlite' and database.is_in_memory_db():
+        return True
+    name = os.path.basename(str(database.settings_dict['NAME'] or '')).lower()
+    return 'test' in name or 'bench' in name
+
+def reset_statistics(user):
+    # the cached statistics and counts of the user are keyed on its content
+    # version, so the next request computes them again while the rest of a
+    # shared cache is left alone
+    invalidate_statistics([user.pk])
+
+def request(client, method, url, data):
+    if method == 'get':
+        response = client.get(url, data() if data else None)
+    else:
+        response = client.post(url, data() if data else None, format='json')
+    if response.status_code >= 400:
+        raise RuntimeError(f'{method.upper()} {url}: {response.status_code}')
+    return response
+
+def measure(user, client, method, url, data, repeat):
+    queries = count_queries()
+    reset_statistics(user)
+    with connection.execute_wrapper(queries):
+        request(client, method, url, data)
+
+    timings = []
+    for _ in range(repeat):
+        reset_statistics(user)
+        started_at = time.perf_counter()
+        request(client, method, url, data)
+        timings.append((time.perf_counter() - started_at) * 1000)
+
+    # a separate run, tracing allocations slows everything down
+    reset_statistics(user)
+    tracemalloc.start()
+    try:
+        request(client, method, url, data)
+        _, peak_memory = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    timings.sort()
+    return {
+        'queries': queries.count,
+        'latency_ms': {
+            'min': round(timings[0], 2),
+            'median': round(statistics.median(timings), 2),
+            'p95': round(timings[int(0.95 * (len(timings) - 1))], 2),
+        },
+        'peak_memory_kb': peak_memory // 1024,
+    }
+
+def run_benchmarks(user, repeat=5):
+    client = APIClient()
+    client.force_authenticate(user)
+    results = {}
+    with override_settings(ALLOWED_HOSTS=['testserver']):
+        for name, method, url, data in get_scenarios(user):
+            results[name] = measure(user, client, method, url, data, repeat)
+    return results
+
+def check_budgets(results):
+    return [
+        f'{tier} {name}: {result["queries"]} queries, '
+        f'budget {QUERY_BUDGETS[name]}'
+        for tier, scenarios in results['tiers'].items()
+        for name, result in scenarios.items()
+        if result['queries'] > QUERY_BUDGETS[name]
+    ]
+
+def compare_results(results, baseline, tolerance):
+    # regressions of the median latency beyond `tolerance` and any
+    # additional queries
+    regressions = []
+    for tier, scenarios in results['tiers'].items():
+        for name, result in scenarios.items():
+            previous = baseline.get('tiers', {}).get(tier, {}).get(name)
+            if previous is None:
+                continue
+            if result['queries'] > previous['queries']:
+                regressions.append(
+                    f'{tier} {name}: {previous["queries"]} -> '
+                    f'{result["queries"]} queries'
+                )
+            median = result['latency_ms']['median']
+            previous_median = previous['latency_ms']['median']
+            if median > previous_median * (1 + tolerance):
+                regressions.append(
+                    f'{tier} {name}: {previous_median} -> {median} ms'
+                )
+    return regressions
+
+def get_load_scenarios(user):
+    # the read endpoints with an async variant, relative to /api/cards/ and
+    # /api/cards/async/
+    card = user.cards.order_by('pk').first()
+    return [
+        ('get_home_info', 'cards/get_home_info/', ''),
+        (
+            'get_cardset_and_statistics_by_query_params',
+            'cards/get_cardset_and_statistics_by_query_params/',
+            ''
+        ),
+        ('card_partials', 'card-partials/', f'card={card.pk if card else 0}'),
+        ('tags', 'tags/', ''),
+    ]
+
+def wsgi_get(handler, path, query_string, authorization):
+    environ = {
+        'REQUEST_METHOD': 'GET',
+        'SCRIPT_NAME': '',
+        'PATH_INFO': path,
+        'QUERY_STRING': query_string,
+        'SERVER_NAME': 'testserver',
+        'SERVER_PORT': '80',
+        'SERVER_PROTOCOL': 'HTTP/1.1',
+        'HTTP_HOST': 'testserver',
+        'HTTP_AUTHORIZATION': authorization,
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': 'http',
+        'wsgi.input': io.BytesIO(),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': False,
+        'wsgi.run_once': False,
+    }
+    statuses = []
+    response = handler(
+        environ,
+        lambda status, headers, exc_info=None: statuses.append(status)
+    )
+    try:
+        b''.join(response)
+    finally:
+        # sends request_finished, which closes the connection of the thread
+        response.close()
+    return int(statuses[0].split()[0])
+
+async def asgi_get(application, path, query_string, authorization):
+    scope = {
+        'type': 'http',
+        'asgi': {'version': '3.0'},
+        'http_version': '1.1',
+        'method': 'GET',
+        'scheme': 'http',
+        'path': path,
+        'raw_path': path.encode(),
+        'query_string': query_string.encode(),
+        'root_path': '',
+        'headers': [
+            (b'host', b'testserver'),
+            (b'authorization', authorization.encode()),
+        ],
+        'client': ('127.0.0.1', 0),
+        'server': ('testserver', 80),
+    }
+    messages = []
+    received = False
+
+    async def receive():
+        nonlocal received
+        if not received:
+            received = True
+            return {'type': 'http.request', 'body': b'', 'more_body': False}
+        # the client never disconnects, the handler cancels this wait
+        await asyncio.Future()
+
+    async def send(message):
+        messages.append(message)
+
+    await application(scope, receive, send)
+    return messages[0]['status']
+
+def summarize_load(latencies, elapsed):
+    latencies.sort()
+    return {
+        'requests_per_second': round(len(latencies) / elapsed, 1),
+        'latency_ms': {
+            'median': round(statistics.median(latencies) * 1000, 2),
+            'p95': round(
+                latencies[int(0.95 * (len(latencies) - 1))] * 1000,
+                2
+            ),
+        },
+    }
+
+def run_wsgi_load(path, query_string, authorization, concurrency, n_requests):
+    # a threaded WSGI server with `concurrency` threads
+    handler = WSGIHandler()
+
+    def get(_):
+        started_at = time.perf_counter()
+        status = wsgi_get(handler, path, query_string, authorization)
+        if status >= 400:
+            raise RuntimeError(f'GET {path}: {status}')
+        return time.perf_counter() - started_at
+
+    started_at = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as executor:
+        latencies = list(executor.map(get, range(n_requests)))
+    return summarize_load(latencies, time.perf_counter() - started_at)
+
+async def run_asgi_load(
+    path,
+    query_string,
+    authorization,
+    concurrency,
+    n_requests
+):
+    # an ASGI server with at most `concurrency` requests in flight
+    application = ASGIHandler()
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def get():
+        async with semaphore:
+            started_at = time.perf_counter()
+            status = await asgi_get(
+                application,
+                path,
+                query_string,
+                authorization
+            )
+            if status >= 400:
+                raise RuntimeError(f'GET {path}: {status}')
+            return time.perf_counter() - started_at
+
+    started_at = time.perf_counter()
+    latencies = await asyncio.gather(*(get() for _ in range(n_requests)))
+    return summarize_load(list(latencies), time.perf_counter() - started_at)
+
+def run_load_benchmarks(user, concurrency, n_requests):
+    # throughput of the sync views against their async variants, both
+    # starting with cold statistics and authenticated with a token like the
+    # frontend
+    token = AccessToken.for_user(user)
+    # access tokens expire after a few minutes, longer than some runs
+    token.set_exp(lifetime=datetime.timedelta(hours=1))
+    authorization = f'JWT {token}'
+    results = {}
+    with override_settings(ALLOWED_HOSTS=['testserver']):
+        for name, path, query_string in get_load_scenarios(user):
+            reset_statistics(user)
+            sync = run_wsgi_load(
+                f'/api/cards/{path}',
+                query_string,
+                authorization,
+                concurrency,
+                n_requests
+            )
+            reset_statistics(user)
+            results[name] = {
+                'sync': sync,
+                'async': asyncio.run(run_asgi_load(
+                    f'/api/cards/async/{path}',
+                    query_string,
+                    authorization,
+                    concurrency,
+                    n_requests
+                )),
+            }
+    return results
+
+def get_scheduler_rows(n_cards, now, seed_value=0):
+    # CardScore values of a library revised over the last year, a tenth of
+    # the cards were never revised
+    rng = random.Random(seed_value)
+    created_at, rows = [], []
+    for _ in range(n_cards):
+        created_at.append(now - datetime.timedelta(days=rng.uniform(1, 365)))
+        if rng.random() < 0.1:
+            rows.append(None)
+            continue
+        last_revised_at = now - datetime.timedelta(days=rng.uniform(0, 60))
+        score = rng.choice([0, 1, 2, 3, 5, 8, 13, 21])
+        rows.append({
+            'score': score,
+            'last_revised_at': last_revised_at,
+            'due_at': get_due_at(last_revised_at, score),
+            'scheduler': 'knards',
+            'stability': None,
+            'difficulty': None,
+            'repetitions': rng.randint(1, 10),
+        })
+    return rows, created_at
+
+def get_loop_schedule(rows, created_at, now):
+    # the revision queue before the vectorized schedulers, one card at a time
+    eligible, weights = [], []
+    for row, moment in zip(rows, created_at):
+        last_revised_at = row['last_revised_at'] if row else moment
+        due_at = row['due_at'] if row else get_unscored_due_at(moment)
+        days_passed = (now - last_revised_at).days
+        eligible.append(due_at <= now)
+        weights.append(int(
+            1000 * math.exp(-0.6 * (row['score'] if row else 0))
+                + 18 * math.pow(max(days_passed, 0), 0.7)
+        ))
+    return eligible, weights
+
+def get_cards_per_second(n_cards, run, repeat):
+    timings = []
+    for _ in range(repeat):
+        started_at = time.perf_counter()
+        run()
+        timings.append(time.perf_counter() - started_at)
+    return round(n_cards / statistics.median(timings))
+
+def run_scheduler_benchmarks(n_cards, repeat=5, seed_value=0):
+    # cards scheduled per second when building a revision queue, and cards
+    # rescheduled per second by the bulk reviews
+    now = datetime.datetime.now(tz=datetime.timezone.utc)
+    rows, created_at = get_scheduler_rows(n_cards, now, seed_value)
+    card_scores = [
+        CardScore(pk=index + 1, **row)
+        for index, row in enumerate(filter(None, rows))
+    ]
+    previous_scores = [card_score.score for card_score in card_scores]
+    reviewed_at = [now] * len(card_scores)
+
+    results = {'loop': {'schedule': get_cards_per_second(
+        n_cards,
+        lambda: get_loop_schedule(rows, created_at, now),
+        repeat
+    )}}
+    for name, algorithm in ALGORITHMS.items():
+        results[name] = {
+            'schedule': get_cards_per_second(
+                n_cards,
+                lambda: get_revision_schedule(
+                    algorithm,
+                    rows,
+                    created_at,
+                    now
+                ),
+                repeat
+            ),
+            'review': get_cards_per_second(
+                len(card_scores),
+                lambda: review_card_scores(
+                    algorithm,
+                    card_scores,
+                    previous_scores,
+                    reviewed_at
+                ),
+                repeat
+            ),
+        }
+    return results
+
+def get_queue_rows(n_cards, seed_value=0):
+    # a revision queue with a third of the cards in series of up to 10
+    rng = random.Random(seed_value)
+    rows, series_id = [], 0
+    while len(rows) < n_cards:
+        if rng.random() < 0.3:
+            series_id += 1
+            size = rng.randint(2, 10)
+        else:
+            size = 1
+        for _ in range(min(size, n_cards - len(rows))):
+            rows.append({
+                'id': len(rows) + 1,
+                'series_id': series_id if size > 1 else None,
+                'weight': rng.choice([1000, 548, 301, 165, 49, 15, 5, 1])
+                    + rng.randint(0, 100),
+            })
+    return rows
+
+def run_ordering_benchmarks(n_cards, repeat=5, seed_value=0):
+    # cards ordered per second by the revision queues
+    rows = get_queue_rows(n_cards, seed_value)
+    return get_cards_per_second(
+        n_cards,
+        lambda: cardset_randomize_and_group_by_weights_and_series(
+            rows,
+            seed_value
+        ),
+        repeat
+    )
+
+def get_rollup_tag_sets(n_tag_sets, n_tags, seed_value=0):
+    # the totals of tag sets of 1 to 5 tags out of `n_tags`, the tags are
+    # not saved
+    rng = random.Random(seed_value)
+    tags = [Tag(pk=index + 1, name=f'tag {index}') for index in range(n_tags)]
+    tag_set_tags, cards_total_by_tag_set = {}, {}
+    for tag_set_id in range(1, n_tag_sets + 1):
+        tag_set_tags[tag_set_id] = sorted(
+            rng.sample(tags, rng.randint(1, min(5, n_tags))),
+            key=lambda tag: tag.pk
+        )
+        total = rng.randint(1, 50)
+        cards_total_by_tag_set[tag_set_id] = {
+            'total': total,
+            'to_revise': rng.randint(0, total),
+        }
+    return cards_total_by_tag_set, tag_set_tags
+
+def run_rollup_benchmarks(n_tag_sets, n_tags=500, repeat=5, seed_value=0):
+    # tag sets rolled up per second by the statistics panel
+    cards_total_by_tag_set, tag_set_tags = get_rollup_tag_sets(
+        n_tag_sets,
+        n_tags,
+        seed_value
+    )
+    return get_cards_per_second(
+        n_tag_sets,
+        lambda: rollup_cards_total_by_tags(
+            cards_total_by_tag_set,
+            tag_set_tags
+        ),
+        repeat
+    )
+
+def get_results(
+    tiers,
+    repeat=5,
+    seed_value=0,
+    concurrency=None,
+    n_requests=200,
+    scheduler_cards=None,
+    ordering_cards=None,
+    rollup_tag_sets=None
+):
+    # `tiers` maps the names of the tiers to their number of cards
+    users = {
+        tier: get_benchmark_user(tier, n_cards, seed_value)
+        for tier, n_cards in tiers.items()
+    }
+    results = {
+        'created_at': datetime.datetime.now(
+            tz=datetime.timezone.utc
+        ).isoformat(),
+        'vendor': connection.vendor,
+        'repeat': repeat,
+        'tiers': {
+            tier: run_benchmarks(user, repeat)
+            for tier, user in users.items()
+        },
+    }
+    if concurrency:
+        results['load'] = {
+            'concurrency': concurrency,
+            'requests': n_requests,
+            'tiers': {
+                tier: run_load_benchmarks(user, concurrency, n_requests)
+                for tier, user in users.items()
+            },
+        }
+    if scheduler_cards:
+        results['scheduler'] = {
+            'cards': scheduler_cards,
+            'cards_per_second': run_scheduler_benchmarks(
+                scheduler_cards,
+                repeat,
+                seed_value
+            ),
+        }
+    if ordering_cards:
+        results['ordering'] = {
+            'cards': ordering_cards,
+            'cards_per_second': run_ordering_benchmarks(
+                ordering_cards,
+                repeat,
+                seed_value
+            ),
+        }
+    if rollup_tag_sets:
+        results['rollup'] = {
+            'tag_sets': rollup_tag_sets,
+            'tag_sets_per_second': run_rollup_benchmarks(
+                rollup_tag_sets,
+                repeat=repeat,
+                seed_value=seed_value
+            ),
+        }
+    return results
+
+def dump_results(results, path):
+    with open(path, 'w') as f:
+        json.dump(results, f, indent=2, sort_keys=True)
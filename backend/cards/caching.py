@@ -0,0 +1,146 @@
+import hashlib, json, threading, time
+from collections import Counter
+from django.conf import settings
+from django.core.cache import caches
+from .versions import (
+    TAGS_KEY,
+    user_key,
+    get_versions,
+    aget_versions,
+    bump_versions
+)
+
+# seconds a computed value is served as is
+STATISTICS_CACHE_TIMEOUT = 60
+# seconds an expired value may still be served while a single request
+# recomputes it
+STATISTICS_CACHE_STALE_TIMEOUT = 5 * 60
+STATISTICS_CACHE_LOCK_TIMEOUT = 30
+
+counters = Counter()
+counters_lock = threading.Lock()
+
+
+def get_statistics_cache():
+    return caches[getattr(settings, 'STATISTICS_CACHE_ALIAS', 'default')]
+
+def get_shared_cache():
+    return caches[getattr(settings, 'SHARED_CACHE_ALIAS', 'default')]
+
+def count(name, outcome):
+    with counters_lock:
+        counters[name, outcome] += 1
+
+def get_cache_counters():
+    # hits, misses, stale hits and refreshes by cached computation
+    with counters_lock:
+        return {
+            f'{name}.{outcome}': value
+            for (name, outcome), value in sorted(counters.items())
+        }
+
+def reset_cache_counters():
+    with counters_lock:
+        counters.clear()
+
+def get_statistics_version_keys(owner_id):
+    # the versions are bumped on every write to the cards of the user and
+    # on tag changes, so the key of stale statistics is never looked up again
+    return [user_key(owner_id), TAGS_KEY]
+
+def format_statistics_cache_key(name, owner_id, versions, params=None):
+    digest = hashlib.md5(
+        json.dumps(params or {}, sort_keys=True, default=str).encode()
+    ).hexdigest()
+    return 'statistics:{}:{}:{}:{}'.format(
+        name,
+        owner_id,
+        '.'.join(map(str, versions)),
+        digest
+    )
+
+def get_statistics_cache_key(name, owner_id, params=None):
+    return format_statistics_cache_key(
+        name,
+        owner_id,
+        get_versions(get_statistics_version_keys(owner_id)),
+        params
+    )
+
+async def aget_statistics_cache_key(name, owner_id, params=None):
+    return format_statistics_cache_key(
+        name,
+        owner_id,
+        await aget_versions(get_statistics_version_keys(owner_id)),
+        params
+    )
+
+def invalidate_statistics(owner_ids):
+    bump_versions([user_key(owner_id) for owner_id in owner_ids])
+
+def get_or_compute(
+    name,
+    owner_id,
+    params,
+    compute,
+    timeout=STATISTICS_CACHE_TIMEOUT,
+    stale_timeout=STATISTICS_CACHE_STALE_TIMEOUT
+):
+    cache = get_statistics_cache()
+    key = get_statistics_cache_key(name, owner_id, params)
+    now = time.time()
+
+    entry = cache.get(key)
+    if entry is not None:
+        value, fresh_until = entry
+        if now < fresh_until:
+            count(name, 'hit')
+            return value
+        # only the request that takes the lock recomputes an expired value
+        if not cache.add(f'{key}:lock', 1, STATISTICS_CACHE_LOCK_TIMEOUT):
+            count(name, 'stale')
+            return value
+        count(name, 'refresh')
+    else:
+        count(name, 'miss')
+
+    value = compute()
+    cache.set(key, (value, now + timeout), timeout + stale_timeout)
+    cache.delete(f'{key}:lock')
+    return value
+
+async def aget_or_compute(
+    name,
+    owner_id,
+    params,
+    compute,
+    timeout=STATISTICS_CACHE_TIMEOUT,
+    stale_timeout=STATISTICS_CACHE_STALE_TIMEOUT
+):
+    # same as get_or_compute with a coroutine function as `compute`, the
+    # values are shared with the sync views
+    cache = get_statistics_cache()
+    key = await aget_statistics_cache_key(name, owner_id, params)
+    now = time.time()
+
+    entry = await cache.aget(key)
+    if entry is not None:
+        value, fresh_until = entry
+        if now < fresh_until:
+            count(name, 'hit')
+            return value
+        if not await cache.aadd(
+            f'{key}:lock',
+            1,
+            STATISTICS_CACHE_LOCK_TIMEOUT
+        ):
+            count(name, 'stale')
+            return value
+        count(name, 'refresh')
+    else:
+        count(name, 'miss')
+
+    value = await compute()
+    await cache.aset(key, (value, now + timeout), timeout + stale_timeout)
+    await cache.adelete(f'{key}:lock')
+    return value
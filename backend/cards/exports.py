@@ -0,0 +1,85 @@
+import json, zipfile
+from django.db.models import Prefetch
+from .models import Tag, Card, CardPartial, CardScore
+
+EXPORT_CHUNK_SIZE = 1000
+
+
+def get_export_cards(owner):
+    # the prefetches run once per chunk of the server-side cursor
+    return Card.objects.filter(owner=owner) \
+        .select_related('card_series') \
+        .prefetch_related(
+            Prefetch('tags', queryset=Tag.objects.order_by('pk')),
+            Prefetch(
+                'card_partials',
+                queryset=CardPartial.objects.order_by('position')
+            ),
+            Prefetch(
+                'card_scores',
+                queryset=CardScore.objects.filter(owner=owner)
+            )
+        ) \
+        .defer('search_document', 'search_vector') \
+        .order_by('pk') \
+        .iterator(chunk_size=EXPORT_CHUNK_SIZE)
+
+def serialize_card(card):
+    # the same shape as the JSON Lines accepted by cards.imports
+    scores = list(card.card_scores.all())
+    return {
+        'id': card.pk,
+        'title': card.title,
+        'tags': [tag.name for tag in card.tags.all()],
+        'series': card.card_series.name if card.card_series else None,
+        'n_in_series': card.n_in_series if card.card_series else None,
+        'is_private': card.is_private,
+        'created_at': card.created_at.isoformat(),
+        'partials': [
+            {
+                'content': partial.content,
+                'is_prompt': partial.is_prompt,
+                'prompt_initial_content': partial.prompt_initial_content,
+            }
+            for partial in card.card_partials.all()
+        ],
+        'score': {
+            'score': scores[0].score,
+            'last_revised_at': scores[0].last_revised_at.isoformat(),
+            'due_at': scores[0].due_at.isoformat()
+                if scores[0].due_at else None,
+        } if scores else None,
+    }
+
+def export_ndjson(owner):
+    for card in get_export_cards(owner):
+        yield json.dumps(serialize_card(card)) + '\n'
+
+
+class ChunkWriter:
+    # an unseekable file that hands over whatever was written so far
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def pop(self):
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+def export_zip(owner, filename='cards.jsonl'):
+    writer = ChunkWriter()
+    with zipfile.ZipFile(writer, 'w', zipfile.ZIP_DEFLATED) as archive:
+        with archive.open(filename, 'w', force_zip64=True) as f:
+            for line in export_ndjson(owner):
+                f.write(line.encode())
+                data = writer.pop()
+                if data:
+                    yield data
+    yield writer.pop()
@@ -0,0 +1,381 @@
+import codecs, csv, html, json, os, re
+from django.db import transaction
+from .models import CardSeries, Tag, Card, CardPartial
+from .search import get_content_text, update_search_vectors
+from .series import lock_series, get_next_n_in_series, get_series_step
+from .stats import (
+    get_tag_statistics_contributions_by_ids,
+    apply_tag_statistics_changes
+)
+from .tagsets import get_tag_set_key, get_or_create_tag_sets
+from .versions import TAGS_KEY, user_key, bump_versions
+
+IMPORT_FORMATS = ('csv', 'jsonl', 'anki')
+IMPORT_CHUNK_SIZE = 500
+# errors beyond this are counted but not reported one by one
+IMPORT_MAX_ERRORS = 100
+
+CLOZE_RE = re.compile(r'\{\{c\d+::(.*?)(?:::[^}]*)?\}\}')
+# the JSON types of the fields of a card, null is the same as missing
+JSONL_FIELD_TYPES = {
+    'title': str,
+    'tags': (list, str),
+    'series': str,
+    'front': str,
+    'back': str,
+    'partials': list,
+}
+
+
+def get_import_format(filename, format=None):
+    if format is None:
+        format = {
+            '.csv': 'csv',
+            '.jsonl': 'jsonl',
+            '.ndjson': 'jsonl',
+            '.txt': 'anki',
+        }.get(os.path.splitext(filename or '')[1].lower())
+    if format not in IMPORT_FORMATS:
+        raise ValueError(
+            f'unknown format, expected one of {", ".join(IMPORT_FORMATS)}'
+        )
+    return format
+
+def strip_html(text):
+    text = re.sub(r'<br\s*/?>|</div>|</p>', '\n', text, flags=re.IGNORECASE)
+    return html.unescape(re.sub(r'<[^>]+>', '', text))
+
+def text_to_slate(text, type='text'):
+    # one block per line, anki clozes become leaves to recall
+    blocks = []
+    for line in text.replace('\r\n', '\n').strip('\n').split('\n'):
+        children, position = [], 0
+        for match in CLOZE_RE.finditer(line):
+            if match.start() > position:
+                children.append({'text': line[position:match.start()]})
+            children.append({'text': match.group(1), 'insetQuestion': True})
+            position = match.end()
+        if position < len(line) or not children:
+            children.append({'text': line[position:]})
+        blocks.append({'type': type, 'children': children})
+    return blocks
+
+def get_partial(text, is_prompt=False, type='text'):
+    return {
+        'content': text_to_slate(text, type),
+        'is_prompt': is_prompt,
+        'prompt_initial_content': [{'type': type, 'children': [{'text': ''}]}],
+    }
+
+def get_front_and_back_partials(front, back):
+    partials = []
+    if front:
+        partials.append(get_partial(front))
+    if back:
+        # the answer is typed in during the revision
+        partials.append(get_partial(back, is_prompt=True))
+    return partials
+
+def parse_csv(stream):
+    # columns: title, tags (comma separated), series, front, back, is_private
+    reader = csv.DictReader(stream)
+    for row in reader:
+        yield reader.line_num, {
+            'title': row.get('title'),
+            'tags': (row.get('tags') or '').split(','),
+            'series': row.get('series'),
+            'is_private': (row.get('is_private') or '').lower()
+                in ('1', 'true', 'yes'),
+            'partials': get_front_and_back_partials(
+                row.get('front'),
+                row.get('back')
+            ),
+        }
+
+def get_jsonl_type_error(data):
+    for field, types in JSONL_FIELD_TYPES.items():
+        if data.get(field) is not None and not isinstance(data[field], types):
+            return ValueError(f'invalid {field}')
+    if isinstance(data.get('tags'), list) \
+            and not all(isinstance(tag, str) for tag in data['tags']):
+        return ValueError('invalid tags, expected names')
+    return None
+
+def parse_jsonl(stream):
+    for line_number, line in enumerate(stream, 1):
+        if not line.strip():
+            continue
+        try:
+            data = json.loads(line)
+        except ValueError:
+            yield line_number, ValueError('invalid JSON')
+            continue
+        if not isinstance(data, dict):
+            yield line_number, ValueError('expected an object')
+            continue
+        error = get_jsonl_type_error(data)
+        if error:
+            yield line_number, error
+            continue
+
+        partials = []
+        for partial in data.get('partials') or []:
+            if isinstance(partial, dict) and 'content' in partial:
+                partials.append({
+                    'content': partial['content'],
+                    'is_prompt': bool(partial.get('is_prompt', False)),
+                    'prompt_initial_content': partial.get(
+                        'prompt_initial_content',
+                        [{'type': 'text', 'children': [{'text': ''}]}]
+                    ),
+                })
+            elif isinstance(partial, dict):
+                partials.append(get_partial(
+                    str(partial.get('text', '')),
+                    bool(partial.get('is_prompt', False)),
+                    partial.get('type', 'text')
+                ))
+        yield line_number, {
+            'title': data.get('title'),
+            'tags': data.get('tags') or [],
+            'series': data.get('series'),
+            'is_private': bool(data.get('is_private', False)),
+            'partials': partials or get_front_and_back_partials(
+                data.get('front'),
+                data.get('back')
+            ),
+        }
+
+def parse_anki(stream):
+    # anki's "notes in plain text" export: `#key:value` headers, then one
+    # note per line with the front, back and tags fields
+    options = {'separator': 'tab', 'html': 'false'}
+    for line_number, line in enumerate(stream, 1):
+        line = line.rstrip('\r\n')
+        if line.startswith('#') and ':' in line:
+            key, value = line[1:].split(':', 1)
+            options[key.strip()] = value.strip()
+            continue
+        if not line.strip():
+            continue
+
+        separator = {
+            'tab': '\t',
+            'comma': ',',
+            'semicolon': ';',
+            'space': ' ',
+            'pipe': '|',
+        }.get(options['separator'], options['separator'])
+        fields = next(csv.reader([line], delimiter=separator))
+        columns = {}
+        for key in ('guid', 'notetype', 'deck', 'tags'):
+            column = options.get(f'{key} column', '')
+            if column.isdigit() and 0 < int(column) <= len(fields):
+                columns[int(column) - 1] = key
+        tags = []
+        for index, key in columns.items():
+            if key == 'tags':
+                tags = fields[index].split()
+        # the fields of the note are whatever is left
+        fields = [
+            field for index, field in enumerate(fields)
+            if index not in columns
+        ]
+        if options['html'] == 'true':
+            fields = [strip_html(field) for field in fields]
+
+        yield line_number, {
+            'title': None,
+            'tags': tags,
+            'series': None,
+            'is_private': False,
+            'partials': get_front_and_back_partials(
+                fields[0] if fields else None,
+                fields[1] if len(fields) > 1 else None
+            ),
+        }
+
+def parse(stream, format):
+    return {
+        'csv': parse_csv,
+        'jsonl': parse_jsonl,
+        'anki': parse_anki,
+    }[format](stream)
+
+def clean_entry(entry):
+    if isinstance(entry, Exception):
+        raise entry
+
+    title = (str(entry['title'] or '')).strip() or None
+    if title and len(title) > Card._meta.get_field('title').max_length:
+        raise ValueError('the title is too long')
+    tags = entry['tags']
+    if isinstance(tags, str):
+        tags = tags.split(',')
+    tags = sorted({str(tag).strip() for tag in tags} - {''})
+    if any(len(tag) > Tag._meta.get_field('name').max_length for tag in tags):
+        raise ValueError('a tag name is too long')
+    series = (str(entry['series'] or '')).strip() or None
+    if series and len(series) > CardSeries._meta.get_field('name').max_length:
+        raise ValueError('the series name is too long')
+    if not title and not entry['partials']:
+        raise ValueError('the card is empty')
+    if any(
+        not isinstance(partial['content'], list)
+            or not isinstance(partial['prompt_initial_content'], list)
+        for partial in entry['partials']
+    ):
+        raise ValueError('the content of a partial must be a list of blocks')
+
+    return {**entry, 'title': title, 'tags': tags, 'series': series}
+
+class Importer:
+    """
+    Creates the cards of `owner` from parsed entries, a chunk of entries per
+    transaction. The tags and series looked up or created along the way are
+    cached for the whole import.
+    """
+
+    def __init__(self, owner, chunk_size=None):
+        self.owner = owner
+        self.chunk_size = chunk_size or IMPORT_CHUNK_SIZE
+        self.tag_ids = {}
+        self.card_series = {}
+        self.rows = 0
+        self.cards = 0
+        self.errors = 0
+
+    def run(self, entries):
+        # yields the progress after every chunk, rows that can't be imported
+        # are skipped and reported
+        chunk, error = [], None
+        try:
+            for line_number, entry in entries:
+                self.rows += 1
+                try:
+                    chunk.append(clean_entry(entry))
+                except ValueError as e:
+                    self.errors += 1
+                    if self.errors <= IMPORT_MAX_ERRORS:
+                        yield self.get_progress(
+                            errors=[{'line': line_number, 'error': str(e)}]
+                        )
+                    continue
+                if len(chunk) >= self.chunk_size:
+                    self.import_chunk(chunk)
+                    chunk = []
+                    yield self.get_progress()
+        except (csv.Error, UnicodeDecodeError) as e:
+            error = f'unreadable file: {e}'
+
+        if chunk:
+            self.import_chunk(chunk)
+        yield self.get_progress(
+            done=True,
+            errors_total=self.errors,
+            **({'error': error} if error else {})
+        )
+
+    def get_progress(self, **extra):
+        return {'rows': self.rows, 'cards': self.cards, **extra}
+
+    def get_tag_ids(self, names):
+        missing = [name for name in names if name not in self.tag_ids]
+        if missing:
+            created = Tag.objects.bulk_create(
+                [Tag(name=name) for name in missing],
+                ignore_conflicts=True
+            )
+            if created:
+                bump_versions([TAGS_KEY])
+            self.tag_ids.update(
+                Tag.objects.filter(name__in=missing).values_list('name', 'pk')
+            )
+        return [self.tag_ids[name] for name in names]
+
+    def get_card_series(self, names):
+        missing = [name for name in names if name not in self.card_series]
+        for card_series in CardSeries.objects.filter(
+            owner=self.owner,
+            name__in=missing
+        ).order_by('pk'):
+            self.card_series.setdefault(card_series.name, card_series)
+        for name in missing:
+            if name not in self.card_series:
+                self.card_series[name] = CardSeries.objects.create(
+                    owner=self.owner,
+                    name=name
+                )
+        return [self.card_series[name] for name in names]
+
+    @transaction.atomic
+    def import_chunk(self, chunk):
+        tag_names = sorted({tag for entry in chunk for tag in entry['tags']})
+        tag_ids = dict(zip(tag_names, self.get_tag_ids(tag_names)))
+        series_names = sorted({entry['series'] for entry in chunk} - {None})
+        card_series = dict(zip(
+            series_names,
+            self.get_card_series(series_names)
+        ))
+
+        # the cards go to the end of their series, locked in a stable order
+        next_n_in_series = {}
+        for series in sorted(card_series.values(), key=lambda s: s.pk):
+            lock_series(series.pk)
+            next_n_in_series[series.pk] = get_next_n_in_series(series)
+
+        card_tag_ids = [
+            [tag_ids[tag] for tag in entry['tags']] for entry in chunk
+        ]
+        tag_sets = get_or_create_tag_sets(card_tag_ids)
+
+        cards = []
+        for entry, entry_tag_ids in zip(chunk, card_tag_ids):
+            series = card_series.get(entry['series'])
+            n_in_series = 1
+            if series is not None:
+                n_in_series = next_n_in_series[series.pk]
+                next_n_in_series[series.pk] += get_series_step(series)
+            cards.append(Card(
+                owner=self.owner,
+                card_series=series,
+                n_in_series=n_in_series,
+                title=entry['title'],
+                is_private=entry['is_private'],
+                tag_set=tag_sets.get(get_tag_set_key(entry_tag_ids)),
+                search_document='\n'.join(
+                    text for text in (
+                        get_content_text(partial['content'])
+                        for partial in entry['partials']
+                    ) if text
+                )
+            ))
+        Card.objects.bulk_create(cards)
+        Card.tags.through.objects.bulk_create([
+            Card.tags.through(card_id=card.pk, tag_id=tag_id)
+            for card, entry_tag_ids in zip(cards, card_tag_ids)
+            for tag_id in entry_tag_ids
+        ])
+        CardPartial.objects.bulk_create([
+            CardPartial(card=card, position=position, **partial)
+            for card, entry in zip(cards, chunk)
+            for position, partial in enumerate(entry['partials'], 1)
+        ])
+
+        # bulk inserts don't send the signals that maintain these
+        card_ids = [card.pk for card in cards]
+        apply_tag_statistics_changes(
+            {},
+            get_tag_statistics_contributions_by_ids(card_ids)
+        )
+        update_search_vectors(card_ids)
+        bump_versions([user_key(self.owner.pk)])
+        self.cards += len(cards)
+
+def import_file(owner, file, format, chunk_size=None):
+    """
+    Streams `file`, a binary file object, into cards of `owner` line by line
+    and yields the progress after every chunk.
+    """
+    lines = codecs.iterdecode(file, 'utf-8-sig')
+    return Importer(owner, chunk_size).run(parse(lines, format))
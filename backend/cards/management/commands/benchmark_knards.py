@@ -0,0 +1,177 @@
+import json
+from django.core.management.base import BaseCommand, CommandError
+from cards.benchmarks import (
+    TIERS,
+    is_benchmark_database,
+    get_results,
+    dump_results,
+    check_budgets,
+    compare_results
+)
+
+
+class Command(BaseCommand):
+    help = 'Benchmarks the main endpoints against generated libraries, ' \
+        'only in a test or bench database'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--tier',
+            action='append',
+            dest='tiers',
+            choices=list(TIERS),
+            help='Size of the library, repeatable (default: 1k and 10k)'
+        )
+        parser.add_argument(
+            '--repeat',
+            type=int,
+            default=5,
+            help='Number of timed requests per endpoint'
+        )
+        parser.add_argument(
+            '--seed',
+            type=int,
+            default=0,
+            help='Seed of the generated libraries'
+        )
+        parser.add_argument(
+            '--concurrency',
+            type=int,
+            default=0,
+            help='Also compare the throughput of the sync and async read '
+                'views with this many requests in flight'
+        )
+        parser.add_argument(
+            '--requests',
+            type=int,
+            default=200,
+            help='Number of requests per endpoint of the throughput runs'
+        )
+        parser.add_argument(
+            '--scheduler-cards',
+            type=int,
+            default=0,
+            help='Also compare the scheduling throughput of the algorithms '
+                'on this many generated cards'
+        )
+        parser.add_argument(
+            '--ordering-cards',
+            type=int,
+            default=0,
+            help='Also measure the ordering of a revision queue of this '
+                'many generated cards'
+        )
+        parser.add_argument(
+            '--rollup-tag-sets',
+            type=int,
+            default=0,
+            help='Also measure the rollups of the statistics panel on this '
+                'many generated tag sets of 500 tags'
+        )
+        parser.add_argument(
+            '--output',
+            default='benchmark-results.json',
+            help='Where to write the results'
+        )
+        parser.add_argument(
+            '--compare',
+            default=None,
+            help='Results of a previous run to compare against'
+        )
+        parser.add_argument(
+            '--tolerance',
+            type=float,
+            default=0.2,
+            help='Allowed relative increase of the median latencies'
+        )
+
+    def handle(self, *args, **options):
+        if not is_benchmark_database():
+            raise CommandError(
+                'the benchmarks seed their users into the database, run them '
+                'against a test or bench database (its name must contain '
+                '"test" or "bench")'
+            )
+        if options['repeat'] < 1:
+            raise CommandError('--repeat must be positive')
+        if options['concurrency'] < 0 or options['requests'] < 1:
+            raise CommandError('--concurrency and --requests must be positive')
+        if min(
+            options['scheduler_cards'],
+            options['ordering_cards'],
+            options['rollup_tag_sets']
+        ) < 0:
+            raise CommandError(
+                '--scheduler-cards, --ordering-cards and --rollup-tag-sets '
+                'must be positive'
+            )
+        tiers = options['tiers'] or ['1k', '10k']
+
+        results = get_results(
+            {tier: TIERS[tier] for tier in tiers},
+            options['repeat'],
+            options['seed'],
+            options['concurrency'],
+            options['requests'],
+            options['scheduler_cards'],
+            options['ordering_cards'],
+            options['rollup_tag_sets']
+        )
+        dump_results(results, options['output'])
+
+        for tier, scenarios in results['tiers'].items():
+            for name, result in scenarios.items():
+                self.stdout.write(
+                    f'{tier:>5} {name:<45} {result["queries"]:>3} queries '
+                    f'{result["latency_ms"]["median"]:>9.2f} ms '
+                    f'{result["peak_memory_kb"]:>7} kB'
+                )
+
+        for tier, scenarios in results.get('load', {}).get('tiers', {}) \
+                .items():
+            for name, result in scenarios.items():
+                for mode in ('sync', 'async'):
+                    self.stdout.write(
+                        f'{tier:>5} {name:<45} {mode:>5} '
+                        f'{result[mode]["requests_per_second"]:>8.1f} req/s '
+                        f'{result[mode]["latency_ms"]["p95"]:>9.2f} ms p95'
+                    )
+
+        for name, result in results.get('scheduler', {}) \
+                .get('cards_per_second', {}).items():
+            self.stdout.write(
+                f'{name:<10} {result["schedule"]:>10} cards/s scheduled'
+                + (
+                    f' {result["review"]:>10} cards/s reviewed'
+                    if 'review' in result else ''
+                )
+            )
+
+        if 'ordering' in results:
+            self.stdout.write(
+                f'{"ordering":<10} '
+                f'{results["ordering"]["cards_per_second"]:>10} cards/s'
+            )
+
+        if 'rollup' in results:
+            self.stdout.write(
+                f'{"rollup":<10} '
+                f'{results["rollup"]["tag_sets_per_second"]:>10} tag sets/s'
+            )
+
+        failures = check_budgets(results)
+        if options['compare']:
+            with open(options['compare']) as f:
+                failures += compare_results(
+                    results,
+                    json.load(f),
+                    options['tolerance']
+                )
+        if failures:
+            for failure in failures:
+                self.stderr.write(failure)
+            raise CommandError(f'{len(failures)} benchmark regressions')
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Wrote the results to {options["output"]}'
+        ))
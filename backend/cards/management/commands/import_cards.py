@@ -0,0 +1,55 @@
+import json
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from cards.imports import IMPORT_CHUNK_SIZE, get_import_format, import_file
+
+
+class Command(BaseCommand):
+    help = 'Imports cards from a CSV, JSON Lines or Anki plain text file'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path')
+        parser.add_argument(
+            '--user',
+            required=True,
+            help='Username of the owner of the imported cards'
+        )
+        parser.add_argument(
+            '--format',
+            default=None,
+            help='csv, jsonl or anki, guessed from the extension if omitted'
+        )
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=IMPORT_CHUNK_SIZE,
+            help='Number of cards per transaction'
+        )
+
+    def handle(self, *args, **options):
+        try:
+            owner = get_user_model().objects.get(username=options['user'])
+        except get_user_model().DoesNotExist:
+            raise CommandError(f'no user named {options["user"]}')
+        try:
+            format = get_import_format(options['path'], options['format'])
+        except ValueError as e:
+            raise CommandError(str(e))
+        if options['chunk_size'] < 1:
+            raise CommandError('--chunk-size must be positive')
+
+        with open(options['path'], 'rb') as f:
+            for progress in import_file(
+                owner,
+                f,
+                format,
+                options['chunk_size']
+            ):
+                self.stdout.write(json.dumps(progress))
+
+        if 'error' in progress:
+            raise CommandError(progress['error'])
+        self.stdout.write(self.style.SUCCESS(
+            f'Imported {progress["cards"]} cards out of {progress["rows"]} '
+            f'rows, {progress["errors_total"]} rows skipped'
+        ))
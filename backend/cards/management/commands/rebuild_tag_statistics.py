@@ -0,0 +1,80 @@
+import datetime, pytz
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from cards.models import TagSet, TagSetStatistics
+from cards.stats import (
+    compact_due,
+    compute_tag_statistics,
+    rebuild_tag_statistics
+)
+
+
+class Command(BaseCommand):
+    help = 'Rebuilds the per-user tag set statistics from scratch'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--user',
+            action='append',
+            dest='users',
+            help='Only process the user with this username (repeatable)'
+        )
+        parser.add_argument(
+            '--check',
+            action='store_true',
+            help='Only report drift, exit with an error if there is any'
+        )
+
+    def handle(self, *args, **options):
+        users = get_user_model().objects.order_by('pk')
+        if options['users']:
+            users = users.filter(username__in=options['users'])
+
+        drifted = 0
+        for user in users:
+            drift = get_drift(user)
+            if drift:
+                drifted += 1
+                names = dict(TagSet.objects.filter(
+                    pk__in=drift
+                ).values_list('pk', 'name'))
+                for tag_set_id, (stored, computed) in sorted(
+                    drift.items(),
+                    key=lambda item: item[0] or 0
+                ):
+                    self.stdout.write(
+                        f'{user.username} [{names.get(tag_set_id, "")}]: '
+                        f'stored {stored}, computed {computed}'
+                    )
+
+            if not options['check']:
+                rebuild_tag_statistics(user)
+
+        if options['check'] and drifted:
+            raise CommandError(f'tag set statistics drifted for {drifted} users')
+
+        self.stdout.write(self.style.SUCCESS(
+            f'{"Checked" if options["check"] else "Rebuilt"} '
+            f'tag set statistics for {users.count()} users'
+        ))
+
+def get_drift(user):
+    # by tag set id, the rows were folded whenever they were last written
+    now = datetime.datetime.now(tz=pytz.UTC)
+    stored = {
+        row.tag_set_id: {
+            'total': row.total,
+            'due': compact_due(row.due, now)
+        }
+        for row in TagSetStatistics.objects.filter(owner=user)
+    }
+    computed = {
+        tag_set_id: {'total': totals['total'], 'due': totals['due']}
+        for tag_set_id, totals in compute_tag_statistics(user, now).items()
+    }
+
+    return {
+        tag_set_id: (stored.get(tag_set_id), computed.get(tag_set_id))
+        for tag_set_id in stored.keys() | computed.keys()
+        if stored.get(tag_set_id) != computed.get(tag_set_id)
+    }
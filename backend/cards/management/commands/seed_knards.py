@@ -0,0 +1,127 @@
+import time
+from django.core.management.base import BaseCommand, CommandError
+from cards.seeding import seed
+
+
+class Command(BaseCommand):
+    help = 'Populates the database with synthetic users, cards and reviews'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--users',
+            type=int,
+            default=1,
+            help='Number of users to create'
+        )
+        parser.add_argument(
+            '--cards',
+            type=int,
+            default=1000,
+            help='Number of cards per user'
+        )
+        parser.add_argument(
+            '--seed',
+            type=int,
+            default=0,
+            help='Seed of the generator, the same seed gives the same data'
+        )
+        parser.add_argument(
+            '--username-prefix',
+            default='seed',
+            help='Users are named <prefix>0, <prefix>1, ...'
+        )
+        parser.add_argument(
+            '--password',
+            default=None,
+            help='Password of the users, unusable if omitted'
+        )
+        parser.add_argument(
+            '--tags',
+            type=int,
+            default=50,
+            help='Number of tags shared by the users'
+        )
+        parser.add_argument(
+            '--tag-sets',
+            type=int,
+            default=30,
+            help='Number of distinct tag sets per user'
+        )
+        parser.add_argument(
+            '--max-tags-per-card',
+            type=int,
+            default=3
+        )
+        parser.add_argument(
+            '--series-ratio',
+            type=float,
+            default=0.3,
+            help='Probability that the next cards start a new series'
+        )
+        parser.add_argument(
+            '--max-series-length',
+            type=int,
+            default=10
+        )
+        parser.add_argument(
+            '--max-partials',
+            type=int,
+            default=4,
+            help='Maximum number of partials per card'
+        )
+        parser.add_argument(
+            '--reviewed-ratio',
+            type=float,
+            default=0.7,
+            help='Share of the cards with a review history'
+        )
+        parser.add_argument(
+            '--max-age-days',
+            type=int,
+            default=365,
+            help='Cards are created up to this many days ago'
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=5000,
+            help='Number of cards per bulk insert'
+        )
+
+    def handle(self, *args, **options):
+        if options['users'] < 1:
+            raise CommandError('there must be at least one user')
+        if options['cards'] < 0 or options['batch_size'] < 1:
+            raise CommandError('--cards and --batch-size must be positive')
+        if options['tags'] < options['max_tags_per_card']:
+            raise CommandError('--tags must be at least --max-tags-per-card')
+
+        started_at = time.monotonic()
+        def progress(user, card_ids):
+            self.stdout.write(
+                f'{user.username}: {len(card_ids)} cards '
+                f'({time.monotonic() - started_at:.1f}s)'
+            )
+
+        users = seed(
+            n_users=options['users'],
+            n_cards=options['cards'],
+            seed=options['seed'],
+            username_prefix=options['username_prefix'],
+            password=options['password'],
+            n_tags=options['tags'],
+            n_tag_sets=options['tag_sets'],
+            max_tags_per_card=options['max_tags_per_card'],
+            progress=progress,
+            series_ratio=options['series_ratio'],
+            max_series_length=options['max_series_length'],
+            max_partials=options['max_partials'],
+            reviewed_ratio=options['reviewed_ratio'],
+            max_age_days=options['max_age_days'],
+            batch_size=options['batch_size']
+        )
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Seeded {len(users)} users with {options["cards"]} cards each '
+            f'in {time.monotonic() - started_at:.1f}s'
+        ))
@@ -0,0 +1,81 @@
+# Generated by Django 5.2.18 on 2026-10-18 09:30
+
+import datetime
+import django.db.models.deletion
+from collections import Counter
+from django.conf import settings
+from django.db import migrations, models
+
+
+def get_due_bucket(last_revision_date, score):
+    due_at = (
+        last_revision_date + datetime.timedelta(days=score + 1)
+    ).astimezone(datetime.timezone.utc)
+    bucket = due_at.replace(minute=0, second=0, microsecond=0)
+    if bucket < due_at:
+        bucket += datetime.timedelta(hours=1)
+    return bucket.strftime('%Y-%m-%dT%H')
+
+def fill_tag_set_statistics(apps, schema_editor):
+    Card = apps.get_model('cards', 'Card')
+    CardScore = apps.get_model('cards', 'CardScore')
+    TagSetStatistics = apps.get_model('cards', 'TagSetStatistics')
+
+    scores = {
+        (score.card_id, score.owner_id): score
+        for score in CardScore.objects.all()
+    }
+    statistics = {}
+    for card in Card.objects.exclude(owner=None).prefetch_related('tags'):
+        score = scores.get((card.pk, card.owner_id))
+        tags_set_str = ', '.join(
+            tag.name for tag in sorted(card.tags.all(), key=lambda t: t.pk)
+        )
+        totals = statistics.setdefault(
+            (card.owner_id, tags_set_str),
+            {'total': 0, 'due': Counter()}
+        )
+        totals['total'] += 1
+        totals['due'][
+            get_due_bucket(score.last_revised_at, score.score)
+                if score else get_due_bucket(card.created_at, 0)
+        ] += 1
+
+    TagSetStatistics.objects.bulk_create([
+        TagSetStatistics(
+            owner_id=owner_id,
+            tags_set_str=tags_set_str,
+            total=totals['total'],
+            due=dict(totals['due'])
+        )
+        for (owner_id, tags_set_str), totals in statistics.items()
+    ], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cards', '0017_card_is_private'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TagSetStatistics',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('tags_set_str', models.TextField(blank=True)),
+                ('total', models.PositiveIntegerField(default=0)),
+                ('due', models.JSONField(default=dict)),
+                ('owner', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='tag_set_statistics', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name_plural': 'tag set statistics',
+                'unique_together': {('owner', 'tags_set_str')},
+            },
+        ),
+        migrations.RunPython(
+            fill_tag_set_statistics,
+            migrations.RunPython.noop
+        ),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 5.2.18 on 2026-10-18 09:32
+
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cards', '0018_tagsetstatistics'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='cardscore',
+            name='due_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AlterField(
+            model_name='cardscore',
+            name='last_revised_at',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.AddIndex(
+            model_name='cardscore',
+            index=models.Index(fields=['owner', 'due_at'], name='cardscore_owner_due_at_idx'),
+        ),
+    ]
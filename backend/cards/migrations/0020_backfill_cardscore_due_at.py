@@ -0,0 +1,42 @@
+import datetime
+from django.db import migrations, transaction
+
+BATCH_SIZE = 1000
+
+
+def backfill_due_at(apps, schema_editor):
+    CardScore = apps.get_model('cards', 'CardScore')
+    db_alias = schema_editor.connection.alias
+
+    # short transactions over pk ranges so that only one batch of rows is
+    # locked at a time
+    last_pk = 0
+    while True:
+        with transaction.atomic(using=db_alias):
+            batch = list(
+                CardScore.objects.using(db_alias)
+                    .filter(pk__gt=last_pk, due_at=None)
+                    .order_by('pk')
+                    .only('pk', 'score', 'last_revised_at')[:BATCH_SIZE]
+            )
+            if not batch:
+                break
+
+            for card_score in batch:
+                card_score.due_at = card_score.last_revised_at \
+                    + datetime.timedelta(days=card_score.score + 1)
+            CardScore.objects.using(db_alias).bulk_update(batch, ['due_at'])
+
+        last_pk = batch[-1].pk
+
+
+class Migration(migrations.Migration):
+    atomic = False
+
+    dependencies = [
+        ('cards', '0019_cardscore_due_at'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_due_at, migrations.RunPython.noop),
+    ]
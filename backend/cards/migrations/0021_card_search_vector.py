@@ -0,0 +1,31 @@
+# Generated by Django 5.2.18 on 2026-10-18 09:34
+
+import django.contrib.postgres.indexes
+import django.contrib.postgres.search
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cards', '0020_backfill_cardscore_due_at'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='card',
+            name='search_document',
+            field=models.TextField(blank=True, default=''),
+        ),
+        migrations.AddField(
+            model_name='card',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(blank=True, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='card',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['search_vector'], name='card_search_vector_idx'),
+        ),
+    ]
@@ -0,0 +1,82 @@
+from django.contrib.postgres.search import SearchVector
+from django.db import migrations, transaction
+from django.db.models import Value
+from django.db.models.functions import Coalesce
+
+BATCH_SIZE = 1000
+
+
+def get_content_text(content):
+    if isinstance(content, list):
+        return '\n'.join(
+            text for text in map(get_content_text, content) if text
+        )
+    if isinstance(content, dict):
+        if 'text' in content:
+            return content['text']
+        return ''.join(map(get_content_text, content.get('children', [])))
+    return ''
+
+def backfill_search_document(apps, schema_editor):
+    Card = apps.get_model('cards', 'Card')
+    CardPartial = apps.get_model('cards', 'CardPartial')
+    db_alias = schema_editor.connection.alias
+    is_postgresql = schema_editor.connection.vendor == 'postgresql'
+
+    last_pk = 0
+    while True:
+        with transaction.atomic(using=db_alias):
+            card_ids = list(
+                Card.objects.using(db_alias)
+                    .filter(pk__gt=last_pk)
+                    .order_by('pk')
+                    .values_list('pk', flat=True)[:BATCH_SIZE]
+            )
+            if not card_ids:
+                break
+
+            documents = {card_id: [] for card_id in card_ids}
+            for card_id, content in CardPartial.objects.using(db_alias) \
+                    .filter(card__in=card_ids) \
+                    .order_by('card', 'position') \
+                    .values_list('card', 'content'):
+                text = get_content_text(content)
+                if text:
+                    documents[card_id].append(text)
+
+            Card.objects.using(db_alias).bulk_update(
+                [
+                    Card(pk=card_id, search_document='\n'.join(texts))
+                    for card_id, texts in documents.items()
+                ],
+                ['search_document']
+            )
+            if is_postgresql:
+                Card.objects.using(db_alias).filter(pk__in=card_ids).update(
+                    search_vector=SearchVector(
+                        Coalesce('title', Value('')),
+                        weight='A',
+                        config='simple'
+                    ) + SearchVector(
+                        'search_document',
+                        weight='B',
+                        config='simple'
+                    )
+                )
+
+        last_pk = card_ids[-1]
+
+
+class Migration(migrations.Migration):
+    atomic = False
+
+    dependencies = [
+        ('cards', '0021_card_search_vector'),
+    ]
+
+    operations = [
+        migrations.RunPython(
+            backfill_search_document,
+            migrations.RunPython.noop
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 09:38
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cards', '0023_trigram_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='cardseries',
+            name='sparse_ordering',
+            field=models.BooleanField(default=False),
+        ),
+    ]
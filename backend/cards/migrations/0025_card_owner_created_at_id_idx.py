@@ -0,0 +1,19 @@
+# Generated by Django 5.2.18 on 2026-10-18 09:41
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cards', '0024_cardseries_sparse_ordering'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='card',
+            index=models.Index(fields=['owner', 'created_at', 'id'], name='card_owner_created_at_id_idx'),
+        ),
+    ]
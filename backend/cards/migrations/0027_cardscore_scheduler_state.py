@@ -0,0 +1,33 @@
+# Generated by Django 5.2.18 on 2026-10-18 10:29
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cards', '0026_contentversion'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='cardscore',
+            name='difficulty',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='cardscore',
+            name='repetitions',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='cardscore',
+            name='scheduler',
+            field=models.CharField(blank=True, default='', max_length=10),
+        ),
+        migrations.AddField(
+            model_name='cardscore',
+            name='stability',
+            field=models.FloatField(blank=True, null=True),
+        ),
+    ]
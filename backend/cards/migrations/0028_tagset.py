@@ -0,0 +1,33 @@
+# Generated by Django 5.2.18 on 2026-10-18 10:44
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cards', '0027_cardscore_scheduler_state'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TagSet',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.TextField(unique=True)),
+                ('name', models.TextField(blank=True)),
+                ('tags', models.ManyToManyField(related_name='tag_sets', to='cards.tag')),
+            ],
+        ),
+        migrations.AddField(
+            model_name='card',
+            name='tag_set',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='cards', to='cards.tagset'),
+        ),
+        migrations.AddField(
+            model_name='tagsetstatistics',
+            name='tag_set',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='statistics', to='cards.tagset'),
+        ),
+    ]
@@ -0,0 +1,87 @@
+from django.db import migrations, transaction
+
+BATCH_SIZE = 1000
+
+
+def backfill_tag_sets(apps, schema_editor):
+    Tag = apps.get_model('cards', 'Tag')
+    TagSet = apps.get_model('cards', 'TagSet')
+    Card = apps.get_model('cards', 'Card')
+    TagSetStatistics = apps.get_model('cards', 'TagSetStatistics')
+    db_alias = schema_editor.connection.alias
+
+    tag_names = dict(Tag.objects.using(db_alias).values_list('pk', 'name'))
+    # tag set ids by key, and by owner and name to carry the statistics
+    # over
+    tag_sets, owner_tag_sets = {}, {}
+
+    last_pk = 0
+    while True:
+        with transaction.atomic(using=db_alias):
+            cards = list(
+                Card.objects.using(db_alias)
+                    .filter(pk__gt=last_pk)
+                    .order_by('pk')
+                    .values_list('pk', 'owner')[:BATCH_SIZE]
+            )
+            if not cards:
+                break
+
+            tag_ids = {card_id: [] for card_id, _ in cards}
+            for card_id, tag_id in Card.tags.through.objects.using(db_alias) \
+                    .filter(card__in=tag_ids) \
+                    .order_by('card', 'tag') \
+                    .values_list('card', 'tag'):
+                tag_ids[card_id].append(tag_id)
+
+            updates = []
+            for card_id, owner_id in cards:
+                if not tag_ids[card_id]:
+                    continue
+                key = ','.join(map(str, tag_ids[card_id]))
+                name = ', '.join(tag_names[pk] for pk in tag_ids[card_id])
+                if key not in tag_sets:
+                    tag_set = TagSet.objects.using(db_alias).create(
+                        key=key,
+                        name=name
+                    )
+                    TagSet.tags.through.objects.using(db_alias).bulk_create([
+                        TagSet.tags.through(tagset_id=tag_set.pk, tag_id=pk)
+                        for pk in tag_ids[card_id]
+                    ])
+                    tag_sets[key] = tag_set.pk
+                owner_tag_sets.setdefault((owner_id, name), tag_sets[key])
+                updates.append(Card(pk=card_id, tag_set_id=tag_sets[key]))
+
+            Card.objects.using(db_alias).bulk_update(updates, ['tag_set'])
+
+        last_pk = cards[-1][0]
+
+    # the statistics were keyed by the names of the tag sets, rows that had
+    # drifted away from the cards are left to rebuild_tag_statistics
+    for statistics in TagSetStatistics.objects.using(db_alias) \
+            .exclude(tags_set_str='') \
+            .iterator():
+        tag_set_id = owner_tag_sets.get(
+            (statistics.owner_id, statistics.tags_set_str)
+        )
+        if tag_set_id is None:
+            statistics.delete()
+        else:
+            statistics.tag_set_id = tag_set_id
+            statistics.save(update_fields=['tag_set'])
+
+
+class Migration(migrations.Migration):
+    atomic = False
+
+    dependencies = [
+        ('cards', '0028_tagset'),
+    ]
+
+    operations = [
+        migrations.RunPython(
+            backfill_tag_sets,
+            migrations.RunPython.noop
+        ),
+    ]
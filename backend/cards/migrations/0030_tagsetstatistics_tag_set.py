@@ -0,0 +1,27 @@
+# Generated by Django 5.2.18 on 2026-10-18 10:44
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cards', '0029_backfill_tag_sets'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AlterUniqueTogether(
+            name='tagsetstatistics',
+            unique_together={('owner', 'tag_set')},
+        ),
+        migrations.AddConstraint(
+            model_name='tagsetstatistics',
+            constraint=models.UniqueConstraint(condition=models.Q(('tag_set', None)), fields=('owner',), name='tagsetstatistics_owner_untagged_uniq'),
+        ),
+        migrations.RemoveField(
+            model_name='tagsetstatistics',
+            name='tags_set_str',
+        ),
+    ]
@@ -0,0 +1,37 @@
+from django.db import migrations
+
+INDEX_NAME = 'cards_card_tags_tag_id_card_id_idx'
+
+
+def get_concurrently(schema_editor):
+    # postgres builds the index without locking the writes to the tags of
+    # the cards, which it can only do outside of a transaction
+    if schema_editor.connection.vendor == 'postgresql':
+        return 'CONCURRENTLY '
+    return ''
+
+def create_index(apps, schema_editor):
+    concurrently = get_concurrently(schema_editor)
+    schema_editor.execute(
+        f'CREATE INDEX {concurrently}{INDEX_NAME} '
+        'ON cards_card_tags (tag_id, card_id)'
+    )
+
+def drop_index(apps, schema_editor):
+    concurrently = get_concurrently(schema_editor)
+    schema_editor.execute(f'DROP INDEX {concurrently}IF EXISTS {INDEX_NAME}')
+
+
+class Migration(migrations.Migration):
+    # the tags of the cards are an auto-created table, so its index is
+    # created in plain SQL: the tag filters group the cards of some tags,
+    # which this index covers without reading the table
+    atomic = False
+
+    dependencies = [
+        ('cards', '0030_tagsetstatistics_tag_set'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_index, drop_index),
+    ]
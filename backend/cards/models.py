@@ -1,6 +1,10 @@
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVectorField
 from django.db import models
-from django.db.models import Q
+from django.db.models import Q, Exists, OuterRef
 from django.contrib.auth import get_user_model
+from django.utils import timezone
+from .scheduler import get_interval
 
 
 class CardSeries(models.Model):
@@ -16,6 +20,12 @@ class CardSeries(models.Model):
         related_name='card_series',
         on_delete=models.CASCADE
     )
+    # number the cards with gaps so that moving a card touches only itself
+    sparse_ordering = models.BooleanField(
+        default=False,
+        blank=False,
+        null=False
+    )
 
     def __str__(self):
         return self.name
@@ -35,6 +45,52 @@ class Tag(models.Model):
     def __str__(self):
         return self.name
 
+    class Meta:
+        indexes = [
+            GinIndex(
+                fields=['name'],
+                opclasses=['gin_trgm_ops'],
+                name='tag_name_trgm_idx'
+            )
+        ]
+
+
+class TagSet(models.Model):
+    # a distinct combination of tags, shared by all the cards with exactly
+    # these tags and maintained by cards.tagsets
+    key = models.TextField(
+        unique=True,
+        blank=False,
+        null=False
+    )
+    # the names of the tags by id, as shown in the statistics
+    name = models.TextField(
+        blank=True,
+        null=False
+    )
+    tags = models.ManyToManyField(Tag, related_name='tag_sets')
+
+    def __str__(self):
+        return self.name
+
+
+class CardQuerySet(models.QuerySet):
+    def due_for_revision(self, owner, now=None):
+        if now is None:
+            now = timezone.now()
+
+        # both branches are range scans: (owner, due_at) on the scores and
+        # (owner, created_at) on the cards that were never scored
+        scored = CardScore.objects.filter(card=OuterRef('pk'), owner=owner)
+        return self.filter(
+            Q(pk__in=CardScore.objects.due_for_revision(owner, now)
+                .values('card'))
+            | Q(
+                ~Exists(scored),
+                created_at__lte=now - get_interval(0)
+            )
+        )
+
 
 class Card(models.Model):
     card_series = models.ForeignKey(
@@ -55,6 +111,14 @@ class Card(models.Model):
         null=True
     )
     tags = models.ManyToManyField(Tag, blank=True)
+    # the set of the tags above, None without tags
+    tag_set = models.ForeignKey(
+        TagSet,
+        blank=True,
+        null=True,
+        related_name='cards',
+        on_delete=models.SET_NULL
+    )
     is_private = models.BooleanField(
         default=False,
         blank=False,
@@ -69,6 +133,18 @@ class Card(models.Model):
     )
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
+    # plain text of the card partials, maintained by cards.search
+    search_document = models.TextField(
+        default='',
+        blank=True,
+        null=False
+    )
+    search_vector = SearchVectorField(
+        blank=True,
+        null=True
+    )
+
+    objects = CardQuerySet.as_manager()
 
     def save(self, *args, **kwargs):
         # custom logic handlers
@@ -91,13 +167,26 @@ class Card(models.Model):
 
     @property
     def tags_set_str(self):
-        result = []
-        for tag in self.tags.all():
-            result.append(tag.name)
-        return ', '.join(result)
+        return self.tag_set.name if self.tag_set_id is not None else ''
 
     class Meta:
         ordering = ['pk']
+        indexes = [
+            # also serves the keyset pagination of the cards list
+            models.Index(
+                fields=['owner', 'created_at', 'id'],
+                name='card_owner_created_at_id_idx'
+            ),
+            GinIndex(
+                fields=['search_vector'],
+                name='card_search_vector_idx'
+            ),
+            GinIndex(
+                fields=['title'],
+                opclasses=['gin_trgm_ops'],
+                name='card_title_trgm_idx'
+            )
+        ]
         constraints = [
             models.UniqueConstraint(
                 fields=['card_series', 'n_in_series'],
@@ -130,6 +219,13 @@ class CardPartial(models.Model):
         ordering = ['position']
 
 
+class CardScoreQuerySet(models.QuerySet):
+    def due_for_revision(self, owner, now=None):
+        if now is None:
+            now = timezone.now()
+        return self.filter(owner=owner, due_at__lte=now)
+
+
 class CardScore(models.Model):
     card = models.ForeignKey(
         Card,
@@ -148,7 +244,96 @@ class CardScore(models.Model):
         blank=False,
         null=False
     )
-    last_revised_at = models.DateTimeField(auto_now=True)
+    last_revised_at = models.DateTimeField(default=timezone.now)
+    due_at = models.DateTimeField(
+        blank=True,
+        null=True
+    )
+    # the memory state of the card for the algorithm that scheduled it,
+    # see cards.scheduler
+    scheduler = models.CharField(
+        max_length=10,
+        blank=True,
+        null=False,
+        default=''
+    )
+    stability = models.FloatField(
+        blank=True,
+        null=True
+    )
+    difficulty = models.FloatField(
+        blank=True,
+        null=True
+    )
+    repetitions = models.PositiveIntegerField(
+        default=0,
+        blank=False,
+        null=False
+    )
+
+    objects = CardScoreQuerySet.as_manager()
+
+    class Meta:
+        unique_together = ('card', 'owner')
+        indexes = [
+            models.Index(
+                fields=['owner', 'due_at'],
+                name='cardscore_owner_due_at_idx'
+            )
+        ]
+
+class TagSetStatistics(models.Model):
+    owner = models.ForeignKey(
+        get_user_model(),
+        related_name='tag_set_statistics',
+        on_delete=models.CASCADE
+    )
+    # None for the cards without tags
+    tag_set = models.ForeignKey(
+        TagSet,
+        blank=True,
+        null=True,
+        related_name='statistics',
+        on_delete=models.CASCADE
+    )
+    total = models.PositiveIntegerField(
+        default=0,
+        blank=False,
+        null=False
+    )
+    # number of cards becoming due for revision, by hourly due date bucket
+    due = models.JSONField(default=dict)
+
+    @property
+    def tags_set_str(self):
+        return self.tag_set.name if self.tag_set_id is not None else ''
 
     class Meta:
-        unique_together = ('card', 'owner')
\ No newline at end of file
+        verbose_name_plural = 'tag set statistics'
+        unique_together = ('owner', 'tag_set')
+        constraints = [
+            # NULLs are distinct in the unique constraint above
+            models.UniqueConstraint(
+                fields=['owner'],
+                condition=Q(tag_set=None),
+                name='tagsetstatistics_owner_untagged_uniq'
+            )
+        ]
+
+
+class ContentVersion(models.Model):
+    # `user:<id>`, `card:<id>` or `tags`, see cards.versions
+    key = models.CharField(
+        max_length=50,
+        unique=True,
+        blank=False,
+        null=False
+    )
+    version = models.PositiveBigIntegerField(
+        default=0,
+        blank=False,
+        null=False
+    )
+
+    def __str__(self):
+        return f'{self.key} v{self.version}'
@@ -0,0 +1,125 @@
+import base64, binascii, json, uuid
+from django.db import transaction, IntegrityError
+from .caching import get_shared_cache
+from .models import CardScore
+from .scheduler import get_algorithm, review_card_scores
+from .stats import tracking_tag_statistics
+from .versions import user_key, bump_versions
+
+BULK_REVIEWS_LIMIT = 500
+UPSERT_ATTEMPTS = 3
+REVISION_SESSION_TIMEOUT = 60 * 60
+REVISION_SESSION_WINDOW = 10
+# the fields written by a review besides the score
+SCHEDULE_FIELDS = [
+    'last_revised_at',
+    'due_at',
+    'scheduler',
+    'stability',
+    'difficulty',
+    'repetitions'
+]
+
+
+def bulk_upsert_card_scores(owner, entries):
+    # the latest review of a card wins if it appears more than once
+    reviews = {}
+    for entry in sorted(entries, key=lambda entry: entry['reviewed_at']):
+        reviews[entry['card']] = entry
+
+    for attempt in range(UPSERT_ATTEMPTS):
+        try:
+            return upsert_card_scores(owner, reviews)
+        except IntegrityError:
+            # a concurrent request created some of the scores, the retry
+            # will pick them up as existing rows
+            if attempt == UPSERT_ATTEMPTS - 1:
+                raise
+
+def review_card_score(owner, card_score, score, reviewed_at):
+    # a single review, returns the fields of the new schedule
+    previous_score = card_score.score
+    card_score.score = score
+    review_card_scores(
+        get_algorithm(owner),
+        [card_score],
+        [previous_score],
+        [reviewed_at]
+    )
+    return {field: getattr(card_score, field) for field in SCHEDULE_FIELDS}
+
+def upsert_card_scores(owner, reviews):
+    with transaction.atomic(), tracking_tag_statistics(reviews):
+        existing = {
+            card_score.card_id: card_score
+            for card_score in CardScore.objects.select_for_update().filter(
+                owner=owner,
+                card__in=list(reviews)
+            )
+        }
+
+        card_scores, to_create, to_update = [], [], []
+        previous_scores = []
+        for card_id, review in reviews.items():
+            card_score = existing.get(card_id)
+            if card_score is None:
+                card_score = CardScore(card_id=card_id, owner=owner)
+                to_create.append(card_score)
+            else:
+                to_update.append(card_score)
+
+            previous_scores.append(card_score.score)
+            card_score.score = review['score']
+            card_scores.append(card_score)
+
+        # all the due dates at once
+        review_card_scores(
+            get_algorithm(owner),
+            card_scores,
+            previous_scores,
+            [review['reviewed_at'] for review in reviews.values()]
+        )
+
+        CardScore.objects.bulk_create(to_create)
+        CardScore.objects.bulk_update(to_update, ['score', *SCHEDULE_FIELDS])
+        bump_versions([user_key(owner.pk)])
+
+    return card_scores
+
+def encode_revision_session_cursor(session, offset, seed=None):
+    return base64.urlsafe_b64encode(json.dumps(
+        {'session': session, 'offset': offset, 'seed': seed}
+    ).encode()).decode()
+
+def decode_revision_session_cursor(cursor):
+    try:
+        data = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        # cursors from before the seeds have none
+        seed = data.get('seed', None)
+        return (
+            str(data['session']),
+            max(int(data['offset']), 0),
+            None if seed is None else int(seed)
+        )
+    except (binascii.Error, ValueError, TypeError, KeyError, AttributeError):
+        raise ValueError('invalid cursor')
+
+def get_revision_session_queue(owner, session, build_queue):
+    # the queue is computed once per session and then served window by
+    # window, so reviews submitted in between don't shift the windows. The
+    # windows may be requested from any worker, so the cache is shared
+    cache = get_shared_cache()
+    queue = None
+    if session is not None:
+        queue = cache.get(f'revision-session:{owner.pk}:{session}')
+
+    if queue is None:
+        session = uuid.uuid4().hex
+        queue = build_queue()
+        cache.set(
+            f'revision-session:{owner.pk}:{session}',
+            queue,
+            REVISION_SESSION_TIMEOUT
+        )
+
+    return session, queue
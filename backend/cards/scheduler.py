@@ -0,0 +1,331 @@
+import datetime
+import numpy as np
+from knards.schedulers import DEFAULT_SCHEDULER
+
+SECONDS_PER_DAY = 24 * 60 * 60
+
+# grades of a review, see get_grades
+AGAIN, HARD, GOOD, EASY = 1, 2, 3, 4
+
+
+def get_interval(score):
+    # a card is eligible for revision once more than `score` full days
+    # passed since it was last revised, i.e. score < days_passed
+    return datetime.timedelta(days=score + 1)
+
+def get_due_at(last_revised_at, score):
+    return last_revised_at + get_interval(score)
+
+def get_unscored_due_at(created_at):
+    # cards that were never revised are treated as scored 0 at creation
+    return get_due_at(created_at, 0)
+
+def get_grades(previous_scores, scores):
+    # the frontend moves the score along the fibonacci sequence: a step up
+    # is a good recall, a step down a hard one and anything lower a lapse
+    previous_scores = np.asarray(previous_scores, dtype=float)
+    scores = np.asarray(scores, dtype=float)
+    return np.select(
+        [
+            scores == 0,
+            scores * 2 < previous_scores,
+            scores < previous_scores
+        ],
+        [AGAIN, AGAIN, HARD],
+        default=GOOD
+    )
+
+def get_states(rows, scheduler):
+    """
+    The memory states of a batch of cards as one array per field, from
+    CardScore instances or dicts of their values. Cards that were never
+    reviewed (None) or were scheduled by another algorithm start over,
+    their stability and difficulty are NaN.
+    """
+    rows = [
+        row if row is None or isinstance(row, dict) else vars(row)
+        for row in rows
+    ]
+    current = [
+        row is not None and row['scheduler'] == scheduler
+        for row in rows
+    ]
+
+    def get_field(field, default):
+        # one list per field is faster than arrays of tuples, None is NaN
+        return np.array([
+            row[field] if is_current else default
+            for row, is_current in zip(rows, current)
+        ], dtype=float)
+
+    return {
+        'score': np.array(
+            [0 if row is None else row['score'] for row in rows],
+            dtype=float
+        ),
+        'stability': get_field('stability', None),
+        'difficulty': get_field('difficulty', None),
+        'repetitions': get_field('repetitions', 0).astype(int),
+    }
+
+class Algorithm:
+    """
+    Schedules a whole batch of cards at once. The states are those of
+    get_states and `elapsed_days` the days since the last revision of
+    every card.
+    """
+
+    name = None
+
+    def get_intervals(self, states):
+        # days from a revision to the next one
+        raise NotImplementedError
+
+    def get_weights(self, states, elapsed_days):
+        # priorities of the due cards in the revision queue
+        raise NotImplementedError
+
+    def review(self, states, grades, elapsed_days):
+        # the states after a review of every card
+        raise NotImplementedError
+
+
+class KnardsAlgorithm(Algorithm):
+    # the score is the interval in days, set by the frontend
+    name = 'knards'
+
+    def get_intervals(self, states):
+        return states['score'] + 1
+
+    def get_weights(self, states, elapsed_days):
+        return (
+            1000 * np.exp(-0.6 * states['score'])
+                + 18 * np.power(np.maximum(elapsed_days, 0), 0.7)
+        ).astype(int)
+
+    def review(self, states, grades, elapsed_days):
+        return {**states, 'repetitions': states['repetitions'] + 1}
+
+
+class SM2Algorithm(Algorithm):
+    # the stability is the interval and the difficulty the ease factor
+    name = 'sm2'
+    INITIAL_EASE = 2.5
+    MIN_EASE = 1.3
+    # qualities by grade, a lapse is below 3
+    QUALITIES = np.array([0, 1, 3, 4, 5])
+
+    def get_intervals(self, states):
+        return np.where(np.isnan(states['stability']), 1, states['stability'])
+
+    def get_weights(self, states, elapsed_days):
+        # 1000 when the card is exactly due, more the later it is
+        return (
+            1000 * np.maximum(elapsed_days, 0) / self.get_intervals(states)
+        ).astype(int)
+
+    def review(self, states, grades, elapsed_days):
+        quality = self.QUALITIES[grades]
+        ease = np.where(
+            np.isnan(states['difficulty']),
+            self.INITIAL_EASE,
+            states['difficulty']
+        )
+        repetitions = states['repetitions']
+        passed = quality >= 3
+
+        intervals = np.select(
+            [~passed, repetitions == 0, repetitions == 1],
+            [1, 1, 6],
+            default=np.round(self.get_intervals(states) * ease)
+        )
+        return {
+            **states,
+            'stability': intervals.astype(float),
+            # the ease factor only changes on passed reviews
+            'difficulty': np.where(
+                passed,
+                np.maximum(
+                    ease + 0.1
+                        - (5 - quality) * (0.08 + (5 - quality) * 0.02),
+                    self.MIN_EASE
+                ),
+                ease
+            ),
+            'repetitions': np.where(passed, repetitions + 1, 0),
+        }
+
+
+class FSRSAlgorithm(Algorithm):
+    # FSRS 4.5 with its default parameters: the stability is the number of
+    # days until the probability of recall drops to 90%, the difficulty is
+    # between 1 and 10
+    name = 'fsrs'
+    WEIGHTS = np.array([
+        0.4872, 1.4003, 3.7145, 13.8206, 5.1618, 1.2298, 0.8975, 0.031,
+        1.6474, 0.1367, 1.0461, 2.1072, 0.0793, 0.3246, 1.587, 0.2272,
+        2.8755
+    ])
+    DECAY = -0.5
+    FACTOR = 19 / 81
+    REQUEST_RETENTION = 0.9
+
+    def get_retrievability(self, stability, elapsed_days):
+        return np.power(
+            1 + self.FACTOR * np.maximum(elapsed_days, 0) / stability,
+            self.DECAY
+        )
+
+    def get_stability(self, states):
+        # never reviewed cards are taken as freshly learned
+        return np.where(
+            np.isnan(states['stability']),
+            self.WEIGHTS[GOOD - 1],
+            states['stability']
+        )
+
+    def get_initial_difficulty(self, grades):
+        return np.clip(
+            self.WEIGHTS[4] - (grades - GOOD) * self.WEIGHTS[5],
+            1,
+            10
+        )
+
+    def get_intervals(self, states):
+        return np.maximum(np.round(
+            self.get_stability(states) / self.FACTOR
+                * (self.REQUEST_RETENTION ** (1 / self.DECAY) - 1)
+        ), 1)
+
+    def get_weights(self, states, elapsed_days):
+        # the probability that the card was forgotten
+        return (1000 * (1 - self.get_retrievability(
+            self.get_stability(states),
+            elapsed_days
+        ))).astype(int)
+
+    def review(self, states, grades, elapsed_days):
+        w = self.WEIGHTS
+        new = np.isnan(states['stability'])
+        stability = np.where(new, 1, states['stability'])
+        difficulty = np.where(new, 1, states['difficulty'])
+        retrievability = self.get_retrievability(stability, elapsed_days)
+
+        recall_stability = stability * (
+            np.exp(w[8])
+                * (11 - difficulty)
+                * np.power(stability, -w[9])
+                * (np.exp(w[10] * (1 - retrievability)) - 1)
+                * np.where(grades == HARD, w[15], 1)
+                * np.where(grades == EASY, w[16], 1)
+            + 1
+        )
+        lapse_stability = w[11] \
+            * np.power(difficulty, -w[12]) \
+            * (np.power(stability + 1, w[13]) - 1) \
+            * np.exp(w[14] * (1 - retrievability))
+        next_difficulty = np.clip(
+            w[7] * self.get_initial_difficulty(GOOD)
+                + (1 - w[7]) * (difficulty - w[6] * (grades - GOOD)),
+            1,
+            10
+        )
+
+        return {
+            **states,
+            'stability': np.where(
+                new,
+                w[grades - 1],
+                np.where(grades == AGAIN, lapse_stability, recall_stability)
+            ),
+            'difficulty': np.where(
+                new,
+                self.get_initial_difficulty(grades),
+                next_difficulty
+            ),
+            'repetitions': states['repetitions'] + 1,
+        }
+
+
+ALGORITHMS = {
+    algorithm.name: algorithm
+    for algorithm in [KnardsAlgorithm(), SM2Algorithm(), FSRSAlgorithm()]
+}
+
+def get_algorithm(user):
+    return ALGORITHMS[getattr(user, 'scheduler', None) or DEFAULT_SCHEDULER]
+
+def get_revision_schedule(algorithm, rows, created_at, now):
+    """
+    Whether every card of a cardset is due for revision at `now` and its
+    weight in the revision queue. `rows` are the values of the CardScore
+    of every card, None if it was never revised.
+    """
+    states = get_states(rows, algorithm.name)
+    # the datetimes are compared and subtracted one by one, which is much
+    # cheaper than converting them to arrays
+    elapsed_days = np.array([
+        (now - (row['last_revised_at'] if row else moment)).days
+        for row, moment in zip(rows, created_at)
+    ], dtype=float)
+    # reviews store the due date, older scores are due after score + 1
+    # days and cards that were never revised the day after their creation
+    is_due = np.array([
+        row['due_at'] <= now if row and row['due_at'] else None
+        for row in rows
+    ], dtype=float)
+    eligible = np.where(
+        np.isnan(is_due),
+        elapsed_days > states['score'],
+        is_due == 1
+    )
+    return eligible, algorithm.get_weights(states, elapsed_days)
+
+def review_card_scores(algorithm, card_scores, previous_scores, reviewed_at):
+    """
+    Reschedules CardScore instances whose score was just set by a review at
+    `reviewed_at`, one moment per instance. The other fields are still
+    those of the previous review, `previous_scores` are the scores before
+    it.
+    """
+    if not card_scores:
+        return card_scores
+
+    states = get_states(
+        [None if card_score.pk is None else card_score
+            for card_score in card_scores],
+        algorithm.name
+    )
+    states['score'] = np.array(
+        [card_score.score for card_score in card_scores],
+        dtype=float
+    )
+    elapsed_days = np.array([
+        0 if card_score.pk is None else
+            (moment - card_score.last_revised_at).total_seconds()
+                / SECONDS_PER_DAY
+        for card_score, moment in zip(card_scores, reviewed_at)
+    ])
+
+    states = algorithm.review(
+        states,
+        get_grades(previous_scores, states['score']),
+        elapsed_days
+    )
+    intervals = algorithm.get_intervals(states)
+    for index, (card_score, moment) in enumerate(
+        zip(card_scores, reviewed_at)
+    ):
+        card_score.last_revised_at = moment
+        card_score.due_at = moment + datetime.timedelta(
+            days=float(intervals[index])
+        )
+        card_score.scheduler = algorithm.name
+        card_score.stability = None \
+            if np.isnan(states['stability'][index]) \
+            else float(states['stability'][index])
+        card_score.difficulty = None \
+            if np.isnan(states['difficulty'][index]) \
+            else float(states['difficulty'][index])
+        card_score.repetitions = int(states['repetitions'][index])
+    return card_scores
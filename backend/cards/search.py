@@ -0,0 +1,232 @@
+import re
+from collections import defaultdict
+from django.contrib.postgres.search import (
+    SearchQuery,
+    SearchRank,
+    SearchHeadline,
+    SearchVector,
+    TrigramSimilarity
+)
+from django.db import connections
+from django.db.models import F, Q, Value, Case, When, Count, IntegerField
+from django.db.models.functions import Coalesce, Concat
+from .models import Tag, Card, CardPartial
+
+SEARCH_CONFIG = 'simple'
+AUTOCOMPLETE_LIMIT = 10
+# same default as pg_trgm.similarity_threshold
+TRIGRAM_SIMILARITY_THRESHOLD = 0.3
+
+
+def is_postgresql(using='default'):
+    return connections[using].vendor == 'postgresql'
+
+def get_content_text(content):
+    # collects the text leaves of the Slate document, one line per block
+    if isinstance(content, list):
+        return '\n'.join(
+            text for text in map(get_content_text, content) if text
+        )
+    if isinstance(content, dict):
+        if 'text' in content:
+            return content['text']
+        return ''.join(map(get_content_text, content.get('children', [])))
+    return ''
+
+def get_search_vector():
+    return SearchVector(
+        Coalesce('title', Value('')),
+        weight='A',
+        config=SEARCH_CONFIG
+    ) + SearchVector('search_document', weight='B', config=SEARCH_CONFIG)
+
+def update_search_vectors(card_ids):
+    if is_postgresql():
+        Card.objects.filter(pk__in=card_ids).update(
+            search_vector=get_search_vector()
+        )
+
+def update_search_documents(card_ids):
+    documents = {card_id: [] for card_id in card_ids}
+    for card_id, content in CardPartial.objects.filter(
+        card__in=card_ids
+    ).order_by('card', 'position').values_list('card', 'content'):
+        text = get_content_text(content)
+        if text:
+            documents[card_id].append(text)
+
+    Card.objects.bulk_update(
+        [
+            Card(pk=card_id, search_document='\n'.join(texts))
+            for card_id, texts in documents.items()
+        ],
+        ['search_document'],
+        batch_size=1000
+    )
+    update_search_vectors(card_ids)
+
+def get_search_query(fulltext):
+    return SearchQuery(
+        fulltext,
+        search_type='websearch',
+        config=SEARCH_CONFIG
+    )
+
+def search_cardset(cardset, fulltext):
+    if not is_postgresql(cardset.db):
+        return cardset.filter(
+            Q(title__icontains=fulltext)
+            | Q(search_document__icontains=fulltext)
+        )
+
+    query = get_search_query(fulltext)
+    return cardset.filter(search_vector=query).annotate(
+        search_rank=SearchRank(F('search_vector'), query)
+    )
+
+def get_search_headlines(card_ids, fulltext):
+    # only run for the cards of the current page, ts_headline is expensive
+    if not is_postgresql():
+        return {
+            card_id: get_text_headline(
+                f'{title or ""}\n{search_document}',
+                fulltext
+            )
+            for card_id, title, search_document in Card.objects.filter(
+                pk__in=card_ids
+            ).values_list('pk', 'title', 'search_document')
+        }
+
+    return dict(
+        Card.objects.filter(pk__in=card_ids).annotate(
+            search_headline=SearchHeadline(
+                Concat(
+                    Coalesce('title', Value('')),
+                    Value('\n'),
+                    'search_document'
+                ),
+                get_search_query(fulltext),
+                config=SEARCH_CONFIG,
+                max_words=20,
+                min_words=5
+            )
+        ).values_list('pk', 'search_headline')
+    )
+
+def get_text_headline(text, fulltext, context=60):
+    start = text.lower().find(fulltext.lower())
+    if start == -1:
+        return text[:2 * context]
+    end = start + len(fulltext)
+    return (
+        text[max(start - context, 0):start]
+        + f'<b>{text[start:end]}</b>'
+        + text[end:end + context]
+    )
+
+def autocomplete_tags(owner, q, limit=AUTOCOMPLETE_LIMIT):
+    # only the tags used on the owner's cards, with their usage counts
+    tags = Tag.objects.filter(card__owner=owner) \
+        .annotate(usage_count=Count('card'))
+
+    if not is_postgresql(tags.db):
+        return TrigramIndex(
+            tags.values('id', 'name', 'usage_count'),
+            'name'
+        ).search(q, limit)
+
+    return list(
+        tags.filter(
+                # both operators can use the gin_trgm_ops index, a plain
+                # istartswith compares UPPER(name) and can't
+                Q(name__trigram_word_similar=q) | Q(name__trigram_similar=q)
+            )
+            .annotate(
+                is_prefix=get_is_prefix('name', q),
+                similarity=TrigramSimilarity('name', q)
+            )
+            .order_by('-is_prefix', '-similarity', '-usage_count', 'name')
+            .values('id', 'name', 'usage_count')[:limit]
+    )
+
+def autocomplete_titles(owner, q, limit=AUTOCOMPLETE_LIMIT):
+    titles = Card.objects.filter(owner=owner).exclude(title=None) \
+        .values('title') \
+        .annotate(usage_count=Count('id'))
+
+    if not is_postgresql(titles.db):
+        return TrigramIndex(titles, 'title').search(q, limit)
+
+    return list(
+        titles.filter(
+                Q(title__trigram_word_similar=q) | Q(title__trigram_similar=q)
+            )
+            .annotate(
+                is_prefix=get_is_prefix('title', q),
+                similarity=TrigramSimilarity('title', q)
+            )
+            .order_by('-is_prefix', '-similarity', '-usage_count', 'title')
+            .values('title', 'usage_count')[:limit]
+    )
+
+def get_is_prefix(field, q):
+    return Case(
+        When(**{f'{field}__istartswith': q}, then=Value(1)),
+        default=Value(0),
+        output_field=IntegerField()
+    )
+
+def get_trigrams(text):
+    # mirrors pg_trgm: lowercased words padded with two leading spaces and
+    # one trailing space
+    trigrams = set()
+    for word in re.findall(r'\w+', text.lower()):
+        word = f'  {word} '
+        trigrams.update(word[i:i + 3] for i in range(len(word) - 2))
+    return trigrams
+
+class TrigramIndex:
+    """
+    In-memory stand-in for a pg_trgm GIN index, used on databases without
+    the extension (e.g. SQLite in tests).
+    """
+
+    def __init__(self, entries, field):
+        self.entries = list(entries)
+        self.field = field
+        self.trigrams = [get_trigrams(entry[field]) for entry in self.entries]
+        self.postings = defaultdict(set)
+        for position, trigrams in enumerate(self.trigrams):
+            for trigram in trigrams:
+                self.postings[trigram].add(position)
+
+    def search(self, q, limit):
+        field = self.field
+        q_trigrams = get_trigrams(q)
+        candidates = {
+            position
+            for trigram in q_trigrams
+            for position in self.postings.get(trigram, ())
+        }
+        candidates.update(
+            position for position, entry in enumerate(self.entries)
+            if entry[field].lower().startswith(q.lower())
+        )
+
+        matches = []
+        for position in candidates:
+            entry = self.entries[position]
+            trigrams = self.trigrams[position]
+            union = len(q_trigrams | trigrams)
+            similarity = len(q_trigrams & trigrams) / union if union else 0
+            is_prefix = entry[field].lower().startswith(q.lower())
+            if is_prefix or similarity >= TRIGRAM_SIMILARITY_THRESHOLD:
+                matches.append((is_prefix, similarity, entry))
+
+        matches.sort(key=lambda match: (
+            -match[0],
+            -match[1],
+            -match[2]['usage_count'],
+            match[2][field]
+        ))
+        return [entry for _, _, entry in matches[:limit]]
@@ -0,0 +1,272 @@
+import datetime, pytz, random
+from contextlib import contextmanager
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.db import transaction
+from .models import CardSeries, Tag, Card, CardPartial, CardScore
+from .scheduler import get_due_at, get_unscored_due_at
+from .search import get_content_text, update_search_vectors
+from .stats import rebuild_tag_statistics
+from .tagsets import get_tag_set_key, get_or_create_tag_sets
+from .versions import TAGS_KEY, bump_versions
+
+WORDS = (
+    'array', 'async', 'branch', 'buffer', 'cache', 'class', 'closure',
+    'commit', 'cursor', 'decorator', 'deque', 'dict', 'django', 'docker',
+    'event', 'exception', 'fixture', 'function', 'generator', 'graph',
+    'hash', 'heap', 'index', 'iterator', 'join', 'kernel', 'lambda', 'list',
+    'lock', 'loop', 'merge', 'migration', 'module', 'mutex', 'object',
+    'pointer', 'postgres', 'process', 'python', 'query', 'queue', 'react',
+    'rebase', 'recursion', 'regex', 'schema', 'semaphore', 'set', 'signal',
+    'socket', 'sort', 'stack', 'string', 'thread', 'transaction', 'tree',
+    'tuple', 'type', 'vim', 'view'
+)
+
+
+@contextmanager
+def explicit_timestamps(model, *field_names):
+    # lets bulk_create keep the given values of auto_now(_add) fields
+    fields = [model._meta.get_field(name) for name in field_names]
+    flags = [(field.auto_now, field.auto_now_add) for field in fields]
+    for field in fields:
+        field.auto_now = field.auto_now_add = False
+    try:
+        yield
+    finally:
+        for field, (auto_now, auto_now_add) in zip(fields, flags):
+            field.auto_now, field.auto_now_add = auto_now, auto_now_add
+
+def get_words(rng, n):
+    return ' '.join(rng.choices(WORDS, k=n))
+
+def get_partial_content(rng, type):
+    # a few lines, every other one with a leaf to recall
+    blocks = []
+    for _ in range(rng.randint(1, 4)):
+        children = [{'text': get_words(rng, rng.randint(3, 12)) + ' '}]
+        if type == 'text' and rng.random() < 0.5:
+            children += [
+                {
+                    'text': get_words(rng, rng.randint(1, 3)),
+                    'insetQuestion': True
+                },
+                {'text': ' ' + get_words(rng, rng.randint(1, 6))}
+            ]
+        blocks.append({'type': type, 'children': children})
+    return blocks
+
+def get_card_partials(rng, max_partials):
+    card_partials = []
+    for position in range(1, rng.randint(1, max_partials) + 1):
+        type = 'code' if rng.random() < 0.2 else 'text'
+        is_prompt = position > 1 and rng.random() < 0.3
+        card_partials.append(CardPartial(
+            is_prompt=is_prompt,
+            content=get_partial_content(rng, type),
+            prompt_initial_content=[
+                {'type': type, 'children': [{'text': ''}]}
+            ],
+            position=position
+        ))
+    return card_partials
+
+def get_score_history(rng, created_at, now):
+    # replays reviews at roughly the due moments, the result is the last one
+    score, last_revised_at = None, None
+    due_at = get_unscored_due_at(created_at)
+    while due_at < now and rng.random() < 0.85:
+        last_revised_at = min(
+            due_at + datetime.timedelta(hours=rng.randint(0, 72)),
+            now
+        )
+        if score is None or rng.random() < 0.15:
+            score = rng.randint(0, 1)
+        else:
+            score = min(score + 1, 10)
+        due_at = get_due_at(last_revised_at, score)
+    return score, last_revised_at
+
+def get_tag_sets(rng, tags, n_tag_sets, max_tags_per_card):
+    tag_sets = [()]
+    while len(tag_sets) < n_tag_sets:
+        tag_sets.append(tuple(
+            rng.sample(tags, rng.randint(1, min(max_tags_per_card, len(tags))))
+        ))
+    return tag_sets
+
+def seed_tags(rng, n_tags):
+    names = [f'{word}-{index}' for index, word in enumerate(
+        rng.choice(WORDS) for _ in range(n_tags)
+    )]
+    Tag.objects.bulk_create(
+        [Tag(name=name) for name in names],
+        ignore_conflicts=True
+    )
+    bump_versions([TAGS_KEY])
+    return list(
+        Tag.objects.filter(name__in=names).order_by('pk').values_list(
+            'pk',
+            flat=True
+        )
+    )
+
+def seed_users(username_prefix, n_users, password=None):
+    User = get_user_model()
+    # hashing is slow, all the users share a single hash
+    password = make_password(password)
+    users = [
+        User(
+            username=f'{username_prefix}{index}',
+            email=f'{username_prefix}{index}@seed.knards.com',
+            password=password
+        )
+        for index in range(n_users)
+    ]
+    User.objects.bulk_create(users, ignore_conflicts=True)
+    return list(
+        User.objects.filter(
+            username__in=[user.username for user in users]
+        ).order_by('pk')
+    )
+
+def seed_cards(
+    rng,
+    owner,
+    n_cards,
+    tag_sets,
+    now,
+    series_ratio=0.3,
+    max_series_length=10,
+    max_partials=4,
+    reviewed_ratio=0.7,
+    max_age_days=365,
+    batch_size=5000
+):
+    """
+    Creates `n_cards` cards of `owner` in batches of bulk inserts, along with
+    their series, tags, partials and scores. Returns the ids of the cards.
+    """
+    # zipf-like, a few tag sets hold most of the cards
+    weights = [1 / (index + 1) for index in range(len(tag_sets))]
+    card_ids = []
+
+    while len(card_ids) < n_cards:
+        size = min(batch_size, n_cards - len(card_ids))
+
+        # (series, n_in_series) of the cards of the batch
+        positions = []
+        card_series = []
+        while len(positions) < size:
+            if rng.random() < series_ratio:
+                series = CardSeries(
+                    owner=owner,
+                    name=get_words(rng, rng.randint(1, 3)),
+                    sparse_ordering=rng.random() < 0.5
+                )
+                card_series.append(series)
+                step = 1024 if series.sparse_ordering else 1
+                length = rng.randint(2, max(max_series_length, 2))
+                positions += [
+                    (series, step * n) for n in range(1, length + 1)
+                ][:size - len(positions)]
+            else:
+                positions.append((None, 1))
+
+        cards, card_partials, card_tags, scores = [], [], [], []
+        for series, n_in_series in positions:
+            created_at = now - datetime.timedelta(
+                seconds=rng.randint(0, max_age_days * 24 * 60 * 60)
+            )
+            partials = get_card_partials(rng, max_partials)
+            cards.append(Card(
+                owner=owner,
+                card_series=series,
+                n_in_series=n_in_series,
+                title=get_words(rng, rng.randint(1, 4))[:50],
+                is_private=rng.random() < 0.1,
+                created_at=created_at,
+                updated_at=created_at,
+                search_document='\n'.join(
+                    text for text in (
+                        get_content_text(partial.content)
+                        for partial in partials
+                    ) if text
+                )
+            ))
+            card_partials.append(partials)
+            card_tags.append(rng.choices(tag_sets, weights)[0])
+            scores.append(
+                get_score_history(rng, created_at, now)
+                    if rng.random() < reviewed_ratio else (None, None)
+            )
+
+        with transaction.atomic(), explicit_timestamps(
+            Card,
+            'created_at',
+            'updated_at'
+        ):
+            CardSeries.objects.bulk_create(card_series)
+            card_tag_sets = get_or_create_tag_sets(card_tags)
+            for card, tag_ids in zip(cards, card_tags):
+                card.tag_set = card_tag_sets.get(get_tag_set_key(tag_ids))
+            Card.objects.bulk_create(cards)
+            Card.tags.through.objects.bulk_create([
+                Card.tags.through(card_id=card.pk, tag_id=tag_id)
+                for card, tag_ids in zip(cards, card_tags)
+                for tag_id in tag_ids
+            ])
+            for card, partials in zip(cards, card_partials):
+                for partial in partials:
+                    partial.card = card
+            CardPartial.objects.bulk_create([
+                partial for partials in card_partials for partial in partials
+            ])
+            CardScore.objects.bulk_create([
+                CardScore(
+                    card=card,
+                    owner=owner,
+                    score=score,
+                    last_revised_at=last_revised_at,
+                    due_at=get_due_at(last_revised_at, score)
+                )
+                for card, (score, last_revised_at) in zip(cards, scores)
+                if score is not None
+            ])
+            update_search_vectors([card.pk for card in cards])
+
+        card_ids += [card.pk for card in cards]
+
+    return card_ids
+
+def seed(
+    n_users=1,
+    n_cards=1000,
+    seed=0,
+    username_prefix='seed',
+    password=None,
+    n_tags=50,
+    n_tag_sets=30,
+    max_tags_per_card=3,
+    now=None,
+    progress=None,
+    **options
+):
+    """
+    Deterministically populates the database for load and scale testing.
+    The bulk inserts don't send any signals, so the tag set statistics and
+    search vectors are rebuilt explicitly.
+    """
+    if now is None:
+        now = datetime.datetime.now(tz=pytz.UTC)
+    rng = random.Random(seed)
+
+    tags = seed_tags(rng, n_tags)
+    users = seed_users(username_prefix, n_users, password)
+    for user in users:
+        tag_sets = get_tag_sets(rng, tags, n_tag_sets, max_tags_per_card)
+        card_ids = seed_cards(rng, user, n_cards, tag_sets, now, **options)
+        rebuild_tag_statistics(user)
+        if progress is not None:
+            progress(user, card_ids)
+
+    return users
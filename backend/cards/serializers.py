@@ -1,3 +1,4 @@
+from django.utils import timezone
 from rest_framework import serializers
 from .models import CardSeries, Tag, Card, CardPartial, CardScore
 
@@ -17,12 +18,31 @@ class TagSerializer(serializers.ModelSerializer):
 
 class CardSerializer(serializers.ModelSerializer):
     owner = serializers.ReadOnlyField(source='owner.username')
+    # only present when the cardset is filtered by `fulltext`
+    search_rank = serializers.FloatField(read_only=True)
 
     class Meta:
         model = Card
-        fields = '__all__'
+        exclude = ['search_document', 'search_vector']
         lookup_field = 'id'
 
+class CardBulkEntrySerializer(serializers.Serializer):
+    title = serializers.CharField(
+        max_length=50,
+        required=False,
+        allow_null=True,
+        allow_blank=True
+    )
+    tags = serializers.ListField(
+        child=serializers.IntegerField(),
+        required=False
+    )
+    is_private = serializers.BooleanField(required=False)
+
+    def validate_tags(self, value):
+        # a card has a tag once, repeated ids would break the bulk insert
+        return list(dict.fromkeys(value))
+
 class CardPartialSerializer(serializers.ModelSerializer):
     class Meta:
         model = CardPartial
@@ -35,4 +55,28 @@ class CardScoreSerializer(serializers.ModelSerializer):
     class Meta:
         model = CardScore
         fields = '__all__'
-        lookup_field = 'id'
\ No newline at end of file
+        read_only_fields = [
+            'last_revised_at',
+            'due_at',
+            'scheduler',
+            'stability',
+            'difficulty',
+            'repetitions'
+        ]
+        lookup_field = 'id'
+
+class CardScoreReviewSerializer(serializers.Serializer):
+    card = serializers.IntegerField()
+    score = serializers.IntegerField(min_value=0, max_value=32767)
+    reviewed_at = serializers.DateTimeField(required=False)
+
+    def validate(self, data):
+        # reviews can't come from the future
+        now = timezone.now()
+        data['reviewed_at'] = min(data.get('reviewed_at', now), now)
+        return data
+
+class CardScoreBulkResultSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = CardScore
+        fields = ['id', 'card', 'score', 'last_revised_at', 'due_at']
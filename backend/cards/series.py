@@ -0,0 +1,231 @@
+from django.db import transaction, IntegrityError
+from django.db.models import Case, When, Value, F, Max
+from .models import CardSeries, Card
+from .search import update_search_vectors
+from .stats import (
+    get_tag_statistics_contributions_by_ids,
+    apply_tag_statistics_changes
+)
+from .tagsets import get_tag_set_key, get_or_create_tag_sets
+from .versions import user_key, bump_versions
+
+# distance between neighbouring cards of a series with sparse ordering
+SERIES_GAP = 1024
+APPEND_ATTEMPTS = 3
+BULK_APPEND_LIMIT = 1000
+
+
+def get_series_step(card_series):
+    return SERIES_GAP if card_series.sparse_ordering else 1
+
+def renumber_cards(cards, card_ids, numbers):
+    # n_in_series is checked by unique_if_card_series_set after every row,
+    # so the cards are first moved out of the way to negative numbers.
+    # `cards` is the series the updates are limited to
+    if not card_ids:
+        return
+    cards = cards.filter(pk__in=card_ids)
+    cards.update(
+        n_in_series=Case(
+            *[
+                When(pk=card_id, then=Value(-number))
+                for card_id, number in zip(card_ids, numbers)
+            ]
+        )
+    )
+    cards.update(n_in_series=-F('n_in_series'))
+
+def lock_series(card_series_id):
+    return CardSeries.objects.select_for_update().get(pk=card_series_id)
+
+@transaction.atomic
+def reorder_cards_in_series(owner, card_ids):
+    if len(set(card_ids)) != len(card_ids):
+        raise ValueError('cards must not repeat')
+    # the series of the cards, locked in the same query
+    card_series = list(CardSeries.objects.select_for_update().filter(
+        pk__in=Card.objects.filter(pk__in=card_ids, owner=owner)
+            .values('card_series')
+    ))
+    if len(card_series) != 1:
+        raise ValueError('cards must belong to the same series')
+    card_series = card_series[0]
+
+    # every position is rewritten, so the cards must be the whole series
+    # and all of them the owner's
+    series_cards = Card.objects.filter(card_series=card_series)
+    owners = dict(series_cards.values_list('pk', 'owner'))
+    if set(owners) != set(card_ids) \
+            or set(owners.values()) != {owner.pk}:
+        raise ValueError('cards must be all the cards of the series')
+
+    step = get_series_step(card_series)
+    renumber_cards(
+        series_cards.filter(owner=owner),
+        card_ids,
+        [step * (index + 1) for index in range(len(card_ids))]
+    )
+    bump_versions([user_key(owner.pk)])
+
+def get_neighbour_numbers(card_series, after):
+    prev_n = 0 if after is None else after.n_in_series
+    next_n = Card.objects \
+        .filter(card_series=card_series, n_in_series__gt=prev_n) \
+        .order_by('n_in_series') \
+        .values_list('n_in_series', flat=True) \
+        .first()
+    return prev_n, next_n
+
+def insert_card(card_series, card, after):
+    # places a card that is not part of any series right after `after`
+    prev_n, next_n = get_neighbour_numbers(card_series, after)
+
+    if not card_series.sparse_ordering:
+        # shift the tail of the series by one to open a slot
+        tail = list(
+            Card.objects.filter(
+                card_series=card_series,
+                n_in_series__gt=prev_n
+            ).values_list('pk', 'n_in_series')
+        )
+        renumber_cards(
+            Card.objects.filter(card_series=card_series),
+            [card_id for card_id, _ in tail],
+            [n_in_series + 1 for _, n_in_series in tail]
+        )
+        n_in_series = prev_n + 1
+    elif next_n is None:
+        n_in_series = prev_n + SERIES_GAP
+    elif next_n - prev_n > 1:
+        n_in_series = (prev_n + next_n) // 2
+    else:
+        # no room left between the neighbours, spread the series out again
+        card_ids = list(
+            Card.objects.filter(card_series=card_series)
+                .order_by('n_in_series')
+                .values_list('pk', flat=True)
+        )
+        position = card_ids.index(after.pk) + 1 if after is not None else 0
+        numbers = [
+            SERIES_GAP * (index + 1) for index in range(len(card_ids) + 1)
+        ]
+        n_in_series = numbers.pop(position)
+        renumber_cards(
+            Card.objects.filter(card_series=card_series),
+            card_ids,
+            numbers
+        )
+
+    Card.objects.filter(pk=card.pk).update(
+        card_series=card_series,
+        n_in_series=n_in_series
+    )
+
+def remove_card(card):
+    # detach the card, the uniqueness of n_in_series only applies to cards
+    # in a series
+    Card.objects.filter(pk=card.pk).update(card_series=None)
+
+    if not card.card_series.sparse_ordering:
+        # close the hole left in a dense series
+        tail = list(
+            Card.objects.filter(
+                card_series=card.card_series,
+                n_in_series__gt=card.n_in_series
+            ).values_list('pk', 'n_in_series')
+        )
+        renumber_cards(
+            Card.objects.filter(card_series=card.card_series),
+            [card_id for card_id, _ in tail],
+            [n_in_series - 1 for _, n_in_series in tail]
+        )
+
+@transaction.atomic
+def move_card(card, card_series=None, after=None):
+    """
+    Moves the card right after `after` (or to the start) of `card_series`,
+    which defaults to the current series of the card.
+    """
+    if card_series is None:
+        card_series = card.card_series
+    if card_series is None:
+        raise ValueError('the card is not in a series')
+    if after is not None and after.card_series_id != card_series.pk:
+        raise ValueError('cards must belong to the same series')
+    if after is not None and after.pk == card.pk:
+        raise ValueError('a card can\'t be moved after itself')
+
+    # lock the series in a stable order to avoid deadlocks
+    for card_series_id in sorted(
+        {card_series.pk, card.card_series_id} - {None}
+    ):
+        lock_series(card_series_id)
+    card.refresh_from_db(fields=['card_series', 'n_in_series'])
+    if after is not None:
+        after.refresh_from_db(fields=['card_series', 'n_in_series'])
+
+    if card.card_series is not None:
+        remove_card(card)
+        if after is not None:
+            after.refresh_from_db(fields=['n_in_series'])
+    insert_card(card_series, card, after)
+    card.refresh_from_db(fields=['card_series', 'n_in_series'])
+    bump_versions([user_key(card.owner_id)])
+
+def get_next_n_in_series(card_series):
+    # callers must hold the series lock
+    last_n = Card.objects.filter(card_series=card_series) \
+        .aggregate(last_n=Max('n_in_series'))['last_n']
+    return (last_n or 0) + get_series_step(card_series)
+
+def append_to_series(card_series, append):
+    """
+    Calls `append(n_in_series, step)` with the first free number at the end
+    of the series, serialized with the other writers of the series.
+    """
+    for attempt in range(APPEND_ATTEMPTS):
+        try:
+            with transaction.atomic():
+                lock_series(card_series.pk)
+                return append(
+                    get_next_n_in_series(card_series),
+                    get_series_step(card_series)
+                )
+        except IntegrityError:
+            # someone renumbered the series without taking the lock
+            if attempt == APPEND_ATTEMPTS - 1:
+                raise
+
+def bulk_append_cards_to_series(owner, card_series, entries):
+    def append(n_in_series, step):
+        tag_sets = get_or_create_tag_sets(
+            entry.get('tags', []) for entry in entries
+        )
+        cards = Card.objects.bulk_create([
+            Card(
+                owner=owner,
+                card_series=card_series,
+                n_in_series=n_in_series + index * step,
+                title=entry.get('title', None),
+                is_private=entry.get('is_private', False),
+                tag_set=tag_sets.get(get_tag_set_key(entry.get('tags', [])))
+            )
+            for index, entry in enumerate(entries)
+        ])
+        Card.tags.through.objects.bulk_create([
+            Card.tags.through(card_id=card.pk, tag_id=tag_id)
+            for card, entry in zip(cards, entries)
+            for tag_id in entry.get('tags', [])
+        ])
+
+        # bulk inserts don't send the signals that maintain these
+        card_ids = [card.pk for card in cards]
+        apply_tag_statistics_changes(
+            {},
+            get_tag_statistics_contributions_by_ids(card_ids)
+        )
+        update_search_vectors(card_ids)
+        bump_versions([user_key(owner.pk)])
+        return cards
+
+    return append_to_series(card_series, append)
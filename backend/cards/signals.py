@@ -0,0 +1,197 @@
+from django.contrib.auth import get_user_model
+from django.db.models import QuerySet
+from django.db.models.signals import (
+    post_save,
+    pre_save,
+    pre_delete,
+    post_delete,
+    m2m_changed
+)
+from django.dispatch import receiver
+from .models import CardSeries, Tag, TagSet, Card, CardPartial, CardScore
+from .scheduler import get_due_at
+from .search import update_search_documents, update_search_vectors
+from .stats import (
+    get_tag_statistics_contributions_by_ids,
+    apply_tag_statistics_changes
+)
+from .tagsets import update_tag_sets, update_tag_set_names
+from .versions import TAGS_KEY, user_key, card_key, bump_versions
+
+
+def deleted_through(origin, model):
+    if isinstance(origin, QuerySet):
+        return origin.model is model
+    return isinstance(origin, model)
+
+@receiver(post_save, sender=Card)
+def card_created(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        apply_tag_statistics_changes(
+            {},
+            get_tag_statistics_contributions_by_ids([instance.pk])
+        )
+
+@receiver(post_save, sender=Card)
+def card_saved(sender, instance, raw=False, **kwargs):
+    # the title is a part of the search vector
+    if not raw:
+        update_search_vectors([instance.pk])
+
+@receiver(pre_delete, sender=Card)
+def card_pre_delete(sender, instance, origin=None, **kwargs):
+    # the statistics rows go away together with their owner
+    if deleted_through(origin, get_user_model()):
+        return
+    instance._tag_statistics_before \
+        = get_tag_statistics_contributions_by_ids([instance.pk])
+
+@receiver(post_delete, sender=Card)
+def card_post_delete(sender, instance, **kwargs):
+    before = getattr(instance, '_tag_statistics_before', None)
+    if before:
+        apply_tag_statistics_changes(before, {})
+
+@receiver(m2m_changed, sender=Card.tags.through)
+def card_tags_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if action.startswith('pre_'):
+        if reverse:
+            card_ids = pk_set if pk_set is not None \
+                else list(instance.card_set.values_list('pk', flat=True))
+        else:
+            card_ids = [instance.pk]
+        instance._tag_statistics_card_ids = card_ids
+        instance._tag_statistics_before \
+            = get_tag_statistics_contributions_by_ids(card_ids)
+    else:
+        update_tag_sets(instance._tag_statistics_card_ids)
+        apply_tag_statistics_changes(
+            instance._tag_statistics_before,
+            get_tag_statistics_contributions_by_ids(
+                instance._tag_statistics_card_ids
+            )
+        )
+
+@receiver(post_save, sender=CardPartial)
+def card_partial_saved(sender, instance, raw=False, **kwargs):
+    if not raw:
+        update_search_documents([instance.card_id])
+
+@receiver(post_delete, sender=CardPartial)
+def card_partial_deleted(sender, instance, origin=None, **kwargs):
+    if deleted_through(origin, CardPartial):
+        update_search_documents([instance.card_id])
+
+@receiver(post_save, sender=Tag)
+def tag_saved(sender, instance, created, raw=False, **kwargs):
+    if not created and not raw:
+        update_tag_set_names(instance)
+
+@receiver(pre_delete, sender=Tag)
+def tag_pre_delete(sender, instance, **kwargs):
+    # deleting a tag changes the tag set of all its cards
+    instance._tag_statistics_card_ids \
+        = list(instance.card_set.values_list('pk', flat=True))
+    instance._tag_statistics_before = get_tag_statistics_contributions_by_ids(
+        instance._tag_statistics_card_ids
+    )
+    instance._stale_tag_set_ids \
+        = list(instance.tag_sets.values_list('pk', flat=True))
+
+@receiver(post_delete, sender=Tag)
+def tag_post_delete(sender, instance, **kwargs):
+    update_tag_sets(instance._tag_statistics_card_ids)
+    apply_tag_statistics_changes(
+        instance._tag_statistics_before,
+        get_tag_statistics_contributions_by_ids(
+            instance._tag_statistics_card_ids
+        )
+    )
+    # no card is left in the sets that contained the tag
+    TagSet.objects.filter(pk__in=instance._stale_tag_set_ids).delete()
+
+@receiver(pre_save, sender=CardScore)
+def card_score_due_at_default(sender, instance, **kwargs):
+    # the due cards are looked up by due_at alone, so scores written outside
+    # of the reviews are due after score + 1 days like before the schedulers
+    if instance.due_at is None:
+        instance.due_at = get_due_at(instance.last_revised_at, instance.score)
+
+@receiver(pre_save, sender=CardScore)
+def card_score_pre_save(sender, instance, raw=False, **kwargs):
+    if not raw:
+        instance._tag_statistics_before \
+            = get_tag_statistics_contributions_by_ids([instance.card_id])
+
+@receiver(post_save, sender=CardScore)
+def card_score_post_save(sender, instance, raw=False, **kwargs):
+    if not raw:
+        apply_tag_statistics_changes(
+            instance._tag_statistics_before,
+            get_tag_statistics_contributions_by_ids([instance.card_id])
+        )
+
+@receiver(pre_delete, sender=CardScore)
+def card_score_pre_delete(sender, instance, origin=None, **kwargs):
+    # cascades from cards or users are accounted for by the card handlers
+    if not deleted_through(origin, CardScore):
+        return
+    instance._tag_statistics_before \
+        = get_tag_statistics_contributions_by_ids([instance.card_id])
+
+@receiver(post_delete, sender=CardScore)
+def card_score_post_delete(sender, instance, **kwargs):
+    before = getattr(instance, '_tag_statistics_before', None)
+    if before is not None:
+        apply_tag_statistics_changes(
+            before,
+            get_tag_statistics_contributions_by_ids([instance.card_id])
+        )
+
+# content versions behind the ETags of cards.versions
+
+@receiver(post_save, sender=CardSeries)
+@receiver(post_delete, sender=CardSeries)
+@receiver(post_save, sender=Card)
+@receiver(post_save, sender=CardScore)
+def owned_content_changed(sender, instance, raw=False, origin=None, **kwargs):
+    if raw or deleted_through(origin, get_user_model()):
+        return
+    bump_versions([user_key(instance.owner_id)])
+
+@receiver(post_delete, sender=Card)
+def card_deleted(sender, instance, origin=None, **kwargs):
+    if deleted_through(origin, get_user_model()):
+        return
+    bump_versions([user_key(instance.owner_id), card_key(instance.pk)])
+
+@receiver(post_delete, sender=CardScore)
+def card_score_deleted(sender, instance, origin=None, **kwargs):
+    if deleted_through(origin, CardScore):
+        bump_versions([user_key(instance.owner_id)])
+
+@receiver(m2m_changed, sender=Card.tags.through)
+def card_tags_versions_changed(sender, instance, action, **kwargs):
+    # the handler above has collected the affected cards in the pre_ phase
+    if action.startswith('post_'):
+        bump_versions([
+            user_key(owner_id) for owner_id in Card.objects.filter(
+                pk__in=instance._tag_statistics_card_ids
+            ).values_list('owner', flat=True).distinct()
+        ])
+
+@receiver(post_save, sender=CardPartial)
+@receiver(post_delete, sender=CardPartial)
+def card_partial_changed(sender, instance, raw=False, origin=None, **kwargs):
+    # cascades from cards are accounted for by the card handlers
+    if raw or origin is not None and not deleted_through(origin, CardPartial):
+        return
+    owner_id = Card.objects.filter(pk=instance.card_id) \
+        .values_list('owner', flat=True).first()
+    bump_versions([user_key(owner_id), card_key(instance.card_id)])
+
+@receiver(post_save, sender=Tag)
+@receiver(post_delete, sender=Tag)
+def tag_changed(sender, instance, raw=False, **kwargs):
+    if not raw:
+        bump_versions([TAGS_KEY])
@@ -0,0 +1,449 @@
+import datetime, pytz
+from collections import Counter, defaultdict
+from django.db import transaction
+from django.db.models import Count
+from .caching import get_or_compute, aget_or_compute, invalidate_statistics
+from .models import TagSet, Card, CardScore, TagSetStatistics
+from .scheduler import (
+    get_due_at,
+    get_unscored_due_at,
+    get_algorithm,
+    get_revision_schedule
+)
+
+DUE_BUCKET_FORMAT = '%Y-%m-%dT%H'
+SCORE_FIELDS = (
+    'id',
+    'card_id',
+    'score',
+    'last_revised_at',
+    'due_at',
+    'scheduler',
+    'stability',
+    'difficulty',
+    'repetitions'
+)
+
+
+def get_revision_cards(cardset, user, now):
+    # only the due cards are loaded, the others are only counted
+    return cardset.due_for_revision(user, now) \
+        .select_related('card_series', 'owner')
+
+def get_cardset_totals(cardset):
+    # the cards by tag set and series, counted by the database
+    return cardset.order_by() \
+        .values('tag_set', 'card_series') \
+        .annotate(total=Count('pk'))
+
+def get_cardset_tag_set_tags(cardset):
+    # the tags of the cards are those of their tag set
+    return TagSet.tags.through.objects \
+        .filter(tagset__in=cardset.values('tag_set')) \
+        .select_related('tag') \
+        .order_by('tag')
+
+def get_revision_queue_and_statistics(cardset, user, now=None):
+    if now is None:
+        now = datetime.datetime.now(tz=pytz.UTC)
+
+    cards = list(get_revision_cards(cardset, user, now))
+
+    # one query for all the scores instead of one per card
+    scores = CardScore.objects.filter(
+        owner=user,
+        card__in=[card.pk for card in cards]
+    ).values(*SCORE_FIELDS)
+
+    return build_revision_queue_and_statistics(
+        cards,
+        scores,
+        get_cardset_totals(cardset),
+        get_cardset_tag_set_tags(cardset),
+        get_algorithm(user),
+        now
+    )
+
+async def aget_revision_queue_and_statistics(cardset, user, now=None):
+    if now is None:
+        now = datetime.datetime.now(tz=pytz.UTC)
+
+    async def fetch(queryset):
+        return [obj async for obj in queryset]
+
+    # one after the other: the async ORM runs every query in the one thread
+    # of the request, gathering them would only queue them there
+    cards = await fetch(get_revision_cards(cardset, user, now))
+    scores = await fetch(CardScore.objects.filter(
+        owner=user,
+        card__in=[card.pk for card in cards]
+    ).values(*SCORE_FIELDS))
+    totals = await fetch(get_cardset_totals(cardset))
+    tag_set_tags = await fetch(get_cardset_tag_set_tags(cardset))
+
+    return build_revision_queue_and_statistics(
+        cards,
+        scores,
+        totals,
+        tag_set_tags,
+        get_algorithm(user),
+        now
+    )
+
+def build_revision_queue_and_statistics(
+    cards,
+    scores,
+    totals,
+    tag_set_tags,
+    algorithm,
+    now
+):
+    """
+    The revision queue of the due `cards` and the statistics of the whole
+    cardset. `totals` count the cards of the cardset by tag set and series
+    and `tag_set_tags` are the tags of their tag sets.
+    """
+    scores = {score['card_id']: score for score in scores}
+    rows = [scores.get(card.pk) for card in cards]
+    # the weight of every card, for the whole queue at once
+    _, weights = get_revision_schedule(
+        algorithm,
+        rows,
+        [card.created_at for card in cards],
+        now
+    )
+    weights = weights.tolist()
+
+    tags_by_tag_set = defaultdict(list)
+    for row in tag_set_tags:
+        tags_by_tag_set[row.tagset_id].append(row.tag)
+
+    # by tag set id
+    cards_total_by_tag_set = {}
+    series_total_cards_count = Counter()
+    for row in totals:
+        cards_total_by_tag_set.setdefault(
+            row['tag_set'],
+            {'total': 0, 'to_revise': 0}
+        )['total'] += row['total']
+        if row['card_series'] is not None:
+            series_total_cards_count[row['card_series']] += row['total']
+
+    queue = []
+    for card, score_obj, weight in zip(cards, rows, weights):
+        tags = tags_by_tag_set[card.tag_set_id]
+        queue.append({
+            'id': card.pk,
+            'title': card.title,
+            'series_id': card.card_series_id,
+            'series_name': card.card_series.name
+                if card.card_series else None,
+            'n_in_series': card.n_in_series,
+            'tags_ids': [tag.id for tag in tags],
+            'tags_names': [tag.name for tag in tags],
+            'created_at': int(card.created_at.timestamp() * 1000),
+            'owner_id': card.owner_id,
+            'owner_name': card.owner.username if card.owner else None,
+            'score_id': score_obj['id'] if score_obj else None,
+            'score': score_obj['score'] if score_obj else 0,
+            'weight': weight,
+        })
+        cards_total_by_tag_set[card.tag_set_id]['to_revise'] += 1
+
+    for card in queue:
+        if card['series_id']:
+            card['total_cards_in_series'] \
+                = series_total_cards_count[card['series_id']]
+
+    return (
+        queue,
+        rollup_cards_total_by_tags(cards_total_by_tag_set, tags_by_tag_set),
+        sum(totals['total'] for totals in cards_total_by_tag_set.values())
+    )
+
+def add_totals(cards_total_by_tags, key, totals):
+    # distinct tag sets share their name when tag names contain ', '
+    current = cards_total_by_tags.setdefault(key, dict.fromkeys(totals, 0))
+    for field, value in totals.items():
+        current[field] += value
+
+def rollup_cards_total_by_tags(cards_total_by_tag_set, tag_set_tags):
+    """
+    Keys the totals of every tag set by its name, plus the totals of every
+    tag shared by several tag sets by the tag name. `tag_set_tags` are the
+    tags of every tag set.
+    """
+    # a plain loop rather than bitmasks of the tags of the user: the masks
+    # would be cached under the same versions as these statistics, so every
+    # miss would build them again, which costs more than this loop
+    cards_total_by_tags = {}
+    tag_sets_by_tag = defaultdict(list)
+    for tag_set_id, totals in cards_total_by_tag_set.items():
+        tags = tag_set_tags[tag_set_id]
+        add_totals(cards_total_by_tags, get_tags_set_str(tags), totals)
+        for tag in tags:
+            tag_sets_by_tag[tag].append(tag_set_id)
+
+    # only the tags found in several tag sets
+    rollups = {}
+    for tag, tag_set_ids in tag_sets_by_tag.items():
+        if len(tag_set_ids) > 1:
+            for tag_set_id in tag_set_ids:
+                add_totals(
+                    rollups,
+                    tag.name,
+                    cards_total_by_tag_set[tag_set_id]
+                )
+    cards_total_by_tags.update(rollups)
+
+    return {k: cards_total_by_tags[k] for k in sorted(cards_total_by_tags)}
+
+def get_tags_set_str(tags):
+    return ', '.join(tag.name for tag in tags)
+
+def get_due_bucket(due_at):
+    # round the due moment up to the hour so that a card is never counted
+    # as due too early
+    due_at = due_at.astimezone(pytz.UTC)
+    bucket = due_at.replace(minute=0, second=0, microsecond=0)
+    if bucket < due_at:
+        bucket += datetime.timedelta(hours=1)
+    return bucket.strftime(DUE_BUCKET_FORMAT)
+
+def get_now_bucket(now):
+    return now.astimezone(pytz.UTC).strftime(DUE_BUCKET_FORMAT)
+
+def count_due(due, now):
+    now_bucket = get_now_bucket(now)
+    return sum(
+        count for bucket, count in due.items() if bucket <= now_bucket
+    )
+
+def compact_due(due, now):
+    # the buckets that passed are all counted as due, so they are folded
+    # into the bucket of the current hour and only the future ones are kept
+    now_bucket = get_now_bucket(now)
+    compacted = Counter()
+    for bucket, count in due.items():
+        compacted[max(bucket, now_bucket)] += count
+    return {bucket: count for bucket, count in compacted.items() if count > 0}
+
+def get_tag_statistics_contributions(cards):
+    # maps every card to the (owner, tag set id, due bucket) it is counted
+    # in
+    cards = list(cards.exclude(owner=None).values_list(
+        'pk',
+        'owner',
+        'tag_set',
+        'created_at'
+    ))
+    scores = {
+        (score['card_id'], score['owner_id']): score
+        for score in CardScore.objects.filter(
+            card__in=[card_id for card_id, _, _, _ in cards]
+        ).values('card_id', 'owner_id', 'score', 'last_revised_at', 'due_at')
+    }
+
+    contributions = {}
+    for card_id, owner_id, tag_set_id, created_at in cards:
+        score = scores.get((card_id, owner_id))
+        contributions[card_id] = (
+            owner_id,
+            tag_set_id,
+            get_due_bucket(
+                score['due_at']
+                    or get_due_at(score['last_revised_at'], score['score'])
+                if score else get_unscored_due_at(created_at)
+            )
+        )
+    return contributions
+
+def get_tag_statistics_contributions_by_ids(card_ids):
+    return get_tag_statistics_contributions(
+        Card.objects.filter(pk__in=card_ids)
+    )
+
+def apply_tag_statistics_changes(before, after, now=None):
+    if now is None:
+        now = datetime.datetime.now(tz=pytz.UTC)
+
+    changes = defaultdict(lambda: [0, Counter()])
+    for card_id in before.keys() | after.keys():
+        old, new = before.get(card_id), after.get(card_id)
+        if old == new:
+            continue
+        if old is not None:
+            owner_id, tag_set_id, bucket = old
+            changes[owner_id, tag_set_id][0] -= 1
+            changes[owner_id, tag_set_id][1][bucket] -= 1
+        if new is not None:
+            owner_id, tag_set_id, bucket = new
+            changes[owner_id, tag_set_id][0] += 1
+            changes[owner_id, tag_set_id][1][bucket] += 1
+
+    if not changes:
+        return
+
+    with transaction.atomic():
+        # rows locked in a stable order, the cards without tags first
+        for (owner_id, tag_set_id), (total, due) in sorted(
+            changes.items(),
+            key=lambda item: (item[0][0], item[0][1] or 0)
+        ):
+            statistics, _ = TagSetStatistics.objects \
+                .select_for_update() \
+                .get_or_create(owner_id=owner_id, tag_set_id=tag_set_id)
+            statistics.total += total
+            # a card leaving a past bucket was counted in the folded one,
+            # so the changes are folded together with the stored buckets
+            merged = Counter(statistics.due)
+            merged.update(due)
+            statistics.due = compact_due(merged, now)
+
+            if statistics.total > 0:
+                statistics.save()
+            else:
+                statistics.delete()
+
+class tracking_tag_statistics:
+    """
+    Keeps the tag set statistics of the given cards up to date across
+    operations that don't send model signals (bulk_create, update, ...).
+    """
+
+    def __init__(self, card_ids):
+        self.card_ids = list(card_ids)
+
+    def __enter__(self):
+        self.before = get_tag_statistics_contributions_by_ids(self.card_ids)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            apply_tag_statistics_changes(
+                self.before,
+                get_tag_statistics_contributions_by_ids(self.card_ids)
+            )
+
+def compute_tag_statistics(owner, now=None):
+    if now is None:
+        now = datetime.datetime.now(tz=pytz.UTC)
+
+    statistics = {}
+    contributions = get_tag_statistics_contributions(
+        Card.objects.filter(owner=owner)
+    )
+    for _, tag_set_id, bucket in contributions.values():
+        totals = statistics.setdefault(
+            tag_set_id,
+            {'total': 0, 'due': Counter()}
+        )
+        totals['total'] += 1
+        totals['due'][bucket] += 1
+    for totals in statistics.values():
+        totals['due'] = compact_due(totals['due'], now)
+    return statistics
+
+@transaction.atomic
+def rebuild_tag_statistics(owner):
+    statistics = compute_tag_statistics(owner)
+    TagSetStatistics.objects.filter(owner=owner).delete()
+    invalidate_statistics([owner.pk])
+    return TagSetStatistics.objects.bulk_create([
+        TagSetStatistics(
+            owner=owner,
+            tag_set_id=tag_set_id,
+            total=totals['total'],
+            due=totals['due']
+        )
+        for tag_set_id, totals in statistics.items()
+    ])
+
+def get_home_statistics(owner, now=None):
+    if now is None:
+        now = datetime.datetime.now(tz=pytz.UTC)
+
+    return summarize_home_statistics(
+        TagSetStatistics.objects.filter(owner=owner).select_related('tag_set'),
+        now
+    )
+
+async def aget_home_statistics(owner, now=None):
+    if now is None:
+        now = datetime.datetime.now(tz=pytz.UTC)
+
+    return summarize_home_statistics(
+        [
+            row async for row in TagSetStatistics.objects
+                .filter(owner=owner)
+                .select_related('tag_set')
+        ],
+        now
+    )
+
+def summarize_home_statistics(statistics, now):
+    cards_total_by_tags = {}
+    for row in statistics:
+        add_totals(cards_total_by_tags, row.tags_set_str, {
+            'total': row.total,
+            'to_revise': count_due(row.due, now)
+        })
+    return cards_total_by_tags
+
+def get_home_info(cards_total_by_tags):
+    recommendations = {}
+    for tags_set_str, obj in cards_total_by_tags.items():
+        if obj['to_revise'] > 0:
+            if obj['total'] / obj['to_revise'] > 1:
+                recommendations[obj['total'] / obj['to_revise']] \
+                    = tags_set_str
+
+    return {
+        'cards_total': sum(
+            obj['total'] for obj in cards_total_by_tags.values()
+        ),
+        'recommendations': list(
+            dict(sorted(recommendations.items())).values()
+        )
+    }
+
+def get_cached_home_statistics(owner, now=None):
+    if now is None:
+        now = datetime.datetime.now(tz=pytz.UTC)
+
+    # the statistics only change with writes and with the hourly due bucket
+    return get_or_compute(
+        'home_statistics',
+        owner.pk,
+        {'bucket': now.astimezone(pytz.UTC).strftime(DUE_BUCKET_FORMAT)},
+        lambda: get_home_statistics(owner, now)
+    )
+
+async def aget_cached_home_statistics(owner, now=None):
+    if now is None:
+        now = datetime.datetime.now(tz=pytz.UTC)
+
+    return await aget_or_compute(
+        'home_statistics',
+        owner.pk,
+        {'bucket': now.astimezone(pytz.UTC).strftime(DUE_BUCKET_FORMAT)},
+        lambda: aget_home_statistics(owner, now)
+    )
+
+def get_cached_revision_queue_and_statistics(cardset, user, params):
+    # `params` are whatever the cardset was filtered by, the weights also
+    # depend on the scheduler of the user
+    return get_or_compute(
+        'revision_queue',
+        user.pk,
+        {**params, 'scheduler': get_algorithm(user).name},
+        lambda: get_revision_queue_and_statistics(cardset, user)
+    )
+
+async def aget_cached_revision_queue_and_statistics(cardset, user, params):
+    return await aget_or_compute(
+        'revision_queue',
+        user.pk,
+        {**params, 'scheduler': get_algorithm(user).name},
+        lambda: aget_revision_queue_and_statistics(cardset, user)
+    )
@@ -0,0 +1,74 @@
+from .models import Tag, Card, TagSet
+
+
+def get_tag_set_key(tag_ids):
+    # the sorted ids, '' without tags
+    return ','.join(map(str, sorted(set(tag_ids))))
+
+def get_tag_set_name(tags):
+    # ordered by id like the cards always showed their tags
+    return ', '.join(tag.name for tag in sorted(tags, key=lambda tag: tag.pk))
+
+def get_or_create_tag_sets(tag_id_sets):
+    """
+    Maps the key of every given set of tag ids to its TagSet, created as
+    needed. Empty sets have no TagSet.
+    """
+    tag_id_sets = {
+        get_tag_set_key(tag_ids): sorted(set(tag_ids))
+        for tag_ids in tag_id_sets
+    }
+    tag_id_sets.pop('', None)
+    tag_sets = TagSet.objects.in_bulk(list(tag_id_sets), field_name='key')
+
+    missing = {
+        key: tag_ids for key, tag_ids in tag_id_sets.items()
+        if key not in tag_sets
+    }
+    if missing:
+        tags = Tag.objects.in_bulk({
+            tag_id for tag_ids in missing.values() for tag_id in tag_ids
+        })
+        # concurrent writes may create the same sets, whichever wins is
+        # looked up again
+        TagSet.objects.bulk_create([
+            TagSet(
+                key=key,
+                name=get_tag_set_name(tags[tag_id] for tag_id in tag_ids)
+            )
+            for key, tag_ids in missing.items()
+        ], ignore_conflicts=True)
+        created = TagSet.objects.in_bulk(list(missing), field_name='key')
+        TagSet.tags.through.objects.bulk_create([
+            TagSet.tags.through(tagset_id=created[key].pk, tag_id=tag_id)
+            for key, tag_ids in missing.items()
+            for tag_id in tag_ids
+        ], ignore_conflicts=True)
+        tag_sets.update(created)
+
+    return tag_sets
+
+def update_tag_sets(card_ids):
+    # the tags of the cards changed without them being saved
+    tag_ids = {card_id: [] for card_id in card_ids}
+    for card_id, tag_id in Card.tags.through.objects.filter(
+        card__in=card_ids
+    ).values_list('card', 'tag'):
+        tag_ids[card_id].append(tag_id)
+
+    tag_sets = get_or_create_tag_sets(tag_ids.values())
+    Card.objects.bulk_update(
+        [
+            Card(pk=card_id, tag_set=tag_sets.get(get_tag_set_key(ids)))
+            for card_id, ids in tag_ids.items()
+        ],
+        ['tag_set'],
+        batch_size=1000
+    )
+
+def update_tag_set_names(tag):
+    # the sets are keyed by id, so renaming a tag only changes their names
+    tag_sets = list(TagSet.objects.filter(tags=tag).prefetch_related('tags'))
+    for tag_set in tag_sets:
+        tag_set.name = get_tag_set_name(tag_set.tags.all())
+    TagSet.objects.bulk_update(tag_sets, ['name'], batch_size=1000)
@@ -1 +1,2043 @@
-from django.test import TestCase
\ No newline at end of file
+import datetime, io, json, os, pytz, random, tempfile, zipfile
+import numpy as np
+from io import StringIO
+from unittest import mock, skipUnless
+from asgiref.sync import iscoroutinefunction, sync_to_async
+from django.core.cache import cache
+from django.core.handlers.asgi import ASGIHandler
+from django.core.management import call_command, CommandError
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.http import QueryDict
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import OperationalError, connections
+from django.db.backends.signals import connection_created
+from rest_framework.test import APIClient
+from knards.instrumentation import InstrumentationMiddleware, get_fingerprint
+from knards.metrics import MetricsMiddleware
+from knards.pagination import TanstackKeysetPagination
+from knards.replicas import ReplicaRouter, get_read_alias, get_sticky_cache
+from knards.schedulers import SCHEDULER_CHOICES
+from .models import (
+    CardSeries,
+    Tag,
+    Card,
+    CardPartial,
+    CardScore,
+    TagSet,
+    TagSetStatistics
+)
+from .benchmarks import (
+    QUERY_BUDGETS,
+    is_benchmark_database,
+    get_results,
+    check_budgets,
+    run_load_benchmarks,
+    get_scheduler_rows,
+    get_loop_schedule,
+    run_scheduler_benchmarks,
+    run_ordering_benchmarks,
+    run_rollup_benchmarks
+)
+from .caching import (
+    get_shared_cache,
+    get_or_compute,
+    get_statistics_cache_key,
+    get_cache_counters,
+    reset_cache_counters
+)
+from .scheduler import (
+    AGAIN,
+    HARD,
+    GOOD,
+    ALGORITHMS,
+    get_grades,
+    get_states,
+    get_revision_schedule
+)
+from .search import get_content_text
+from .seeding import seed
+from .series import reorder_cards_in_series, move_card
+from .stats import count_due, tracking_tag_statistics
+from .tagsets import get_tag_set_key
+from .views import (
+    get_cardset_by_query_params,
+    cardset_randomize_and_group_by_weights_and_series
+)
+from .management.commands.rebuild_tag_statistics import get_drift
+
+
+def create_cards(owner, n, series=None, tags=(), days_ago=10):
+    created_at = datetime.datetime.now(tz=pytz.UTC) \
+        - datetime.timedelta(days=days_ago)
+    cards = []
+    for i in range(n):
+        card = Card.objects.create(
+            owner=owner,
+            title=f'card {i}',
+            card_series=series,
+            n_in_series=i + 1
+        )
+        card.tags.set(tags)
+        cards.append(card)
+    card_ids = [card.pk for card in cards]
+    with tracking_tag_statistics(card_ids):
+        Card.objects.filter(pk__in=card_ids).update(created_at=created_at)
+    return cards
+
+
+# the replicas are only read from in ReplicaTestCase
+@override_settings(REPLICA_DATABASES=[])
+class CardsTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = get_user_model().objects.create_user(
+            'user', 'user@knards.com', 'password'
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.tags = [
+            Tag.objects.create(name='python'),
+            Tag.objects.create(name='django')
+        ]
+
+
+class RevisionQueueTestCase(CardsTestCase):
+    url = '/api/cards/cards/get_cardset_and_statistics_by_query_params/'
+
+    def populate(self, n):
+        series = CardSeries.objects.create(name='series', owner=self.user)
+        create_cards(self.user, n, series=series, tags=self.tags[:1])
+        cards = create_cards(self.user, n, tags=self.tags)
+        for card in cards[:n // 2]:
+            CardScore.objects.create(card=card, owner=self.user, score=3)
+
+    def test_response_shape(self):
+        self.populate(4)
+
+        response = self.client.get(self.url)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['cards_total'], 8)
+        ids = [card['id'] for card in response.data['cardset']]
+        self.assertEqual(len(ids), 6)
+        self.assertEqual(len(set(ids)), 6)
+        self.assertEqual(response.data['cards_total_by_tags'], {
+            'python': {'total': 8, 'to_revise': 6},
+            'python, django': {'total': 4, 'to_revise': 2},
+        })
+        card = next(
+            card for card in response.data['cardset'] if card['series_id']
+        )
+        self.assertEqual(card['total_cards_in_series'], 4)
+        self.assertEqual(card['series_name'], 'series')
+        self.assertEqual(card['owner_name'], 'user')
+        self.assertEqual(card['weight'], int(1000 + 18 * 10 ** 0.7))
+
+    def test_scored_cards_are_not_due(self):
+        card = create_cards(self.user, 1)[0]
+        CardScore.objects.create(card=card, owner=self.user, score=5)
+
+        response = self.client.get(self.url)
+
+        self.assertEqual(response.data['cardset'], [])
+        self.assertEqual(
+            response.data['cards_total_by_tags'],
+            {'': {'total': 1, 'to_revise': 0}}
+        )
+
+    def test_query_count_does_not_grow_with_cardset(self):
+        # the content versions for the cache key, then the computation
+        self.populate(2)
+        with self.assertNumQueries(5):
+            self.client.get(self.url)
+
+        self.populate(20)
+        with self.assertNumQueries(5):
+            self.client.get(self.url)
+
+
+class TagSetStatisticsTestCase(CardsTestCase):
+    url = '/api/cards/cards/get_home_info/'
+
+    def test_statistics_follow_card_changes(self):
+        cards = create_cards(self.user, 3, tags=self.tags[:1])
+        self.assertEqual(get_drift(self.user), {})
+
+        cards[0].tags.add(self.tags[1])
+        self.tags[1].card_set.add(cards[1])
+        CardScore.objects.create(card=cards[2], owner=self.user, score=2)
+        self.assertEqual(get_drift(self.user), {})
+
+        score = CardScore.objects.get(card=cards[2])
+        score.score = 4
+        score.save()
+        cards[0].tags.clear()
+        self.tags[0].name = 'python3'
+        self.tags[0].save()
+        self.assertEqual(get_drift(self.user), {})
+
+        score.delete()
+        cards[1].delete()
+        self.tags[1].delete()
+        self.assertEqual(get_drift(self.user), {})
+        self.assertEqual(
+            sorted(
+                (row.tags_set_str, row.total)
+                for row in TagSetStatistics.objects.select_related('tag_set')
+            ),
+            [('', 1), ('python3', 1)]
+        )
+
+    def test_home_info_is_a_single_read(self):
+        create_cards(self.user, 4, tags=self.tags[:1])
+        create_cards(self.user, 2, tags=self.tags, days_ago=0)
+
+        with self.assertNumQueries(2):
+            response = self.client.get(self.url)
+        # cached after the first read
+        with self.assertNumQueries(1):
+            self.client.get(self.url)
+
+        self.assertEqual(response.data['cards_total'], 6)
+        self.assertEqual(list(response.data['recommendations']), [])
+
+    def test_rebuild_command_reports_and_fixes_drift(self):
+        create_cards(self.user, 2, tags=self.tags[:1])
+        TagSetStatistics.objects.filter(owner=self.user).update(total=5)
+
+        with self.assertRaises(CommandError):
+            call_command('rebuild_tag_statistics', check=True, stdout=StringIO())
+        call_command('rebuild_tag_statistics', stdout=StringIO())
+
+        self.assertEqual(get_drift(self.user), {})
+
+    def test_past_due_buckets_are_folded(self):
+        # cards that became due on 20 different days, and one that is not
+        # due yet
+        now = datetime.datetime.now(tz=pytz.UTC)
+        cards = create_cards(self.user, 20, tags=self.tags[:1], days_ago=0)
+        for days_ago, card in enumerate(cards, 2):
+            with tracking_tag_statistics([card.pk]):
+                Card.objects.filter(pk=card.pk).update(
+                    created_at=now - datetime.timedelta(days=days_ago)
+                )
+        create_cards(self.user, 1, tags=self.tags[:1], days_ago=0)
+
+        row = TagSetStatistics.objects.get(owner=self.user)
+        self.assertEqual(len(row.due), 2)
+        self.assertEqual(count_due(row.due, now), 20)
+        self.assertEqual(get_drift(self.user), {})
+
+
+class TagSetTestCase(CardsTestCase):
+    def assertTagSetsMatchTags(self, cards):
+        for card in Card.objects.filter(pk__in=[card.pk for card in cards]):
+            tag_ids = [tag.pk for tag in card.tags.all()]
+            self.assertEqual(
+                card.tag_set.key if card.tag_set else '',
+                get_tag_set_key(tag_ids)
+            )
+
+    def test_cards_share_their_tag_set(self):
+        cards = create_cards(self.user, 3, tags=self.tags)
+        self.assertEqual(TagSet.objects.count(), 1)
+        tag_set = TagSet.objects.get()
+        self.assertEqual(tag_set.name, 'python, django')
+        self.assertEqual(
+            {card.tag_set_id for card in Card.objects.all()},
+            {tag_set.pk}
+        )
+
+        cards[0].tags.remove(self.tags[1])
+        self.tags[1].card_set.remove(cards[1])
+        cards[2].tags.clear()
+        self.assertTagSetsMatchTags(cards)
+        self.assertEqual(TagSet.objects.count(), 2)
+
+        self.tags[0].name = 'python3'
+        self.tags[0].save()
+        self.assertEqual(
+            Card.objects.get(pk=cards[0].pk).tags_set_str,
+            'python3'
+        )
+
+        cards[2].tags.set(self.tags)
+        self.tags[0].delete()
+        self.assertTagSetsMatchTags(cards)
+        self.assertEqual(
+            list(TagSet.objects.values_list('name', flat=True)),
+            ['django']
+        )
+        self.assertEqual(get_drift(self.user), {})
+
+    def test_bulk_inserts_set_the_tag_sets(self):
+        user = seed(n_users=1, n_cards=30)[0]
+
+        self.assertTagSetsMatchTags(user.cards.all())
+        self.assertEqual(get_drift(user), {})
+
+    def test_tags_with_commas_are_not_split(self):
+        tag = Tag.objects.create(name='python, django')
+        create_cards(self.user, 2, tags=[tag])
+        create_cards(self.user, 1, tags=self.tags[:1])
+        create_cards(self.user, 1, tags=self.tags)
+
+        response = self.client.get(
+            '/api/cards/cards/get_cardset_and_statistics_by_query_params/'
+        )
+
+        self.assertEqual(response.data['cards_total_by_tags'], {
+            # both the tag and the tag set are named 'python, django'
+            'python, django': {'total': 3, 'to_revise': 3},
+            'python': {'total': 2, 'to_revise': 2},
+        })
+
+    def test_rollup_benchmark(self):
+        self.assertGreater(run_rollup_benchmarks(100, repeat=1), 0)
+
+
+class TagFilterTestCase(CardsTestCase):
+    url = '/api/cards/cards/get_cards_from_series/'
+
+    def setUp(self):
+        super().setUp()
+        self.tags.append(Tag.objects.create(name='rust'))
+        python, django, rust = self.tags
+        self.series = CardSeries.objects.create(
+            name='series',
+            owner=self.user
+        )
+        self.cards = {
+            'python': create_cards(self.user, 1, tags=[python])[0],
+            'django': create_cards(self.user, 1, tags=[django])[0],
+            'both': create_cards(self.user, 1, tags=[python, django])[0],
+            'all': create_cards(self.user, 1, tags=self.tags)[0],
+            'none': create_cards(self.user, 1)[0],
+            'series': create_cards(
+                self.user,
+                1,
+                series=self.series,
+                tags=[python]
+            )[0],
+        }
+        Card.objects.filter(pk=self.cards['both'].pk).update(is_private=True)
+
+    def get_names(self, params):
+        names = {card.pk: name for name, card in self.cards.items()}
+        response = self.client.get(self.url, params)
+        self.assertEqual(response.status_code, 200)
+        return sorted(names[card['id']] for card in response.data)
+
+    def get_tags(self, *names):
+        tags = {tag.name: tag.pk for tag in self.tags}
+        return ','.join(str(tags[name]) for name in names)
+
+    def test_tags(self):
+        python_or_django = self.get_tags('python', 'django')
+        self.assertEqual(
+            self.get_names({'tags': python_or_django}),
+            ['all', 'both', 'django', 'python', 'series']
+        )
+        self.assertEqual(
+            self.get_names({'tags': python_or_django, 'tag_inclusion': 'and'}),
+            ['all', 'both']
+        )
+        self.assertEqual(
+            self.get_names({
+                'tags': self.get_tags('python', 'python'),
+                'tag_inclusion': 'and'
+            }),
+            ['all', 'both', 'python', 'series']
+        )
+        self.assertEqual(
+            self.get_names({'exclude_tags': self.get_tags('django', 'rust')}),
+            ['none', 'python', 'series']
+        )
+        self.assertEqual(
+            self.get_names({
+                'tags': python_or_django,
+                'tag_inclusion': 'and',
+                'exclude_tags': self.get_tags('rust'),
+            }),
+            ['both']
+        )
+
+    def test_series_and_privacy(self):
+        python = self.get_tags('python')
+        self.assertEqual(
+            self.get_names({'tags': python, 'series': self.series.pk}),
+            ['series']
+        )
+        self.assertEqual(
+            self.get_names({'tags': python, 'is_private': 'true'}),
+            ['both']
+        )
+        self.assertEqual(
+            self.get_names({'tags': python, 'is_private': 'false'}),
+            ['all', 'python', 'series']
+        )
+
+    def test_many_tags_run_one_query(self):
+        tags = [Tag.objects.create(name=f'tag {i}') for i in range(12)]
+        card = create_cards(self.user, 1, tags=tags)[0]
+        create_cards(self.user, 1, tags=tags[:11])
+
+        for tag_inclusion in ('or', 'and'):
+            params = QueryDict(mutable=True)
+            params.update({
+                'tags': ','.join(str(tag.pk) for tag in tags),
+                'tag_inclusion': tag_inclusion,
+                'exclude_tags': self.get_tags('rust'),
+            })
+            with self.assertNumQueries(1):
+                cards = list(get_cardset_by_query_params(params, self.user))
+            self.assertEqual(len(cards), 2 if tag_inclusion == 'or' else 1)
+            self.assertIn(card, cards)
+
+    def test_invalid_params(self):
+        for params in [
+            {'tags': 'python'},
+            {'exclude_tags': '1,'},
+            {'tag_inclusion': 'xor'},
+            {'is_private': 'yes'},
+            {'series': 'abc'},
+            {'series': '1.5'},
+        ]:
+            response = self.client.get(self.url, params)
+            self.assertEqual(response.status_code, 400)
+            self.assertEqual(list(response.data), list(params))
+
+
+class DueAtTestCase(CardsTestCase):
+    url = '/api/cards/card-scores/'
+
+    def test_reviews_reschedule_the_card(self):
+        card = create_cards(self.user, 1)[0]
+        response = self.client.post(self.url, {'card': card.pk, 'score': 2})
+        self.assertEqual(response.status_code, 201)
+        score = CardScore.objects.get(pk=response.data['id'])
+        self.assertEqual(
+            score.due_at,
+            score.last_revised_at + datetime.timedelta(days=3)
+        )
+
+        # the frontend sends the score even when it doesn't change
+        CardScore.objects.filter(pk=score.pk).update(
+            last_revised_at=score.last_revised_at - datetime.timedelta(days=5)
+        )
+        response = self.client.patch(
+            f'{self.url}{score.pk}/',
+            {'score': 2},
+            format='json'
+        )
+        self.assertEqual(response.status_code, 200)
+        score.refresh_from_db()
+        self.assertEqual(score.repetitions, 2)
+        self.assertEqual(
+            score.due_at,
+            score.last_revised_at + datetime.timedelta(days=3)
+        )
+
+    def test_other_writes_keep_the_schedule(self):
+        card = create_cards(self.user, 1)[0]
+        score = CardScore.objects.create(card=card, owner=self.user, score=2)
+        # due like before the schedulers
+        due_at = score.last_revised_at + datetime.timedelta(days=3)
+        self.assertEqual(score.due_at, due_at)
+
+        score.score = 3
+        score.save()
+        score.refresh_from_db()
+        self.assertEqual(score.due_at, due_at)
+        self.assertEqual(score.repetitions, 0)
+
+    def test_due_for_revision(self):
+        old, scored_due, scored_not_due = create_cards(self.user, 3)
+        create_cards(self.user, 1, days_ago=0)
+        CardScore.objects.create(card=scored_due, owner=self.user, score=1)
+        CardScore.objects.create(card=scored_not_due, owner=self.user, score=1)
+        CardScore.objects.filter(card=scored_due).update(
+            due_at=datetime.datetime.now(tz=pytz.UTC)
+        )
+
+        due = Card.objects.filter(owner=self.user).due_for_revision(self.user)
+
+        self.assertEqual(
+            sorted(card.pk for card in due),
+            sorted([old.pk, scored_due.pk])
+        )
+        self.assertEqual(
+            CardScore.objects.due_for_revision(self.user).count(),
+            1
+        )
+
+
+def slate(*lines):
+    return [
+        {'type': 'paragraph', 'children': [{'text': line}]} for line in lines
+    ]
+
+
+class FullTextSearchTestCase(CardsTestCase):
+    url = '/api/cards/cards/'
+
+    def test_content_text(self):
+        content = slate('first line') + [{
+            'type': 'paragraph',
+            'children': [
+                {'text': 'the answer is '},
+                {'text': '42', 'insetQuestion': True}
+            ]
+        }]
+
+        self.assertEqual(
+            get_content_text(content),
+            'first line\nthe answer is 42'
+        )
+
+    def test_search_document_follows_partials(self):
+        card = create_cards(self.user, 1)[0]
+        partial = CardPartial.objects.create(
+            card=card,
+            content=slate('generators are lazy'),
+            prompt_initial_content=slate('')
+        )
+        card.refresh_from_db()
+        self.assertEqual(card.search_document, 'generators are lazy')
+
+        partial.delete()
+        card.refresh_from_db()
+        self.assertEqual(card.search_document, '')
+
+    def test_fulltext_filter(self):
+        cards = create_cards(self.user, 3)
+        CardPartial.objects.create(
+            card=cards[1],
+            content=slate('list comprehensions'),
+            prompt_initial_content=slate('')
+        )
+
+        response = self.client.get(self.url, {'fulltext': 'comprehension'})
+
+        self.assertEqual(
+            [card['id'] for card in response.data['results']],
+            [cards[1].pk]
+        )
+        self.assertIn(
+            '<b>comprehension</b>',
+            response.data['results'][0]['search_headline']
+        )
+
+
+class AutocompleteTestCase(CardsTestCase):
+    def test_tags_are_scoped_to_the_user(self):
+        other = get_user_model().objects.create_user(
+            'other', 'other@knards.com', 'password'
+        )
+        pytest_tag = Tag.objects.create(name='pytest')
+        create_cards(self.user, 2, tags=self.tags[:1])
+        create_cards(self.user, 1, tags=[pytest_tag])
+        create_cards(other, 1, tags=[Tag.objects.create(name='pypy')])
+
+        response = self.client.get('/api/cards/tags/autocomplete/', {'q': 'py'})
+
+        self.assertEqual(response.data, [
+            {'id': self.tags[0].pk, 'name': 'python', 'usage_count': 2},
+            {'id': pytest_tag.pk, 'name': 'pytest', 'usage_count': 1},
+        ])
+
+    def test_titles_match_typos(self):
+        card = create_cards(self.user, 1)[0]
+        card.title = 'decorators'
+        card.save()
+
+        response = self.client.get(
+            '/api/cards/cards/autocomplete_titles/',
+            {'q': 'decortors'}
+        )
+
+        self.assertEqual(
+            response.data,
+            [{'title': 'decorators', 'usage_count': 1}]
+        )
+
+
+class BulkReviewsTestCase(CardsTestCase):
+    url = '/api/cards/card-scores/bulk/'
+
+    def test_upserts_scores(self):
+        cards = create_cards(self.user, 3)
+        existing = CardScore.objects.create(
+            card=cards[0],
+            owner=self.user,
+            score=1
+        )
+        reviewed_at = datetime.datetime.now(tz=pytz.UTC) \
+            - datetime.timedelta(hours=1)
+
+        response = self.client.post(self.url, [
+            {'card': cards[0].pk, 'score': 2, 'reviewed_at': reviewed_at},
+            {'card': cards[1].pk, 'score': 0},
+            {'card': cards[2].pk, 'score': 1, 'reviewed_at': reviewed_at},
+        ], format='json')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(CardScore.objects.count(), 3)
+        self.assertEqual(response.data[0]['id'], existing.pk)
+        self.assertTrue(all(result['id'] for result in response.data))
+        score = CardScore.objects.get(card=cards[2])
+        self.assertEqual(score.last_revised_at, reviewed_at)
+        self.assertEqual(score.due_at, reviewed_at + datetime.timedelta(days=2))
+        self.assertEqual(get_drift(self.user), {})
+
+    def test_rejects_cards_of_other_users(self):
+        other = get_user_model().objects.create_user(
+            'other', 'other@knards.com', 'password'
+        )
+        card = create_cards(other, 1)[0]
+
+        response = self.client.post(
+            self.url,
+            [{'card': card.pk, 'score': 2}],
+            format='json'
+        )
+
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(CardScore.objects.exists())
+
+
+
+class SchedulerTestCase(CardsTestCase):
+    url = '/api/cards/card-scores/bulk/'
+
+    def review(self, algorithm, states, grades, elapsed_days):
+        states = algorithm.review(
+            states,
+            np.array(grades),
+            np.array(elapsed_days, dtype=float)
+        )
+        return states, algorithm.get_intervals(states).tolist()
+
+    def test_every_choice_has_an_algorithm(self):
+        self.assertEqual(
+            [name for name, _ in SCHEDULER_CHOICES],
+            list(ALGORITHMS)
+        )
+
+    def test_grades_follow_the_score_steps(self):
+        self.assertEqual(
+            get_grades([3, 3, 3, 3, 0], [5, 2, 1, 0, 1]).tolist(),
+            [GOOD, HARD, AGAIN, AGAIN, GOOD]
+        )
+
+    def test_knards_schedule_matches_the_loop(self):
+        now = datetime.datetime.now(tz=pytz.UTC)
+        rows, created_at = get_scheduler_rows(500, now)
+
+        eligible, weights = get_revision_schedule(
+            ALGORITHMS['knards'],
+            rows,
+            created_at,
+            now
+        )
+
+        self.assertEqual(
+            (eligible.tolist(), weights.tolist()),
+            get_loop_schedule(rows, created_at, now)
+        )
+
+    def test_sm2_intervals(self):
+        sm2 = ALGORITHMS['sm2']
+        states = get_states([None], 'sm2')
+        intervals = []
+        for _ in range(3):
+            states, [interval] = self.review(sm2, states, [GOOD], [0])
+            intervals.append(interval)
+        self.assertEqual(intervals, [1, 6, 15])
+
+        # a hard recall lowers the ease factor
+        states, _ = self.review(sm2, states, [HARD], [15])
+        ease = states['difficulty'].tolist()
+        self.assertLess(ease, [2.5])
+
+        # a lapse starts over and keeps the ease factor
+        states, intervals = self.review(sm2, states, [AGAIN], [15])
+        self.assertEqual(intervals, [1])
+        self.assertEqual(states['repetitions'].tolist(), [0])
+        self.assertEqual(states['difficulty'].tolist(), ease)
+
+    def test_fsrs_stability(self):
+        fsrs = ALGORITHMS['fsrs']
+        states, _ = self.review(fsrs, get_states([None], 'fsrs'), [GOOD], [0])
+        stability = states['stability'][0]
+
+        recalled, _ = self.review(fsrs, states, [GOOD], [stability])
+        forgotten, _ = self.review(fsrs, states, [AGAIN], [stability])
+        self.assertGreater(recalled['stability'][0], stability)
+        self.assertLess(forgotten['stability'][0], stability)
+        self.assertGreater(
+            forgotten['difficulty'][0],
+            recalled['difficulty'][0]
+        )
+
+    def test_users_choose_their_scheduler(self):
+        self.user.scheduler = 'sm2'
+        self.user.save()
+        response = self.client.get(f'/api/accounts/users/{self.user.pk}/')
+        self.assertEqual(response.data['scheduler'], 'sm2')
+        cards = create_cards(self.user, 2)
+        reviewed_at = datetime.datetime.now(tz=pytz.UTC) \
+            - datetime.timedelta(hours=1)
+
+        for score in (1, 2):
+            response = self.client.post(self.url, [
+                {'card': card.pk, 'score': score, 'reviewed_at': reviewed_at}
+                for card in cards
+            ], format='json')
+            self.assertEqual(response.status_code, 200)
+
+        score = CardScore.objects.get(card=cards[0])
+        self.assertEqual(score.scheduler, 'sm2')
+        self.assertEqual(score.repetitions, 2)
+        self.assertEqual(score.due_at, reviewed_at + datetime.timedelta(days=6))
+
+        # the scores of the previous scheduler start over
+        self.user.scheduler = 'knards'
+        self.user.save()
+        response = self.client.patch(
+            f'/api/cards/card-scores/{score.pk}/',
+            {'score': 3},
+            format='json'
+        )
+        self.assertEqual(response.status_code, 200)
+        score.refresh_from_db()
+        self.assertEqual(score.scheduler, 'knards')
+        self.assertEqual(score.repetitions, 1)
+        self.assertIsNone(score.stability)
+
+    def test_benchmark(self):
+        results = run_scheduler_benchmarks(50, repeat=1)
+
+        self.assertEqual(set(results), {'loop', *ALGORITHMS})
+        for name in ALGORITHMS:
+            self.assertGreater(results[name]['schedule'], 0)
+            self.assertGreater(results[name]['review'], 0)
+
+
+class RevisionSessionTestCase(CardsTestCase):
+    url = '/api/cards/cards/revision_session/'
+
+    def test_windows_come_with_partials(self):
+        cards = create_cards(self.user, 5)
+        for card in cards:
+            for position in (2, 1):
+                CardPartial.objects.create(
+                    card=card,
+                    position=position,
+                    content=slate(f'{card.pk}-{position}'),
+                    prompt_initial_content=slate('')
+                )
+
+        seen = []
+        response = self.client.get(self.url, {'limit': 2})
+        while True:
+            self.assertEqual(response.data['cards_total'], 5)
+            for card in response.data['cardset']:
+                seen.append(card['id'])
+                self.assertEqual(
+                    [partial['position'] for partial in card['card_partials']],
+                    [1, 2]
+                )
+            if not response.data['next']:
+                break
+            # reviews submitted mid-session don't shift the next window,
+            # even when it is served by a worker with another local cache
+            CardScore.objects.create(card_id=seen[-1], owner=self.user)
+            cache.clear()
+            response = self.client.get(
+                self.url,
+                {'limit': 2, 'cursor': response.data['next']}
+            )
+
+        self.assertEqual(sorted(seen), [card.pk for card in cards])
+
+    def test_invalid_cursor(self):
+        response = self.client.get(self.url, {'cursor': 'nope'})
+
+        self.assertEqual(response.status_code, 400)
+
+    def test_windows_hold_at_least_one_card(self):
+        cards = create_cards(self.user, 3)
+
+        for limit in (0, -2):
+            seen = []
+            response = self.client.get(self.url, {'limit': limit})
+            while True:
+                self.assertEqual(len(response.data['cardset']), 1)
+                seen += [card['id'] for card in response.data['cardset']]
+                if not response.data['next']:
+                    break
+                response = self.client.get(
+                    self.url,
+                    {'limit': limit, 'cursor': response.data['next']}
+                )
+
+            self.assertEqual(sorted(seen), [card.pk for card in cards])
+
+    def test_seeded_sessions_keep_their_order(self):
+        series = CardSeries.objects.create(name='series', owner=self.user)
+        create_cards(self.user, 3, series=series)
+        create_cards(self.user, 5)
+
+        def walk(params):
+            ids = []
+            response = self.client.get(self.url, params)
+            while True:
+                self.assertEqual(response.data['seed'], 7)
+                ids += [card['id'] for card in response.data['cardset']]
+                if not response.data['next']:
+                    return ids
+                # the session expires, the cursor still knows the order
+                get_shared_cache().clear()
+                response = self.client.get(
+                    self.url,
+                    {'limit': 3, 'cursor': response.data['next']}
+                )
+
+        order = walk({'limit': 3, 'seed': 7})
+        self.assertEqual(len(set(order)), 8)
+        self.assertEqual(walk({'limit': 8, 'seed': 7}), order)
+
+
+class OrderingTestCase(CardsTestCase):
+    def get_queue(self, rng):
+        # few weights and short series so that both collide a lot
+        queue = []
+        for index in range(rng.randint(0, 30)):
+            queue.append({
+                'id': index,
+                'series_id': rng.choice([None, None, 1, 2, 3]),
+                'weight': rng.choice([1, 2, 3]),
+            })
+        return queue
+
+    def test_grouping_rules(self):
+        rng = random.Random(0)
+        for seed in range(300):
+            queue = self.get_queue(rng)
+            ordered = cardset_randomize_and_group_by_weights_and_series(
+                queue,
+                seed
+            )
+
+            # every card exactly once
+            self.assertEqual(
+                sorted(card['id'] for card in ordered),
+                [card['id'] for card in queue]
+            )
+
+            # series are kept together in their queue order and every
+            # block lands with the heaviest of its cards
+            blocks = []
+            for card in ordered:
+                if card['series_id'] is not None and blocks \
+                        and blocks[-1][0] == card['series_id']:
+                    blocks[-1][1].append(card)
+                else:
+                    blocks.append((card['series_id'], [card]))
+            series_ids = [
+                series_id for series_id, _ in blocks if series_id is not None
+            ]
+            self.assertEqual(len(series_ids), len(set(series_ids)))
+            for series_id, cards in blocks:
+                if series_id is not None:
+                    self.assertEqual(cards, [
+                        card for card in queue
+                        if card['series_id'] == series_id
+                    ])
+            weights = [
+                max(card['weight'] for card in cards) for _, cards in blocks
+            ]
+            self.assertEqual(weights, sorted(weights, reverse=True))
+
+    def test_standalone_cards_are_not_repeated(self):
+        queue = [
+            {'id': 1, 'series_id': None, 'weight': 1},
+            {'id': 2, 'series_id': 1, 'weight': 1},
+            {'id': 3, 'series_id': 1, 'weight': 2},
+        ]
+        for seed in range(20):
+            self.assertEqual(
+                [card['id'] for card in
+                    cardset_randomize_and_group_by_weights_and_series(
+                        queue,
+                        seed
+                    )],
+                [2, 3, 1]
+            )
+
+    def test_seeds(self):
+        queue = self.get_queue(random.Random(1))
+        orders = {
+            tuple(card['id'] for card in
+                cardset_randomize_and_group_by_weights_and_series(
+                    queue,
+                    seed
+                ))
+            for seed in range(10)
+        }
+        self.assertGreater(len(orders), 1)
+        self.assertEqual(
+            cardset_randomize_and_group_by_weights_and_series(queue, 3),
+            cardset_randomize_and_group_by_weights_and_series(queue, 3)
+        )
+
+    def test_invalid_seed(self):
+        response = self.client.get(
+            '/api/cards/cards/get_cardset_and_statistics_by_query_params/',
+            {'seed': 'nope'}
+        )
+
+        self.assertEqual(response.status_code, 400)
+
+    def test_benchmark(self):
+        self.assertGreater(run_ordering_benchmarks(100, repeat=1), 0)
+
+
+class SeriesOrderingTestCase(CardsTestCase):
+    def create_series(self, n, sparse_ordering=False):
+        card_series = CardSeries.objects.create(
+            name='series',
+            owner=self.user,
+            sparse_ordering=sparse_ordering
+        )
+        return card_series, create_cards(self.user, n, series=card_series)
+
+    def get_order(self, card_series):
+        return list(
+            Card.objects.filter(card_series=card_series)
+                .order_by('n_in_series')
+                .values_list('pk', flat=True)
+        )
+
+    def test_reorder_runs_a_constant_number_of_queries(self):
+        for n in (3, 30):
+            _, cards = self.create_series(n)
+            cards.reverse()
+
+            # savepoint, select, lock, 2 updates, version bump, release
+            with self.assertNumQueries(8):
+                response = self.client.post(
+                    '/api/cards/cards/reorder_cards_in_series/',
+                    {'cards_from_series': [
+                        {'id': card.pk, 'n_in_series': index}
+                        for index, card in enumerate(cards)
+                    ]},
+                    format='json'
+                )
+
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(
+                list(
+                    Card.objects.filter(pk__in=[card.pk for card in cards])
+                        .order_by('n_in_series')
+                        .values_list('pk', 'n_in_series')
+                ),
+                [(card.pk, index + 1) for index, card in enumerate(cards)]
+            )
+
+    def test_reorder_needs_the_whole_series_of_the_owner(self):
+        card_series, cards = self.create_series(3)
+        other = get_user_model().objects.create_user(
+            'other', 'other@knards.com', 'password'
+        )
+        other_series = CardSeries.objects.create(name='other', owner=other)
+        other_cards = create_cards(other, 3, series=other_series)
+        before = dict(Card.objects.values_list('pk', 'n_in_series'))
+
+        for card_ids in [
+            # a part of a dense series
+            [cards[1].pk, cards[0].pk],
+            # the cards of another user are not the series of the owner
+            [cards[2].pk, cards[1].pk, cards[0].pk, other_cards[2].pk],
+            [other_cards[2].pk, other_cards[1].pk, other_cards[0].pk],
+        ]:
+            response = self.client.post(
+                '/api/cards/cards/reorder_cards_in_series/',
+                {'cards_from_series': [
+                    {'id': card_id, 'n_in_series': index}
+                    for index, card_id in enumerate(card_ids)
+                ]},
+                format='json'
+            )
+            self.assertEqual(response.status_code, 400)
+
+        self.assertEqual(
+            dict(Card.objects.values_list('pk', 'n_in_series')),
+            before
+        )
+
+    def test_move_within_dense_series(self):
+        card_series, cards = self.create_series(4)
+
+        response = self.client.post(
+            f'/api/cards/cards/{cards[0].pk}/move/',
+            {'after': cards[2].pk},
+            format='json'
+        )
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            self.get_order(card_series),
+            [cards[1].pk, cards[2].pk, cards[0].pk, cards[3].pk]
+        )
+        self.assertEqual(
+            sorted(Card.objects.values_list('n_in_series', flat=True)),
+            [1, 2, 3, 4]
+        )
+
+    def test_move_within_sparse_series_touches_one_card(self):
+        card_series, cards = self.create_series(4, sparse_ordering=True)
+        reorder_cards_in_series(self.user, [card.pk for card in cards])
+        before = dict(Card.objects.values_list('pk', 'n_in_series'))
+
+        move_card(cards[3], after=cards[0])
+
+        after = dict(Card.objects.values_list('pk', 'n_in_series'))
+        self.assertEqual(
+            [pk for pk in before if before[pk] != after[pk]],
+            [cards[3].pk]
+        )
+        self.assertEqual(
+            self.get_order(card_series),
+            [cards[0].pk, cards[3].pk, cards[1].pk, cards[2].pk]
+        )
+
+    def test_sparse_series_is_spread_out_when_full(self):
+        card_series, cards = self.create_series(3, sparse_ordering=True)
+
+        move_card(cards[2], after=cards[0])
+
+        self.assertEqual(
+            self.get_order(card_series),
+            [cards[0].pk, cards[2].pk, cards[1].pk]
+        )
+        self.assertEqual(
+            sorted(Card.objects.values_list('n_in_series', flat=True)),
+            [1024, 2048, 3072]
+        )
+
+    def test_move_to_another_series(self):
+        source, cards = self.create_series(3)
+        target = CardSeries.objects.create(name='target', owner=self.user)
+        target_card = Card.objects.create(
+            owner=self.user,
+            card_series=target,
+            n_in_series=1
+        )
+
+        response = self.client.post(
+            f'/api/cards/cards/{cards[0].pk}/move/',
+            {'card_series': target.pk},
+            format='json'
+        )
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.get_order(source), [cards[1].pk, cards[2].pk])
+        self.assertEqual(self.get_order(target), [cards[0].pk, target_card.pk])
+        self.assertEqual(
+            list(Card.objects.filter(card_series=source)
+                .order_by('n_in_series')
+                .values_list('n_in_series', flat=True)),
+            [1, 2]
+        )
+
+
+class SeriesAppendTestCase(CardsTestCase):
+    def test_create_appends_to_the_series(self):
+        card_series = CardSeries.objects.create(name='series', owner=self.user)
+        create_cards(self.user, 2, series=card_series)
+        Card.objects.filter(card_series=card_series, n_in_series=1).delete()
+        create_cards(self.user, 1, series=card_series)
+
+        response = self.client.post(
+            '/api/cards/cards/',
+            {'title': 'last', 'card_series': card_series.pk},
+            format='json'
+        )
+
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data['n_in_series'], 3)
+
+    def test_create_rejects_series_of_other_users(self):
+        other = get_user_model().objects.create_user(
+            'other', 'other@knards.com', 'password'
+        )
+        card_series = CardSeries.objects.create(name='series', owner=other)
+
+        response = self.client.post(
+            '/api/cards/cards/',
+            {'title': 'card', 'card_series': card_series.pk},
+            format='json'
+        )
+
+        self.assertEqual(response.status_code, 400)
+
+    def test_bulk_append(self):
+        card_series = CardSeries.objects.create(name='series', owner=self.user)
+        create_cards(self.user, 1, series=card_series)
+
+        response = self.client.post(
+            '/api/cards/cards/bulk_append_to_series/',
+            {
+                'card_series': card_series.pk,
+                'cards': [
+                    # repeated tags count once
+                    {'title': f'card {i}', 'tags': [self.tags[0].pk] * 2}
+                    for i in range(5)
+                ]
+            },
+            format='json'
+        )
+
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(
+            [card['n_in_series'] for card in response.data],
+            [2, 3, 4, 5, 6]
+        )
+        self.assertEqual(response.data[0]['tags'], [self.tags[0].pk])
+        self.assertEqual(get_drift(self.user), {})
+
+
+class KeysetPaginationTestCase(CardsTestCase):
+    url = '/api/cards/cards/'
+
+    def test_walks_the_cardset_both_ways(self):
+        cards = create_cards(self.user, 5)
+        # all cards share created_at, the id breaks the ties
+        expected = sorted(card.pk for card in cards)[::-1]
+
+        with mock.patch.object(TanstackKeysetPagination, 'page_size', 2):
+            pages = []
+            response = self.client.get(
+                self.url,
+                {'pagination': 'keyset', 'count': 'true'}
+            )
+            self.assertEqual(response.data['count'], 5)
+            self.assertIsNone(response.data['previous'])
+            while True:
+                pages.append([card['id'] for card in response.data['results']])
+                if not response.data['next']:
+                    break
+                response = self.client.get(
+                    self.url,
+                    {'pagination': 'keyset', 'page': response.data['next']}
+                )
+
+            self.assertEqual(sum(pages, []), expected)
+            self.assertIsNone(response.data['count'])
+
+            response = self.client.get(
+                self.url,
+                {'pagination': 'keyset', 'page': response.data['previous']}
+            )
+            self.assertEqual(
+                [card['id'] for card in response.data['results']],
+                pages[-2]
+            )
+
+    def test_counts_follow_writes(self):
+        cards = create_cards(self.user, 3)
+        params = {'pagination': 'keyset', 'count': 'true'}
+        self.assertEqual(self.client.get(self.url, params).data['count'], 3)
+
+        create_cards(self.user, 1)
+        self.assertEqual(self.client.get(self.url, params).data['count'], 4)
+
+        cards[0].delete()
+        self.assertEqual(self.client.get(self.url, params).data['count'], 3)
+
+
+class ConditionalGetTestCase(CardsTestCase):
+    url = '/api/cards/cards/'
+
+    def test_answers_unchanged_content_with_not_modified(self):
+        create_cards(self.user, 3)
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        etag = response['ETag']
+
+        # only the content versions are read
+        with self.assertNumQueries(1):
+            response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+
+        response = self.client.get(
+            self.url,
+            {'page': 2},
+            HTTP_IF_NONE_MATCH=etag
+        )
+        self.assertNotEqual(response.status_code, 304)
+
+    def test_writes_change_the_etag(self):
+        card = create_cards(self.user, 1)[0]
+        etag = self.client.get(self.url)['ETag']
+
+        card.title = 'renamed'
+        card.save()
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+        etag = response['ETag']
+        response = self.client.post(
+            '/api/cards/card-scores/bulk/',
+            [{'card': card.pk, 'score': 1}],
+            format='json'
+        )
+        self.assertEqual(response.status_code, 200)
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+    def test_partials_are_versioned_by_card(self):
+        cards = create_cards(self.user, 2)
+        url = '/api/cards/card-partials/'
+        etags = [
+            self.client.get(url, {'card': card.pk})['ETag'] for card in cards
+        ]
+
+        CardPartial.objects.create(
+            card=cards[0],
+            content=slate('question'),
+            prompt_initial_content=slate('')
+        )
+        responses = [
+            self.client.get(url, {'card': card.pk}, HTTP_IF_NONE_MATCH=etag)
+            for card, etag in zip(cards, etags)
+        ]
+        self.assertEqual(responses[0].status_code, 200)
+        self.assertEqual(responses[1].status_code, 304)
+
+    def test_tags_are_versioned_globally(self):
+        url = '/api/cards/tags/'
+        etag = self.client.get(url)['ETag']
+        self.assertEqual(
+            self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code,
+            304
+        )
+
+        Tag.objects.create(name='postgres')
+        self.assertEqual(
+            self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code,
+            200
+        )
+
+
+class StatisticsCacheTestCase(CardsTestCase):
+    url = '/api/cards/cards/get_cardset_and_statistics_by_query_params/'
+
+    def setUp(self):
+        super().setUp()
+        reset_cache_counters()
+
+    def test_caches_statistics_until_the_cards_change(self):
+        cards = create_cards(self.user, 3, tags=self.tags[:1])
+        first = self.client.get(self.url).data
+        second = self.client.get(self.url).data
+        self.assertEqual(
+            first['cards_total_by_tags'],
+            second['cards_total_by_tags']
+        )
+        self.assertEqual(get_cache_counters(), {
+            'revision_queue.hit': 1,
+            'revision_queue.miss': 1
+        })
+
+        cards[0].tags.add(self.tags[1])
+        response = self.client.get(self.url)
+        self.assertEqual(
+            response.data['cards_total_by_tags']['python, django']['total'],
+            1
+        )
+        self.assertEqual(get_cache_counters()['revision_queue.miss'], 2)
+
+    def test_keys_are_scoped_by_params_and_user(self):
+        create_cards(self.user, 2, tags=self.tags[:1])
+        self.client.get(self.url)
+        self.client.get(self.url, {'tags': self.tags[1].pk})
+
+        other = get_user_model().objects.create_user(
+            'other', 'other@knards.com', 'password'
+        )
+        self.client.force_authenticate(other)
+        response = self.client.get(self.url)
+        self.assertEqual(response.data['cards_total'], 0)
+        self.assertEqual(get_cache_counters(), {'revision_queue.miss': 3})
+
+    def test_serves_stale_statistics_while_refreshing(self):
+        calls = []
+        def compute():
+            calls.append(1)
+            return len(calls)
+
+        with mock.patch('cards.caching.time.time', return_value=0):
+            self.assertEqual(
+                get_or_compute('test', self.user.pk, {}, compute, 10, 60),
+                1
+            )
+        with mock.patch('cards.caching.time.time', return_value=20):
+            # another request is already refreshing the value
+            key = get_statistics_cache_key('test', self.user.pk)
+            cache.add(f'{key}:lock', 1)
+            self.assertEqual(
+                get_or_compute('test', self.user.pk, {}, compute, 10, 60),
+                1
+            )
+            cache.delete(f'{key}:lock')
+            self.assertEqual(
+                get_or_compute('test', self.user.pk, {}, compute, 10, 60),
+                2
+            )
+        self.assertEqual(get_cache_counters(), {
+            'test.miss': 1,
+            'test.refresh': 1,
+            'test.stale': 1
+        })
+
+    def test_home_info_is_invalidated_by_reviews(self):
+        cards = create_cards(self.user, 2, tags=self.tags[:1])
+        url = '/api/cards/cards/get_home_info/'
+        self.assertEqual(self.client.get(url).data['cards_total'], 2)
+
+        self.client.post(
+            '/api/cards/card-scores/bulk/',
+            [{'card': card.pk, 'score': 3} for card in cards],
+            format='json'
+        )
+        self.assertEqual(
+            TagSetStatistics.objects.get(owner=self.user).total,
+            2
+        )
+        self.client.get(url)
+        self.assertEqual(get_cache_counters(), {'home_statistics.miss': 2})
+
+
+class AsyncViewsTestCase(CardsTestCase):
+    def setUp(self):
+        super().setUp()
+        self.async_client.force_login(self.user)
+        series = CardSeries.objects.create(name='series', owner=self.user)
+        self.cards = create_cards(self.user, 3, series=series, tags=self.tags)
+        create_cards(self.user, 2, tags=self.tags[:1], days_ago=0)
+        CardScore.objects.create(card=self.cards[0], owner=self.user, score=3)
+        for position in (1, 2):
+            CardPartial.objects.create(
+                card=self.cards[1],
+                position=position,
+                content=slate(f'partial {position}'),
+                prompt_initial_content=slate('')
+            )
+
+    async def test_match_the_sync_views(self):
+        for path, params in [
+            ('cards/get_home_info/', {}),
+            ('card-partials/', {'card': self.cards[1].pk}),
+            ('card-partials/', {}),
+            ('tags/', {}),
+        ]:
+            response = await self.async_client.get(
+                f'/api/cards/async/{path}',
+                params
+            )
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(
+                response.json(),
+                (await sync_to_async(self.client.get)(
+                    f'/api/cards/{path}',
+                    params
+                )).json(),
+                path
+            )
+
+    async def test_revision_queue_matches_the_sync_view(self):
+        path = 'cards/get_cardset_and_statistics_by_query_params/'
+        params = {'tags': self.tags[1].pk}
+        data = (await self.async_client.get(
+            f'/api/cards/async/{path}',
+            params
+        )).json()
+        # computed by the sync view, not read from the cache
+        await sync_to_async(cache.clear)()
+        expected = (await sync_to_async(self.client.get)(
+            f'/api/cards/{path}',
+            params
+        )).json()
+
+        self.assertEqual(data['cards_total'], 3)
+        self.assertEqual(
+            data['cards_total_by_tags'],
+            expected['cards_total_by_tags']
+        )
+        self.assertEqual(
+            sorted(data['cardset'], key=lambda card: card['id']),
+            sorted(expected['cardset'], key=lambda card: card['id'])
+        )
+
+    def test_revision_queue_query_count(self):
+        # the content versions for the cache key, then the due cards, their
+        # scores, the totals of the cardset and the tags of its tag sets
+        with self.assertNumQueries(5):
+            response = self.client.get(
+                '/api/cards/async/cards/'
+                'get_cardset_and_statistics_by_query_params/'
+            )
+        self.assertEqual(response.status_code, 200)
+        with self.assertNumQueries(1):
+            self.client.get(
+                '/api/cards/async/cards/'
+                'get_cardset_and_statistics_by_query_params/'
+            )
+
+    def test_run_without_a_sync_middleware(self):
+        # a single sync middleware would take every request through a thread,
+        # which the handler only logs in debug
+        with override_settings(
+            DEBUG=True,
+            INSTRUMENTATION=True,
+            METRICS_DIR=tempfile.gettempdir()
+        ):
+            with self.assertNoLogs('django.request', 'DEBUG'):
+                ASGIHandler()
+
+    async def test_answers_unchanged_content_with_not_modified(self):
+        response = await self.async_client.get('/api/cards/async/tags/')
+        etag = response['ETag']
+
+        response = await self.async_client.get(
+            '/api/cards/async/tags/',
+            headers={'If-None-Match': etag}
+        )
+        self.assertEqual(response.status_code, 304)
+
+        await Tag.objects.acreate(name='postgres')
+        response = await self.async_client.get(
+            '/api/cards/async/tags/',
+            headers={'If-None-Match': etag}
+        )
+        self.assertEqual(response.status_code, 200)
+
+    async def test_errors(self):
+        response = await self.async_client.get(
+            '/api/cards/async/card-partials/',
+            {'card': 'x'}
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('card', response.json())
+
+        response = await self.async_client.post('/api/cards/async/tags/')
+        self.assertEqual(response.status_code, 405)
+
+        await self.async_client.alogout()
+        response = await self.async_client.get('/api/cards/async/tags/')
+        self.assertEqual(response.status_code, 403)
+
+
+class SeedTestCase(TestCase):
+    def dump(self):
+        return [
+            (
+                card.owner.username,
+                card.title,
+                card.n_in_series,
+                card.card_series.name if card.card_series else None,
+                sorted(tag.name for tag in card.tags.all()),
+                [partial.content for partial in card.card_partials.all()],
+                [
+                    (score.score, score.due_at)
+                    for score in card.card_scores.all()
+                ]
+            )
+            for card in Card.objects.select_related('owner', 'card_series')
+                .prefetch_related('tags', 'card_partials', 'card_scores')
+                .order_by('pk')
+        ]
+
+    def test_is_deterministic_and_consistent(self):
+        now = datetime.datetime(2024, 1, 1, tzinfo=pytz.UTC)
+        options = {'n_users': 2, 'n_cards': 40, 'now': now, 'batch_size': 15}
+
+        users = seed(seed=1, **options)
+        self.assertEqual(Card.objects.count(), 80)
+        for user in users:
+            self.assertEqual(get_drift(user), {})
+        self.assertTrue(CardScore.objects.exists())
+        self.assertTrue(any(
+            leaf.get('insetQuestion')
+            for content in CardPartial.objects.values_list(
+                'content',
+                flat=True
+            )
+            for block in content
+            for leaf in block['children']
+        ))
+        first = self.dump()
+
+        get_user_model().objects.all().delete()
+        Tag.objects.all().delete()
+        seed(seed=1, **options)
+        self.assertEqual(self.dump(), first)
+
+    def test_command(self):
+        stdout = StringIO()
+        call_command(
+            'seed_knards',
+            '--users=1',
+            '--cards=10',
+            '--seed=2',
+            stdout=stdout
+        )
+        self.assertIn('Seeded 1 users with 10 cards', stdout.getvalue())
+        self.assertEqual(
+            Card.objects.filter(owner__username='seed0').count(),
+            10
+        )
+
+
+@override_settings(REPLICA_DATABASES=[])
+class QueryBudgetTestCase(TestCase):
+    def test_endpoints_stay_within_their_query_budgets(self):
+        cache.set('session', 1)
+        get_shared_cache().set('pin', 1)
+
+        results = get_results({'small': 60, 'large': 300}, repeat=1)
+
+        self.assertEqual(check_budgets(results), [])
+        # only the statistics of the bench users were invalidated
+        self.assertEqual(cache.get('session'), 1)
+        self.assertEqual(get_shared_cache().get('pin'), 1)
+        # the number of queries doesn't depend on the size of the library
+        for name in QUERY_BUDGETS:
+            self.assertEqual(
+                results['tiers']['small'][name]['queries'],
+                results['tiers']['large'][name]['queries'],
+                name
+            )
+
+    def test_only_runs_in_a_test_or_bench_database(self):
+        self.assertTrue(is_benchmark_database())
+
+        with mock.patch.dict(
+            connections['default'].settings_dict,
+            {'NAME': '/var/lib/knards/knards.sqlite3'}
+        ):
+            self.assertFalse(is_benchmark_database())
+            with self.assertRaises(CommandError):
+                call_command('benchmark_knards', stdout=StringIO())
+        self.assertFalse(get_user_model().objects.exists())
+
+
+@override_settings(REPLICA_DATABASES=[])
+class LoadBenchmarkTestCase(TransactionTestCase):
+    # the requests run in other threads, which only see committed data
+    def test_compares_the_sync_and_async_views(self):
+        user = seed(n_users=1, n_cards=20)[0]
+
+        results = run_load_benchmarks(user, concurrency=2, n_requests=4)
+
+        self.assertEqual(set(results), {
+            'get_home_info',
+            'get_cardset_and_statistics_by_query_params',
+            'card_partials',
+            'tags',
+        })
+        for result in results.values():
+            for mode in ('sync', 'async'):
+                self.assertGreater(result[mode]['requests_per_second'], 0)
+
+
+class InstrumentationTestCase(CardsTestCase):
+    url = '/api/cards/cards/'
+
+    def test_fingerprints_ignore_the_parameters(self):
+        self.assertEqual(
+            get_fingerprint(
+                "SELECT * FROM t WHERE a = %s AND b IN (%s, %s) AND c = 'x'"
+            ),
+            get_fingerprint(
+                'SELECT * FROM t WHERE a = 1 AND b IN (2) AND c = 3'
+            )
+        )
+
+    def test_is_off_by_default(self):
+        response = self.client.get(self.url)
+        self.assertNotIn('Server-Timing', response)
+
+    @override_settings(INSTRUMENTATION=True)
+    def test_reports_timings_and_duplicated_queries(self):
+        cards = create_cards(self.user, 3)
+        for card in cards:
+            CardScore.objects.create(card=card, owner=self.user, score=1)
+
+        with self.assertLogs('knards.instrumentation', 'INFO') as logs:
+            response = self.client.get(self.url)
+
+        self.assertRegex(
+            response['Server-Timing'],
+            r'^db;dur=[\d.]+;desc="\d+ queries, 0 duplicated", '
+            r'serializer;dur=[\d.]+, app;dur=[\d.]+, total;dur=[\d.]+$'
+        )
+        record = json.loads(logs.records[0].getMessage())
+        self.assertEqual(record['route'], 'cards-list')
+        self.assertEqual(record['status'], 200)
+        self.assertGreater(record['queries'], 0)
+        self.assertEqual(record['duplicates'], [])
+
+        # the owner of every score is loaded separately
+        with self.assertLogs('knards.instrumentation', 'INFO') as logs:
+            response = self.client.get('/api/cards/card-scores/')
+        self.assertIn('3 duplicated', response['Server-Timing'])
+        record = json.loads(logs.records[0].getMessage())
+        self.assertEqual(record['duplicates'][0]['count'], 3)
+
+    @override_settings(INSTRUMENTATION=True)
+    async def test_records_the_queries_of_the_async_views(self):
+        async def get_response(request):
+            pass
+
+        # loaded at startup like the ASGI application, before the threads of
+        # sync_to_async connect, and without a thread of its own
+        self.assertTrue(iscoroutinefunction(
+            await sync_to_async(InstrumentationMiddleware)(get_response)
+        ))
+
+        await self.async_client.aforce_login(self.user)
+        with self.assertLogs('knards.instrumentation', 'INFO') as logs:
+            response = await self.async_client.get('/api/cards/async/tags/')
+
+        self.assertEqual(response.status_code, 200)
+        record = json.loads(logs.records[0].getMessage())
+        self.assertEqual(record['route'], 'async-tags-list')
+        self.assertGreater(record['queries'], 0)
+
+
+class MetricsTestCase(CardsTestCase):
+    def setUp(self):
+        super().setUp()
+        self.directory = tempfile.mkdtemp()
+        self.settings = override_settings(METRICS_DIR=self.directory)
+        self.settings.enable()
+        reset_cache_counters()
+
+    def tearDown(self):
+        self.settings.disable()
+        for filename in os.listdir(self.directory):
+            os.remove(os.path.join(self.directory, filename))
+        os.rmdir(self.directory)
+        super().tearDown()
+
+    def get_samples(self):
+        response = self.client.get('/metrics')
+        self.assertEqual(response.status_code, 200)
+        return {
+            line.rsplit(' ', 1)[0]: float(line.rsplit(' ', 1)[1])
+            for line in response.content.decode().splitlines()
+            if not line.startswith('#')
+        }
+
+    def test_aggregates_the_workers(self):
+        route = 'cards-get-cardset-and-statistics-by-query-params'
+        url = '/api/cards/cards/get_cardset_and_statistics_by_query_params/'
+        # the registry lives as long as the process
+        before = self.get_samples()
+        self.client.get(url)
+        self.client.get(url)
+
+        # an exited worker
+        with open(os.path.join(self.directory, 'metrics-0.json'), 'w') as f:
+            json.dump({
+                'pid': 2 ** 22 + 1,
+                'counters': [[
+                    'knards_http_requests_total',
+                    {'route': route, 'method': 'GET', 'status': 200},
+                    3
+                ]],
+                'histograms': [],
+                'gauges': [['knards_http_requests_in_flight', {}, 5]],
+            }, f)
+
+        samples = self.get_samples()
+        key = 'knards_http_requests_total' \
+            f'{{method="GET",route="{route}",status="200"}}'
+        self.assertEqual(samples[key] - before.get(key, 0), 5)
+        self.assertEqual(
+            samples[
+                'knards_http_request_duration_seconds_count'
+                f'{{route="{route}"}}'
+            ] - before.get(
+                'knards_http_request_duration_seconds_count'
+                f'{{route="{route}"}}',
+                0
+            ),
+            2
+        )
+        self.assertIn(
+            f'knards_db_queries_per_request_bucket{{route="{route}",le="5"}}',
+            samples
+        )
+        # only the request for the metrics themselves
+        self.assertEqual(samples['knards_http_requests_in_flight'], 1)
+        self.assertEqual(
+            samples['knards_cache_hit_ratio{cache="revision_queue"}'],
+            0.5
+        )
+
+    async def test_counts_the_queries_of_the_async_views(self):
+        async def get_response(request):
+            pass
+
+        # loaded at startup like the ASGI application
+        self.assertTrue(iscoroutinefunction(
+            await sync_to_async(MetricsMiddleware)(get_response)
+        ))
+
+        await self.async_client.aforce_login(self.user)
+        response = await self.async_client.get('/api/cards/async/tags/')
+
+        self.assertEqual(response.status_code, 200)
+        samples = await sync_to_async(self.get_samples)()
+        route = 'async-tags-list'
+        self.assertEqual(
+            samples[f'knards_db_queries_per_request_count{{route="{route}"}}'],
+            samples[
+                'knards_db_queries_per_request_bucket'
+                f'{{route="{route}",le="1"}}'
+            ] + 1
+        )
+
+    def test_database_connections(self):
+        samples = self.get_samples()
+        self.assertGreaterEqual(
+            samples['knards_db_connections_open{database="default"}'],
+            1
+        )
+
+        key = 'knards_db_connections_opened_total{database="default"}'
+        opened = samples.get(key, 0)
+        connection_created.send(
+            sender=connections['default'].__class__,
+            connection=connections['default']
+        )
+        self.assertEqual(self.get_samples()[key], opened + 1)
+
+    def test_is_not_served_when_disabled(self):
+        with override_settings(METRICS_DIR=None):
+            self.assertEqual(self.client.get('/metrics').status_code, 404)
+
+    def test_token(self):
+        with override_settings(METRICS_TOKEN='secret'):
+            self.assertEqual(self.client.get('/metrics').status_code, 401)
+            self.assertEqual(
+                self.client.get(
+                    '/metrics',
+                    HTTP_AUTHORIZATION='Bearer secret'
+                ).status_code,
+                200
+            )
+
+
+class ImportTestCase(CardsTestCase):
+    url = '/api/cards/cards/import/'
+
+    def upload(self, name, content, **data):
+        response = self.client.post(self.url, {
+            'file': SimpleUploadedFile(name, content.encode()),
+            **data
+        })
+        self.assertEqual(response.status_code, 200)
+        return [
+            json.loads(line)
+            for line in b''.join(response.streaming_content).splitlines()
+        ]
+
+    def test_imports_csv(self):
+        series = CardSeries.objects.create(name='basics', owner=self.user)
+        create_cards(self.user, 2, series=series)
+
+        progress = self.upload('deck.csv', '\n'.join([
+            'title,tags,series,front,back',
+            'first,"python,new",basics,"What is {{c1::PEP 8}}?","style"',
+            f'{"x" * 51},python,,front,',
+            'second,,basics,"line 1\nline 2",',
+            'third,new,other,front,',
+        ]))
+
+        self.assertEqual(progress[0]['errors'][0]['line'], 3)
+        self.assertEqual(progress[-1], {
+            'rows': 4,
+            'cards': 3,
+            'done': True,
+            'errors_total': 1
+        })
+        first = Card.objects.get(title='first')
+        self.assertEqual(
+            sorted(tag.name for tag in first.tags.all()),
+            ['new', 'python']
+        )
+        self.assertEqual(Tag.objects.filter(name='python').count(), 1)
+        self.assertEqual(
+            list(Card.objects.filter(card_series=series)
+                .order_by('n_in_series')
+                .values_list('title', 'n_in_series')),
+            [('card 0', 1), ('card 1', 2), ('first', 3), ('second', 4)]
+        )
+        partials = list(first.card_partials.order_by('position'))
+        self.assertEqual(partials[0].content, [{'type': 'text', 'children': [
+            {'text': 'What is '},
+            {'text': 'PEP 8', 'insetQuestion': True},
+            {'text': '?'},
+        ]}])
+        self.assertTrue(partials[1].is_prompt)
+        self.assertEqual(
+            len(Card.objects.get(title='second').card_partials.get().content),
+            2
+        )
+        self.assertEqual(get_drift(self.user), {})
+
+    def test_imports_jsonl_in_chunks(self):
+        lines = [
+            json.dumps({'title': f'card {i}', 'tags': ['python'], 'partials': [
+                {'text': f'question {i}'},
+                {'content': slate(f'answer {i}'), 'is_prompt': True},
+            ]})
+            for i in range(5)
+        ] + ['not json']
+
+        with mock.patch('cards.imports.IMPORT_CHUNK_SIZE', 2):
+            progress = self.upload('deck.jsonl', '\n'.join(lines))
+
+        self.assertEqual(
+            [event['cards'] for event in progress],
+            [2, 4, 4, 5]
+        )
+        self.assertEqual(progress[2]['errors'][0]['error'], 'invalid JSON')
+        self.assertEqual(CardPartial.objects.filter(is_prompt=True).count(), 5)
+        self.assertEqual(
+            Card.objects.get(title='card 3').search_document,
+            'question 3\nanswer 3'
+        )
+
+    def test_jsonl_fields_of_the_wrong_type_are_reported(self):
+        lines = [json.dumps(data) for data in [
+            {'title': 'no tags', 'tags': None, 'partials': None},
+            {'title': 'card', 'tags': 5},
+            {'title': 'card', 'tags': [['python']]},
+            {'title': {'text': 'card'}},
+            {'title': 'card', 'partials': 'question'},
+            {'front': 5},
+            {'title': 'last', 'tags': 'python,django'},
+        ]]
+
+        progress = self.upload('deck.jsonl', '\n'.join(lines))
+
+        self.assertEqual(progress[-1]['cards'], 2)
+        self.assertEqual(progress[-1]['errors_total'], 5)
+        self.assertEqual(
+            [event['errors'][0]['line'] for event in progress[:-1]],
+            [2, 3, 4, 5, 6]
+        )
+        self.assertEqual(
+            sorted(Card.objects.values_list('title', flat=True)),
+            ['last', 'no tags']
+        )
+
+    def test_command_imports_anki_notes(self):
+        with tempfile.NamedTemporaryFile('w', suffix='.txt') as f:
+            f.write('\n'.join([
+                '#separator:tab',
+                '#html:true',
+                '#tags column:3',
+                'Capital of France?<br>Europe\tParis &amp; more\tgeo europe',
+                '{{c1::Berlin}} is in Germany\t\tgeo',
+            ]))
+            f.flush()
+            stdout = StringIO()
+            call_command('import_cards', f.name, user='user', stdout=stdout)
+
+        self.assertIn('Imported 2 cards out of 2 rows', stdout.getvalue())
+        card = Card.objects.get(tags__name='europe')
+        partials = list(card.card_partials.order_by('position'))
+        self.assertEqual(
+            get_content_text(partials[0].content),
+            'Capital of France?\nEurope'
+        )
+        self.assertEqual(get_content_text(partials[1].content), 'Paris & more')
+        self.assertEqual(
+            Card.objects.filter(tags__name='geo').count(),
+            2
+        )
+
+
+class ExportTestCase(CardsTestCase):
+    url = '/api/cards/cards/export/'
+
+    def setUp(self):
+        super().setUp()
+        series = CardSeries.objects.create(name='basics', owner=self.user)
+        self.cards = create_cards(
+            self.user,
+            3,
+            series=series,
+            tags=self.tags
+        )
+        for position in (2, 1):
+            CardPartial.objects.create(
+                card=self.cards[0],
+                content=slate(f'partial {position}'),
+                prompt_initial_content=slate(''),
+                position=position
+            )
+        CardScore.objects.create(card=self.cards[0], owner=self.user, score=2)
+
+    def test_exports_ndjson_in_a_single_pass(self):
+        create_cards(self.user, 5)
+
+        # the cards with their series, then tags, partials and scores per
+        # chunk of 3 cards
+        with mock.patch('cards.exports.EXPORT_CHUNK_SIZE', 3), \
+                self.assertNumQueries(10):
+            response = self.client.get(self.url)
+            lines = b''.join(response.streaming_content).splitlines()
+
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        cards = [json.loads(line) for line in lines]
+        self.assertEqual(len(cards), 8)
+        self.assertEqual(cards[0]['tags'], ['python', 'django'])
+        self.assertEqual(cards[0]['series'], 'basics')
+        self.assertEqual(
+            [partial['content'] for partial in cards[0]['partials']],
+            [slate('partial 1'), slate('partial 2')]
+        )
+        self.assertEqual(cards[0]['score']['score'], 2)
+        self.assertIsNone(cards[1]['score'])
+
+    def test_exports_zip_that_can_be_imported_again(self):
+        response = self.client.get(self.url, {'type': 'zip'})
+        archive = zipfile.ZipFile(io.BytesIO(
+            b''.join(response.streaming_content)
+        ))
+        content = archive.read('cards.jsonl')
+        self.assertEqual(len(content.splitlines()), 3)
+
+        other = get_user_model().objects.create_user(
+            'other', 'other@knards.com', 'password'
+        )
+        self.client.force_authenticate(other)
+        response = self.client.post('/api/cards/cards/import/', {
+            'file': SimpleUploadedFile('cards.jsonl', content)
+        })
+        # the import runs as the progress is streamed
+        b''.join(response.streaming_content)
+        card = Card.objects.filter(owner=other).order_by('pk').first()
+        self.assertEqual(card.card_series.name, 'basics')
+        self.assertEqual(
+            list(card.card_partials.order_by('position')
+                .values_list('content', flat=True)),
+            [slate('partial 1'), slate('partial 2')]
+        )
+
+
+# a second database, sqlite or postgres, configured with DB_REPLICA_HOSTS or
+# added to DATABASES and REPLICA_DATABASES by the test settings. It mirrors
+# the test database of the primary, so the tests look at where the queries
+# go rather than at what they read
+REPLICA = next(iter(settings.REPLICA_DATABASES), None)
+
+@override_settings(REPLICA_DATABASES=['replica'])
+class ReplicaRoutingTestCase(CardsTestCase):
+    def setUp(self):
+        super().setUp()
+        patcher = mock.patch.dict('knards.replicas.unavailable_until')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_pins_writers_to_the_primary(self):
+        other = get_user_model().objects.create_user(
+            'other', 'other@knards.com', 'password'
+        )
+        with mock.patch('knards.replicas.is_available', return_value=True):
+            self.assertEqual(get_read_alias(self.user), 'replica')
+
+            response = self.client.post(
+                '/api/cards/card-series/',
+                {'name': 'series'}
+            )
+            self.assertEqual(response.status_code, 201)
+            self.assertIsNone(get_read_alias(self.user))
+            self.assertEqual(get_read_alias(other), 'replica')
+
+            # failed writes change nothing
+            self.client.force_authenticate(other)
+            self.client.post('/api/cards/card-series/', {})
+            self.assertEqual(get_read_alias(other), 'replica')
+
+    def test_falls_back_to_the_primary(self):
+        with mock.patch('knards.replicas.connections') as connections:
+            ensure_connection = connections.__getitem__.return_value \
+                .ensure_connection
+            ensure_connection.side_effect = OperationalError
+
+            self.assertIsNone(get_read_alias(self.user))
+            # not tried again for a while
+            self.assertIsNone(get_read_alias(self.user))
+            self.assertEqual(ensure_connection.call_count, 1)
+
+    def test_replicas_are_not_migrated(self):
+        router = ReplicaRouter()
+        self.assertFalse(router.allow_migrate('replica', 'cards', 'card'))
+        self.assertIsNone(router.allow_migrate('default', 'cards', 'card'))
+
+
+@skipUnless(REPLICA, 'no replica database configured')
+@override_settings(REPLICA_DATABASES=[REPLICA])
+class ReplicaTestCase(TransactionTestCase):
+    # the replica is another connection, which only sees committed data
+    databases = {'default', *settings.REPLICA_DATABASES[:1]}
+
+    def setUp(self):
+        cache.clear()
+        get_sticky_cache().clear()
+        self.user = get_user_model().objects.create_user(
+            'user', 'user@knards.com', 'password'
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def get_replica_queries(self, url):
+        with CaptureQueriesContext(connections[REPLICA]) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(queries)
+
+    def test_safe_requests_read_from_the_replica(self):
+        self.assertGreater(
+            self.get_replica_queries('/api/cards/card-series/'),
+            0
+        )
+        self.assertGreater(self.get_replica_queries('/api/accounts/users/'), 0)
+
+    def test_users_read_their_own_writes(self):
+        url = '/api/cards/card-series/'
+        response = self.client.post(url, {'name': 'new'})
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(self.get_replica_queries(url), 0)
+
+        # the pin is seen by the workers with another local cache
+        cache.clear()
+        self.assertEqual(self.get_replica_queries(url), 0)
+
+        get_sticky_cache().clear()
+        self.assertGreater(self.get_replica_queries(url), 0)
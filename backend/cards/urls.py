@@ -1,5 +1,6 @@
+from django.urls import path, include
 from rest_framework import routers
-from . import views
+from . import async_views, views
 
 router = routers.SimpleRouter()
 router.register(r'card-series', views.CardSeriesViewSet, basename='card-series')
@@ -7,4 +8,28 @@ router.register(r'tags', views.TagsViewSet, basename='tags')
 router.register(r'cards', views.CardsViewSet, basename='cards')
 router.register(r'card-partials', views.CardPartialsViewSet, basename='card-partials')
 router.register(r'card-scores', views.CardScoresViewSet, basename='card-scores')
-urlpatterns = router.urls
+
+# async variants of the hot read endpoints, served without tying up a thread
+# under ASGI
+async_urlpatterns = [
+    path(
+        'cards/get_home_info/',
+        async_views.home_info,
+        name='async-cards-get-home-info'
+    ),
+    path(
+        'cards/get_cardset_and_statistics_by_query_params/',
+        async_views.revision_queue,
+        name='async-cards-get-cardset-and-statistics-by-query-params'
+    ),
+    path(
+        'card-partials/',
+        async_views.card_partials_list,
+        name='async-card-partials-list'
+    ),
+    path('tags/', async_views.tags_list, name='async-tags-list'),
+]
+
+urlpatterns = router.urls + [
+    path('async/', include(async_urlpatterns)),
+]
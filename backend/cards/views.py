@@ -1,22 +1,67 @@
-import datetime, pytz, math, random
-from collections import defaultdict, Counter
-from django.db.models import Q
+import datetime, json, random
+from collections import defaultdict
+from django.http import StreamingHttpResponse
+from django.db.models import Q, Count, Exists, OuterRef
+from django.shortcuts import get_object_or_404
+from django.utils import timezone
 from rest_framework import viewsets, permissions
 from rest_framework.decorators import action
+from rest_framework.exceptions import ValidationError
 from rest_framework.response import Response
-from knards.pagination import TanstackPagination
+from knards.pagination import TanstackPagination, TanstackKeysetPagination
+from knards.replicas import ReplicaReadMixin
 from .permissions import IsOwnerOrReadOnly
 from .serializers import (
     CardSeriesSerializer,
     TagSerializer,
     CardSerializer,
+    CardBulkEntrySerializer,
     CardPartialSerializer,
-    CardScoreSerializer
+    CardScoreSerializer,
+    CardScoreReviewSerializer,
+    CardScoreBulkResultSerializer
 )
 from .models import CardSeries, Tag, Card, CardPartial, CardScore
+from .series import (
+    BULK_APPEND_LIMIT,
+    reorder_cards_in_series,
+    move_card,
+    append_to_series,
+    bulk_append_cards_to_series
+)
+from .reviews import (
+    BULK_REVIEWS_LIMIT,
+    REVISION_SESSION_WINDOW,
+    bulk_upsert_card_scores,
+    review_card_score,
+    encode_revision_session_cursor,
+    decode_revision_session_cursor,
+    get_revision_session_queue
+)
+from .exports import export_ndjson, export_zip
+from .imports import get_import_format, import_file
+from .stats import (
+    get_revision_queue_and_statistics,
+    get_cached_revision_queue_and_statistics,
+    get_cached_home_statistics,
+    get_home_info
+)
+from .versions import TAGS_KEY, user_key, card_key, VersionedETagMixin
+from .search import (
+    AUTOCOMPLETE_LIMIT,
+    is_postgresql,
+    search_cardset,
+    get_search_headlines,
+    autocomplete_tags,
+    autocomplete_titles
+)
 
 
-class CardSeriesViewSet(viewsets.ModelViewSet):
+class CardSeriesViewSet(
+    ReplicaReadMixin,
+    VersionedETagMixin,
+    viewsets.ModelViewSet
+):
     serializer_class = CardSeriesSerializer
     permission_classes = [
         permissions.IsAuthenticatedOrReadOnly,
@@ -44,12 +89,31 @@ class CardSeriesViewSet(viewsets.ModelViewSet):
 
         serializer.save(owner=self.request.user)
 
-class TagsViewSet(viewsets.ModelViewSet):
+class TagsViewSet(
+    ReplicaReadMixin,
+    VersionedETagMixin,
+    viewsets.ModelViewSet
+):
     serializer_class = TagSerializer
     queryset = Tag.objects.order_by('name')
     lookup_field = 'pk'
+
+    def get_version_keys(self):
+        return [TAGS_KEY]
+
+    @action(detail=False, methods=['GET'])
+    def autocomplete(self, request):
+        q, limit = get_autocomplete_params(request.query_params)
+        if not q:
+            return Response([])
+
+        return Response(autocomplete_tags(request.user, q, limit))
     
-class CardsViewSet(viewsets.ModelViewSet):
+class CardsViewSet(
+    ReplicaReadMixin,
+    VersionedETagMixin,
+    viewsets.ModelViewSet
+):
     serializer_class = CardSerializer
     permission_classes = [
         permissions.IsAuthenticatedOrReadOnly,
@@ -63,62 +127,148 @@ class CardsViewSet(viewsets.ModelViewSet):
             self.request.query_params,
             self.request.user
         )
+        cardset = cardset.select_related('owner').prefetch_related('tags')
+        if self.request.query_params.get('fulltext', None) \
+                and is_postgresql(cardset.db):
+            return cardset.order_by('-search_rank', '-created_at')
         return cardset.order_by('-created_at')
 
+    def get_version_keys(self):
+        # deleting a tag drops it from the cards without any m2m_changed
+        return [user_key(self.request.user.pk), TAGS_KEY]
+
+    @property
+    def paginator(self):
+        # keyset pagination is opt-in and doesn't apply to ranked results
+        if not hasattr(self, '_paginator') \
+                and self.request.query_params.get('pagination') == 'keyset' \
+                and not self.request.query_params.get('fulltext', None):
+            self._paginator = TanstackKeysetPagination()
+        return super().paginator
+
+    def list(self, request, *args, **kwargs):
+        response = super().list(request, *args, **kwargs)
+
+        fulltext = request.query_params.get('fulltext', None)
+        if fulltext:
+            headlines = get_search_headlines(
+                [card['id'] for card in response.data['results']],
+                fulltext
+            )
+            for card in response.data['results']:
+                card['search_headline'] = headlines.get(card['id'])
+
+        return response
+
     def perform_create(self, serializer):
-        card_series = self.request.data.get('card_series', None)
-        cards = Card.objects.filter(
-            card_series=card_series
+        card_series = serializer.validated_data.get('card_series', None)
+        if card_series is None:
+            serializer.save(owner=self.request.user, n_in_series=1)
+            return
+        if card_series.owner != self.request.user:
+            raise ValidationError({'card_series': 'not found'})
+
+        append_to_series(
+            card_series,
+            lambda n_in_series, step: serializer.save(
+                owner=self.request.user,
+                n_in_series=n_in_series
+            )
         )
-        n_in_series = 1 if card_series is None else len(cards) + 1
 
-        serializer.save(owner=self.request.user, n_in_series=n_in_series)
+    @action(detail=False, methods=['POST'])
+    def bulk_append_to_series(self, request):
+        card_series = get_object_or_404(
+            CardSeries,
+            pk=request.data.get('card_series', None),
+            owner=request.user
+        )
+        serializer = CardBulkEntrySerializer(
+            data=request.data.get('cards', []),
+            many=True
+        )
+        serializer.is_valid(raise_exception=True)
+        if len(serializer.validated_data) > BULK_APPEND_LIMIT:
+            raise ValidationError(
+                f'at most {BULK_APPEND_LIMIT} cards can be appended at once'
+            )
 
-    @action(detail=False, methods=['GET'])
-    def get_home_info(self, request):
-        cards_total_by_tags = {}
-        cardset = Card.objects.filter(owner=request.user)
+        tag_ids = {
+            tag_id
+            for entry in serializer.validated_data
+            for tag_id in entry.get('tags', [])
+        }
+        unknown_tag_ids = tag_ids - set(
+            Tag.objects.filter(pk__in=tag_ids).values_list('pk', flat=True)
+        )
+        if unknown_tag_ids:
+            raise ValidationError({'tags': sorted(unknown_tag_ids)})
 
-        for card in cardset:
-            card_score = 0
-            try:
-                card_score_obj = CardScore.objects.get(
-                    card=card.id,
-                    owner=request.user
-                )
-                last_revision_date = card_score_obj.last_revised_at
-                card_score = card_score_obj.score
-            except CardScore.DoesNotExist:
-                last_revision_date = card.created_at
-            days_passed = (
-                datetime.datetime.now(tz=pytz.UTC) - last_revision_date
-            ).days
-
-            eligible_for_revision = card_score < days_passed and days_passed > 0
-
-            if card.tags_set_str not in cards_total_by_tags:
-                cards_total_by_tags[card.tags_set_str] = {}
-                cards_total_by_tags[card.tags_set_str]['total'] = 1
-                cards_total_by_tags[card.tags_set_str]['to_revise'] = (
-                    1 if eligible_for_revision else 0
-                )
-            else:
-                cards_total_by_tags[card.tags_set_str]['total'] += 1
-                cards_total_by_tags[card.tags_set_str]['to_revise'] += (
-                    1 if eligible_for_revision else 0
-                )
-
-        recommendations = {}
-        for tags_set_str, obj in cards_total_by_tags.items():
-            if obj['to_revise'] > 0:
-                if obj['total'] / obj['to_revise'] > 1:
-                    recommendations[obj['total'] / obj['to_revise']] \
-                        = tags_set_str
+        cards = bulk_append_cards_to_series(
+            request.user,
+            card_series,
+            serializer.validated_data
+        )
 
-        return Response({
-            'cards_total': cardset.count(),
-            'recommendations': dict(sorted(recommendations.items())).values()
-        })
+        return Response(CardSerializer(
+            Card.objects.filter(pk__in=[card.pk for card in cards])
+                .select_related('owner')
+                .prefetch_related('tags')
+                .defer('search_document', 'search_vector')
+                .order_by('n_in_series'),
+            many=True
+        ).data, status=201)
+
+    @action(detail=False, methods=['POST'], url_path='import')
+    def import_cards(self, request):
+        file = request.FILES.get('file', None)
+        if file is None:
+            raise ValidationError({'file': 'no file was uploaded'})
+        try:
+            format = get_import_format(
+                file.name,
+                request.data.get('format', None)
+            )
+        except ValueError as e:
+            raise ValidationError({'format': str(e)})
+
+        # one line of progress per imported chunk
+        return StreamingHttpResponse(
+            (
+                json.dumps(progress) + '\n'
+                for progress in import_file(request.user, file, format)
+            ),
+            content_type='application/x-ndjson'
+        )
+
+    @action(detail=False, methods=['GET'])
+    def export(self, request):
+        # `format` would select a renderer
+        type = request.query_params.get('type', 'ndjson')
+        if type not in ('ndjson', 'zip'):
+            raise ValidationError({'type': 'expected ndjson or zip'})
+
+        filename = f'knards-{datetime.date.today().isoformat()}'
+        if type == 'zip':
+            response = StreamingHttpResponse(
+                export_zip(request.user),
+                content_type='application/zip'
+            )
+            filename += '.zip'
+        else:
+            response = StreamingHttpResponse(
+                export_ndjson(request.user),
+                content_type='application/x-ndjson'
+            )
+            filename += '.jsonl'
+        response['Content-Disposition'] = f'attachment; filename="{filename}"'
+        return response
+
+    @action(detail=False, methods=['GET'])
+    def get_home_info(self, request):
+        return Response(
+            get_home_info(get_cached_home_statistics(request.user))
+        )
 
     @action(detail=False, methods=['GET'])
     def get_cardset_and_statistics_by_query_params(self, request):
@@ -127,142 +277,172 @@ class CardsViewSet(viewsets.ModelViewSet):
             request.user
         )
 
-        modified_cardset = []
-        cards_total_by_tags = {}
-        series_total_cards_count = {}
-        for card in cardset:
-            modified_card = {
-                'id': card.pk,
-                'title': card.title,
-                'series_id': card.card_series.pk if card.card_series else None,
-                'series_name': card.card_series.name if card.card_series else None,
-                'n_in_series': card.n_in_series,
-                'tags_ids': [tag.id for tag in card.tags.all()],
-                'tags_names': [tag.name for tag in card.tags.all()],
-                'created_at': int(card.created_at.timestamp() * 1000),
-                'owner_id': card.owner.id,
-                'owner_name': card.owner.username,
-            }
-            if card.card_series:
-                series_name = card.card_series.name
-                if series_name in series_total_cards_count:
-                    series_total_cards_count[series_name] += 1
-                else:
-                    series_total_cards_count[series_name] = 1
-            
-            card_score = 0
-            try:
-                card_score_obj = CardScore.objects.get(
-                    card=card.id,
-                    owner=request.user
-                )
-                last_revision_date = card_score_obj.last_revised_at
-                card_score = card_score_obj.score
-
-                modified_card['score_id'] = card_score_obj.pk
-                modified_card['score'] = card_score
-            except CardScore.DoesNotExist:
-                last_revision_date = card.created_at
-
-                modified_card['score_id'] = None
-                modified_card['score'] = 0
-            days_passed = (
-                datetime.datetime.now(tz=pytz.UTC) - last_revision_date
-            ).days
-
-            eligible_for_revision = card_score < days_passed and days_passed > 0
-
-            if eligible_for_revision:
-                modified_card['weight'] = int(
-                    1000 * math.exp(-0.6 * card_score)
-                        + 18 * math.pow(days_passed, 0.7)
-                )
-                modified_cardset.append(modified_card)
-
-            if card.tags_set_str not in cards_total_by_tags:
-                cards_total_by_tags[card.tags_set_str] = {}
-                cards_total_by_tags[card.tags_set_str]['total'] = 1
-                cards_total_by_tags[card.tags_set_str]['to_revise'] = (
-                    1 if eligible_for_revision else 0
-                )
-            else:
-                cards_total_by_tags[card.tags_set_str]['total'] += 1
-                cards_total_by_tags[card.tags_set_str]['to_revise'] += (
-                    1 if eligible_for_revision else 0
-                )
-        
-        global_tag_strs = {}
-        
-        # count how many times each tag appears throughout the key-value pairs
-        tag_counts = Counter(
-            tag.strip()
-            for key in cards_total_by_tags
-            for tag in key.split(',')
-        )
+        seed = get_order_seed(request.query_params)
+        params = request.query_params.dict()
+        # the queue is ordered after the cache
+        params.pop('seed', None)
 
-        for key, values in cards_total_by_tags.items():
-            tags = [t.strip() for t in key.split(',')]
-            for tag in tags:
-                # only aggregate tags that appear in multiple keys
-                if tag_counts[tag] > 1:
-                    if tag not in global_tag_strs:
-                        global_tag_strs[tag] = {'total': 0, 'to_revise': 0}
-                    global_tag_strs[tag]['total'] += values.get('total', 0)
-                    global_tag_strs[tag]['to_revise'] \
-                        += values.get('to_revise', 0)
-        
-        cards_total_by_tags.update(global_tag_strs)
-        cards_total_by_tags \
-            = {k: cards_total_by_tags[k] for k in sorted(cards_total_by_tags)}
-
-        for card in modified_cardset:
-            if card['series_id']:
-                card['total_cards_in_series']\
-                    = series_total_cards_count[card['series_name']]
+        modified_cardset, cards_total_by_tags, cards_total \
+            = get_cached_revision_queue_and_statistics(
+                cardset,
+                request.user,
+                params
+            )
 
         return Response({
             'cardset': cardset_randomize_and_group_by_weights_and_series(
-                modified_cardset
+                modified_cardset,
+                seed
             ),
-            'cards_total': cardset.count(),
+            'cards_total': cards_total,
             'cards_total_by_tags': cards_total_by_tags
         })
 
     @action(detail=False, methods=['GET'])
-    def get_cards_from_series(self, request):
-        cardset = get_cardset_by_query_params(
-            request.query_params,
-            request.user
+    def revision_session(self, request):
+        cursor = request.query_params.get('cursor', None)
+        session, offset, seed = None, 0, None
+        if cursor:
+            try:
+                session, offset, seed \
+                    = decode_revision_session_cursor(cursor)
+            except ValueError as e:
+                raise ValidationError({'cursor': str(e)})
+        # the seed travels with the cursor, so an expired session is
+        # rebuilt in the same order
+        if seed is None:
+            seed = get_order_seed(request.query_params)
+        if seed is None:
+            seed = random.getrandbits(32)
+        try:
+            limit = min(
+                int(request.query_params.get('limit', REVISION_SESSION_WINDOW)),
+                100
+            )
+        except ValueError:
+            limit = REVISION_SESSION_WINDOW
+        # an empty window would hand back the same cursor forever
+        limit = max(limit, 1)
+
+        def build_queue():
+            cardset = get_cardset_by_query_params(
+                request.query_params,
+                request.user
+            )
+            queue, _, _ = get_revision_queue_and_statistics(
+                cardset,
+                request.user
+            )
+            return cardset_randomize_and_group_by_weights_and_series(
+                queue,
+                seed
+            )
+
+        session, queue = get_revision_session_queue(
+            request.user,
+            session,
+            build_queue
         )
+        window = [dict(card) for card in queue[offset:offset + limit]]
+
+        # partials of the whole window in a single query
+        card_partials = defaultdict(list)
+        for card_partial in CardPartial.objects.filter(
+            card__in=[card['id'] for card in window]
+        ).order_by('card', 'position'):
+            card_partials[card_partial.card_id].append(card_partial)
+        for card in window:
+            card['card_partials'] = CardPartialSerializer(
+                card_partials[card['id']],
+                many=True
+            ).data
+
+        next_offset = offset + len(window)
+        return Response({
+            'cardset': window,
+            'cards_total': len(queue),
+            'seed': seed,
+            'next': encode_revision_session_cursor(session, next_offset, seed)
+                if next_offset < len(queue) else None
+        })
+
+    @action(detail=False, methods=['GET'])
+    def get_cards_from_series(self, request):
+        def get_response():
+            cardset = get_cardset_by_query_params(
+                request.query_params,
+                request.user
+            ).select_related('owner').prefetch_related('tags')
+
+            serializer = CardSerializer(cardset, many=True)
+            return Response(serializer.data)
 
-        serializer = CardSerializer(cardset, many=True)
-        return Response(serializer.data)
+        return self.get_conditional_response(request, get_response)
+
+    @action(detail=False, methods=['GET'])
+    def autocomplete_titles(self, request):
+        q, limit = get_autocomplete_params(request.query_params)
+        if not q:
+            return Response([])
+
+        return Response(autocomplete_titles(request.user, q, limit))
 
     @action(detail=False, methods=['POST'])
     def reorder_cards_in_series(self, request):
-        cards_from_db = list()
-
-        for index, card in enumerate(
-            sorted(request.data['cards_from_series'],
-            key=lambda x: int(x['n_in_series']))
-        ):
-            card_from_db = Card.objects.get(pk=int(card['id']))
-            card_from_db.n_in_series = -(index + 1)
-            card_from_db.save()
-            cards_from_db.append(card_from_db)
+        card_ids = [
+            int(card['id']) for card in sorted(
+                request.data['cards_from_series'],
+                key=lambda x: int(x['n_in_series'])
+            )
+        ]
 
-        for card in cards_from_db:
-            card.n_in_series = -(card.n_in_series)
-            card.save()
+        try:
+            reorder_cards_in_series(request.user, card_ids)
+        except ValueError as e:
+            raise ValidationError(str(e))
 
         return Response({
             'result': 'ok'
         })
 
-class CardPartialsViewSet(viewsets.ModelViewSet):
+    @action(detail=True, methods=['POST'])
+    def move(self, request, pk=None):
+        card = self.get_object()
+        card_series_id = request.data.get('card_series', None)
+        after_id = request.data.get('after', None)
+
+        card_series = None
+        if card_series_id is not None:
+            card_series = get_object_or_404(
+                CardSeries,
+                pk=card_series_id,
+                owner=request.user
+            )
+        after = None
+        if after_id is not None:
+            after = get_object_or_404(Card, pk=after_id, owner=request.user)
+
+        try:
+            move_card(card, card_series=card_series, after=after)
+        except ValueError as e:
+            raise ValidationError(str(e))
+
+        return Response(CardSerializer(card).data)
+
+class CardPartialsViewSet(
+    ReplicaReadMixin,
+    VersionedETagMixin,
+    viewsets.ModelViewSet
+):
     serializer_class = CardPartialSerializer
     lookup_field = 'pk'
 
+    def get_version_keys(self):
+        card = self.request.query_params.get('card', None)
+        if card:
+            return [card_key(card)]
+        return [user_key(self.request.user.pk)]
+
     def get_queryset(self):
         card = self.request.query_params.get('card', None)
 
@@ -278,7 +458,7 @@ class CardPartialsViewSet(viewsets.ModelViewSet):
             
         return queryset.order_by('position')
 
-class CardScoresViewSet(viewsets.ModelViewSet):
+class CardScoresViewSet(ReplicaReadMixin, viewsets.ModelViewSet):
     serializer_class = CardScoreSerializer
     lookup_field = 'pk'
 
@@ -297,81 +477,160 @@ class CardScoresViewSet(viewsets.ModelViewSet):
         return queryset.order_by('pk')
 
     def perform_create(self, serializer):
-        serializer.save(owner=self.request.user)
+        self.perform_review(serializer, CardScore(owner=self.request.user))
 
-def get_cardset_by_query_params(query_params, owner):
+    def perform_update(self, serializer):
+        self.perform_review(serializer, serializer.instance)
+
+    def perform_review(self, serializer, card_score):
+        # every score written here is a review, even when it doesn't change
+        serializer.save(owner=self.request.user, **review_card_score(
+            self.request.user,
+            card_score,
+            serializer.validated_data.get('score', card_score.score),
+            timezone.now()
+        ))
+
+    @action(detail=False, methods=['POST'])
+    def bulk(self, request):
+        serializer = CardScoreReviewSerializer(data=request.data, many=True)
+        serializer.is_valid(raise_exception=True)
+        if len(serializer.validated_data) > BULK_REVIEWS_LIMIT:
+            raise ValidationError(
+                f'at most {BULK_REVIEWS_LIMIT} reviews can be submitted at once'
+            )
+
+        card_ids = {review['card'] for review in serializer.validated_data}
+        unknown_card_ids = card_ids - set(
+            Card.objects.filter(
+                pk__in=card_ids,
+                owner=request.user
+            ).values_list('pk', flat=True)
+        )
+        if unknown_card_ids:
+            raise ValidationError({'card': sorted(unknown_card_ids)})
+
+        card_scores = bulk_upsert_card_scores(
+            request.user,
+            serializer.validated_data
+        )
+
+        return Response(
+            CardScoreBulkResultSerializer(card_scores, many=True).data
+        )
+
+def get_tag_ids(query_params, param):
+    # comma separated ids, repeated ids count once
+    tags = query_params.get(param, None)
+    if not tags:
+        return []
+    try:
+        return sorted({int(tag) for tag in tags.split(',')})
+    except ValueError:
+        raise ValidationError({param: 'expected comma separated ids'})
+
+def get_series_id(query_params):
     series = query_params.get('series', None)
-    tags = query_params.get('tags', None)
+    if not series:
+        return None
+    try:
+        return int(series)
+    except ValueError:
+        raise ValidationError({'series': 'expected an id'})
+
+def get_cardset_by_query_params(query_params, owner):
+    """
+    The cards of `owner` filtered by the query params. The tags are matched
+    in subqueries on the tags of the cards, so the cards are never joined
+    to them and every card is found once whatever the number of tags.
+    """
+    series = get_series_id(query_params)
+    tag_ids = get_tag_ids(query_params, 'tags')
+    exclude_tag_ids = get_tag_ids(query_params, 'exclude_tags')
     tag_inclusion = query_params.get('tag_inclusion', 'or')
+    is_private = query_params.get('is_private', None)
     fulltext = query_params.get('fulltext', None)
 
-    cardset = Card.objects.filter(owner=owner)
-    if series:
+    if tag_inclusion not in ('or', 'and'):
+        raise ValidationError({'tag_inclusion': 'expected or or and'})
+    if is_private not in (None, 'true', 'false'):
+        raise ValidationError({'is_private': 'expected true or false'})
+
+    cardset = Card.objects.filter(owner=owner) \
+        .defer('search_document', 'search_vector')
+    if series is not None:
         cardset = cardset.filter(
             card_series=series
         )
-    if tags:
-        tags_list = tags.split(',')
-        if tag_inclusion == 'or':
-            q = Q()
-            for tag in tags_list:
-                q |= Q(tags=tag)
-            cardset = cardset.filter(q)
-        if tag_inclusion == 'and':
-            for index, tag in enumerate(tags_list):
-                if index == 0:
-                    cardset = cardset.filter(tags=tag)
-                else:
-                    cardset &= cardset.filter(tags=tag)
-    
-    return cardset.distinct()
+    if is_private:
+        cardset = cardset.filter(is_private=is_private == 'true')
+
+    card_tags = Card.tags.through.objects
+    if tag_ids and tag_inclusion == 'or':
+        cardset = cardset.filter(Exists(card_tags.filter(
+            card=OuterRef('pk'),
+            tag__in=tag_ids
+        )))
+    if tag_ids and tag_inclusion == 'and':
+        # the cards with as many of the tags as there are tags, the tags of
+        # a card are unique
+        cardset = cardset.filter(pk__in=card_tags.filter(
+            tag__in=tag_ids
+        ).values('card').annotate(
+            n_tags=Count('tag')
+        ).filter(n_tags=len(tag_ids)).values('card'))
+    if exclude_tag_ids:
+        cardset = cardset.filter(~Exists(card_tags.filter(
+            card=OuterRef('pk'),
+            tag__in=exclude_tag_ids
+        )))
+    if fulltext:
+        cardset = search_cardset(cardset, fulltext)
+
+    return cardset
+
+def get_autocomplete_params(query_params):
+    q = query_params.get('q', '').strip()
+    try:
+        limit = min(int(query_params.get('limit', AUTOCOMPLETE_LIMIT)), 50)
+    except ValueError:
+        limit = AUTOCOMPLETE_LIMIT
+    return q, max(limit, 1)
+
+def get_order_seed(query_params):
+    # the same seed gives the same order of the same queue
+    seed = query_params.get('seed', None)
+    if seed is None:
+        return None
+    try:
+        return int(seed)
+    except ValueError:
+        raise ValidationError({'seed': 'expected an integer'})
+
+def cardset_randomize_and_group_by_weights_and_series(cardset, seed=None):
+    """
+    Orders a revision queue by weight descending, shuffled within each
+    weight. Every series is inserted whole, in its queue order, where the
+    first of its cards lands.
+    """
+    rng = random.Random(seed)
 
-def cardset_randomize_and_group_by_weights_and_series(cardset):
-    # group by weight
     weight_groups = defaultdict(list)
-    for card in cardset:
-        weight_groups[card['weight']].append(card)
-
-    # sort weights descending
-    sorted_weights = sorted(weight_groups.keys(), reverse=True)
-
-    # index by series_id for quick access
     series_map = defaultdict(list)
     for card in cardset:
+        weight_groups[card['weight']].append(card)
         if card['series_id'] is not None:
             series_map[card['series_id']].append(card)
 
-    parsed_series = set()
     result = []
-
-    for weight in sorted_weights:
+    for weight in sorted(weight_groups, reverse=True):
         wgroup = weight_groups[weight]
-        random.shuffle(wgroup)
-
-        i = 0
-        while i < len(wgroup):
-            card = wgroup[i]
-            if card['series_id'] is not None:
-                series_id = card['series_id']
-                if series_id not in parsed_series:
-                    # insert full series group here
-                    full_group = series_map[series_id]
-                    result.extend(full_group)
-                    parsed_series.add(series_id)
-
-                    # remove series from current and future groups
-                    for w in sorted_weights:
-                        weight_groups[w] = [
-                            o for o in weight_groups[w] \
-                                if o['series_id'] != series_id
-                        ]
-                    # restart loop with current weight group (it has changed)
-                    wgroup = weight_groups[weight]
-                    random.shuffle(wgroup)
-                    i = 0
-                    continue
-            else:
+        rng.shuffle(wgroup)
+        for card in wgroup:
+            if card['series_id'] is None:
                 result.append(card)
-            i += 1
+            elif card['series_id'] in series_map:
+                # the rest of the series is skipped wherever it comes up
+                result.extend(series_map.pop(card['series_id']))
 
     return result
\ No newline at end of file
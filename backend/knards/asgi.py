@@ -3,4 +3,7 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'knards.settings')
 
+# served by any ASGI server, e.g. `uvicorn knards.asgi:application`; the
+# views under /api/cards/async/ only release the worker while they wait on
+# the database when served this way
 application = get_asgi_application()
@@ -0,0 +1,205 @@
+import contextvars, functools, json, logging, re, time
+from collections import Counter
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.db.backends.signals import connection_created
+from rest_framework import serializers
+
+logger = logging.getLogger('knards.instrumentation')
+
+# the record of the request being processed, if instrumentation is enabled
+current_record = contextvars.ContextVar('instrumentation', default=None)
+
+
+class RequestRecord:
+    def __init__(self):
+        self.queries = []
+        self.serializer_time = 0
+        self.serializing = False
+        self.view_started_at = None
+
+    @property
+    def query_time(self):
+        return sum(duration for _, duration in self.queries)
+
+    def get_duplicates(self):
+        # statements repeated with different parameters, usually an N+1
+        fingerprints = Counter(
+            get_fingerprint(sql) for sql, _ in self.queries
+        )
+        return {
+            fingerprint: count
+            for fingerprint, count in fingerprints.most_common()
+            if count > 1
+        }
+
+    def get_slowest(self, n):
+        return sorted(self.queries, key=lambda query: -query[1])[:n]
+
+
+def get_fingerprint(sql):
+    sql = re.sub(r"'(?:[^']|'')*'", '?', sql)
+    sql = re.sub(r'%s|\b\d+\b', '?', sql)
+    return re.sub(r'\(\?(?:\s*,\s*\?)*\)', '(...)', sql)
+
+def record_query(execute, sql, params, many, context):
+    record = current_record.get()
+    if record is None:
+        return execute(sql, params, many, context)
+
+    started_at = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        record.queries.append((sql, time.perf_counter() - started_at))
+
+def install_execute_wrapper(wrapper, dispatch_uid):
+    """
+    Runs `wrapper` around the queries of the connections of every thread,
+    also those opened later. The async views query from the threads of
+    sync_to_async, whose connections the request never sees, so the
+    wrappers find the request through context variables, which follow it.
+    """
+    def install(connection, **kwargs):
+        if wrapper not in connection.execute_wrappers:
+            connection.execute_wrappers.append(wrapper)
+
+    connection_created.connect(install, weak=False, dispatch_uid=dispatch_uid)
+    for connection in connections.all(initialized_only=True):
+        install(connection)
+
+def timed_representation(to_representation):
+    @functools.wraps(to_representation)
+    def wrapper(self, instance):
+        record = current_record.get()
+        # nested serializers are part of the outermost one
+        if record is None or record.serializing:
+            return to_representation(self, instance)
+
+        record.serializing = True
+        started_at = time.perf_counter()
+        try:
+            return to_representation(self, instance)
+        finally:
+            record.serializing = False
+            record.serializer_time += time.perf_counter() - started_at
+
+    wrapper.timed = True
+    return wrapper
+
+def install_serializer_timers():
+    for serializer_class in [
+        serializers.Serializer,
+        serializers.ListSerializer
+    ]:
+        if not getattr(serializer_class.to_representation, 'timed', False):
+            serializer_class.to_representation \
+                = timed_representation(serializer_class.to_representation)
+
+def mark_view_started():
+    record = current_record.get()
+    if record is not None:
+        record.view_started_at = time.perf_counter()
+
+def get_server_timing(record, total):
+    # durations in milliseconds
+    view = time.perf_counter() - record.view_started_at \
+        if record.view_started_at is not None else total
+    app = max(view - record.query_time - record.serializer_time, 0)
+    duplicates = sum(record.get_duplicates().values())
+    return ', '.join([
+        'db;dur={:.1f};desc="{} queries, {} duplicated"'.format(
+            record.query_time * 1000,
+            len(record.queries),
+            duplicates
+        ),
+        f'serializer;dur={record.serializer_time * 1000:.1f}',
+        f'app;dur={app * 1000:.1f}',
+        f'total;dur={total * 1000:.1f}',
+    ])
+
+
+class InstrumentationMiddleware:
+    """
+    Times the SQL, serialization and the rest of every request and reports
+    them in a Server-Timing header and a JSON log line. Enabled with the
+    INSTRUMENTATION setting, otherwise it is removed from the middleware
+    chain altogether.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not getattr(settings, 'INSTRUMENTATION', False):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.slowest_queries = getattr(
+            settings,
+            'INSTRUMENTATION_SLOWEST_QUERIES',
+            3
+        )
+        install_serializer_timers()
+        install_execute_wrapper(record_query, 'knards.instrumentation')
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+            # the handler would run a sync process_view in a thread
+            self.process_view = self.aprocess_view
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+
+        record = RequestRecord()
+        token = current_record.set(record)
+        started_at = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            current_record.reset(token)
+        return self.report(request, response, record, started_at)
+
+    async def __acall__(self, request):
+        record = RequestRecord()
+        token = current_record.set(record)
+        started_at = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            current_record.reset(token)
+        return self.report(request, response, record, started_at)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        mark_view_started()
+
+    async def aprocess_view(self, request, view_func, view_args, view_kwargs):
+        mark_view_started()
+
+    def report(self, request, response, record, started_at):
+        total = time.perf_counter() - started_at
+        response['Server-Timing'] = get_server_timing(record, total)
+        self.log(request, response, record, total)
+        return response
+
+    def log(self, request, response, record, total):
+        resolver_match = getattr(request, 'resolver_match', None)
+        logger.info(json.dumps({
+            'method': request.method,
+            'path': request.path,
+            'route': resolver_match.view_name if resolver_match else None,
+            'status': response.status_code,
+            'total_ms': round(total * 1000, 2),
+            'db_ms': round(record.query_time * 1000, 2),
+            'serializer_ms': round(record.serializer_time * 1000, 2),
+            'queries': len(record.queries),
+            'duplicates': [
+                {'fingerprint': fingerprint, 'count': count}
+                for fingerprint, count in record.get_duplicates().items()
+            ],
+            'slowest': [
+                {'sql': sql[:1000], 'ms': round(duration * 1000, 2)}
+                for sql, duration in record.get_slowest(self.slowest_queries)
+            ],
+        }))
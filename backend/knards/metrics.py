@@ -0,0 +1,389 @@
+import contextvars, json, os, threading, time, weakref
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.http import HttpResponse, Http404
+from .instrumentation import install_execute_wrapper
+
+LATENCY_BUCKETS = (
+    0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10
+)
+QUERY_COUNT_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500)
+FLUSH_INTERVAL = 1
+
+# the query counter of the request being processed
+current_queries = contextvars.ContextVar('metrics_queries', default=None)
+
+# the database connections of every thread, they go with their threads
+open_connections = weakref.WeakSet()
+open_connections_lock = threading.Lock()
+
+DESCRIPTIONS = {
+    'knards_http_requests_total': (
+        'counter',
+        'Requests by route, method and status'
+    ),
+    'knards_http_request_duration_seconds': (
+        'histogram',
+        'Request latency by route'
+    ),
+    'knards_db_queries_per_request': (
+        'histogram',
+        'Number of SQL queries per request by route'
+    ),
+    'knards_http_requests_in_flight': (
+        'gauge',
+        'Requests being processed'
+    ),
+    'knards_cache_requests_total': (
+        'counter',
+        'Lookups of the statistics cache by computation and outcome'
+    ),
+    'knards_cache_hit_ratio': (
+        'gauge',
+        'Share of the lookups of the statistics cache served from the cache'
+    ),
+    'knards_db_connections_open': (
+        'gauge',
+        'Open database connections by database'
+    ),
+    'knards_db_connections_opened_total': (
+        'counter',
+        'Database connections opened by database'
+    ),
+}
+
+
+class Registry:
+    """
+    The metrics of this process. Every worker writes a snapshot of its own
+    registry to the metrics directory, the endpoint adds them all up.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.histograms = {}
+        self.gauges = {}
+        self.flushed_at = 0
+
+    def inc(self, name, labels, value=1):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, labels, value, buckets):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = {
+                    'buckets': list(buckets),
+                    'counts': [0] * len(buckets),
+                    'sum': 0,
+                    'count': 0
+                }
+            for index, bound in enumerate(buckets):
+                if value <= bound:
+                    histogram['counts'][index] += 1
+                    break
+            histogram['sum'] += value
+            histogram['count'] += 1
+
+    def add_to_gauge(self, name, labels, value):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.gauges[key] = self.gauges.get(key, 0) + value
+
+    def snapshot(self):
+        from cards.caching import get_cache_counters
+
+        with self.lock:
+            counters = [
+                [name, dict(labels), value]
+                for (name, labels), value in self.counters.items()
+            ]
+            for key, value in get_cache_counters().items():
+                cache, outcome = key.rsplit('.', 1)
+                counters.append([
+                    'knards_cache_requests_total',
+                    {'cache': cache, 'outcome': outcome},
+                    value
+                ])
+            gauges = [
+                [name, dict(labels), value]
+                for (name, labels), value in self.gauges.items()
+            ]
+            for alias, value in get_open_connections().items():
+                gauges.append([
+                    'knards_db_connections_open',
+                    {'database': alias},
+                    value
+                ])
+            return {
+                'pid': os.getpid(),
+                'counters': counters,
+                'histograms': [
+                    [name, dict(labels), histogram]
+                    for (name, labels), histogram in self.histograms.items()
+                ],
+                'gauges': gauges,
+            }
+
+    def flush(self, directory, force=False):
+        now = time.monotonic()
+        if not force and now - self.flushed_at < FLUSH_INTERVAL:
+            return
+        self.flushed_at = now
+
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, f'metrics-{os.getpid()}.json')
+        # readers never see a half written file
+        with open(f'{path}.tmp', 'w') as f:
+            json.dump(self.snapshot(), f)
+        os.replace(f'{path}.tmp', path)
+
+registry = Registry()
+
+
+def track_connection(sender, connection, **kwargs):
+    registry.inc(
+        'knards_db_connections_opened_total',
+        {'database': connection.alias}
+    )
+    with open_connections_lock:
+        open_connections.add(connection)
+
+def get_open_connections():
+    # django keeps a connection per thread and database, closed ones are
+    # reopened on the next query
+    counts = {}
+    with open_connections_lock:
+        for connection in list(open_connections):
+            if connection.connection is not None:
+                counts[connection.alias] = counts.get(connection.alias, 0) + 1
+    return counts
+
+def is_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+def read_snapshots(directory):
+    snapshots = []
+    for filename in sorted(os.listdir(directory)):
+        if not filename.startswith('metrics-') \
+                or not filename.endswith('.json'):
+            continue
+        try:
+            with open(os.path.join(directory, filename)) as f:
+                snapshots.append(json.load(f))
+        except (OSError, ValueError):
+            continue
+    return snapshots
+
+def aggregate(snapshots):
+    # the counters of exited workers are kept, their gauges are not
+    counters, histograms, gauges = {}, {}, {}
+    for snapshot in snapshots:
+        for name, labels, value in snapshot['counters']:
+            key = (name, tuple(sorted(labels.items())))
+            counters[key] = counters.get(key, 0) + value
+        for name, labels, histogram in snapshot['histograms']:
+            key = (name, tuple(sorted(labels.items())))
+            total = histograms.setdefault(key, {
+                'buckets': histogram['buckets'],
+                'counts': [0] * len(histogram['buckets']),
+                'sum': 0,
+                'count': 0
+            })
+            for index, count in enumerate(histogram['counts']):
+                total['counts'][index] += count
+            total['sum'] += histogram['sum']
+            total['count'] += histogram['count']
+        if is_alive(snapshot['pid']):
+            for name, labels, value in snapshot['gauges']:
+                key = (name, tuple(sorted(labels.items())))
+                gauges[key] = gauges.get(key, 0) + value
+
+    # hit ratios of the statistics cache
+    lookups = {}
+    for (name, labels), value in counters.items():
+        if name == 'knards_cache_requests_total':
+            labels = dict(labels)
+            hits, total = lookups.get(labels['cache'], (0, 0))
+            if labels['outcome'] in ('hit', 'stale'):
+                hits += value
+            lookups[labels['cache']] = (hits, total + value)
+    for cache, (hits, total) in lookups.items():
+        gauges['knards_cache_hit_ratio', (('cache', cache),)] = hits / total
+
+    return counters, histograms, gauges
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(
+        '{}="{}"'.format(
+            name,
+            str(value).replace('\\', '\\\\').replace('"', '\\"')
+        )
+        for name, value in labels
+    ) + '}'
+
+def render(counters, histograms, gauges):
+    lines = []
+    samples = {}
+    for (name, labels), value in counters.items():
+        samples.setdefault(name, []).append(
+            f'{name}{format_labels(labels)} {value}'
+        )
+    for (name, labels), value in gauges.items():
+        samples.setdefault(name, []).append(
+            f'{name}{format_labels(labels)} {value}'
+        )
+    for (name, labels), histogram in histograms.items():
+        cumulative = 0
+        for bound, count in zip(histogram['buckets'], histogram['counts']):
+            cumulative += count
+            samples.setdefault(name, []).append('{}_bucket{} {}'.format(
+                name,
+                format_labels(labels + (('le', bound),)),
+                cumulative
+            ))
+        samples[name] += [
+            '{}_bucket{} {}'.format(
+                name,
+                format_labels(labels + (('le', '+Inf'),)),
+                histogram['count']
+            ),
+            f'{name}_sum{format_labels(labels)} {histogram["sum"]}',
+            f'{name}_count{format_labels(labels)} {histogram["count"]}',
+        ]
+
+    for name in sorted(samples):
+        type, description = DESCRIPTIONS.get(name, ('untyped', name))
+        lines += [
+            f'# HELP {name} {description}',
+            f'# TYPE {name} {type}',
+        ] + sorted(samples[name])
+    return '\n'.join(lines) + '\n'
+
+def metrics_view(request):
+    directory = getattr(settings, 'METRICS_DIR', None)
+    if not directory:
+        raise Http404
+    token = getattr(settings, 'METRICS_TOKEN', None)
+    if token and request.headers.get('Authorization') != f'Bearer {token}':
+        return HttpResponse(status=401)
+
+    registry.flush(directory, force=True)
+    return HttpResponse(
+        render(*aggregate(read_snapshots(directory))),
+        content_type='text/plain; version=0.0.4; charset=utf-8'
+    )
+
+
+class count_queries:
+    # unlike CaptureQueriesContext this survives the connection being closed
+    # at the end of the request
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+def count_request_queries(execute, sql, params, many, context):
+    queries = current_queries.get()
+    if queries is None:
+        return execute(sql, params, many, context)
+    return queries(execute, sql, params, many, context)
+
+
+class MetricsMiddleware:
+    """
+    Records the latency, status and number of queries of every request by
+    DRF route, and the database connections of the process. Enabled with
+    the METRICS_DIR setting, the directory shared by all the workers.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.directory = getattr(settings, 'METRICS_DIR', None)
+        if not self.directory:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        install_execute_wrapper(
+            count_request_queries,
+            'knards.metrics.count_request_queries'
+        )
+        connection_created.connect(
+            track_connection,
+            dispatch_uid='knards.metrics.track_connection'
+        )
+        with open_connections_lock:
+            open_connections.update(connections.all(initialized_only=True))
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+
+        queries = count_queries()
+        token = current_queries.set(queries)
+        registry.add_to_gauge('knards_http_requests_in_flight', {}, 1)
+        started_at = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            registry.add_to_gauge('knards_http_requests_in_flight', {}, -1)
+            current_queries.reset(token)
+        return self.record(request, response, queries, started_at)
+
+    async def __acall__(self, request):
+        queries = count_queries()
+        token = current_queries.set(queries)
+        registry.add_to_gauge('knards_http_requests_in_flight', {}, 1)
+        started_at = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            registry.add_to_gauge('knards_http_requests_in_flight', {}, -1)
+            current_queries.reset(token)
+        return self.record(request, response, queries, started_at)
+
+    def record(self, request, response, queries, started_at):
+        duration = time.perf_counter() - started_at
+
+        resolver_match = getattr(request, 'resolver_match', None)
+        route = resolver_match.view_name \
+            if resolver_match and resolver_match.view_name else 'unmatched'
+        registry.inc('knards_http_requests_total', {
+            'route': route,
+            'method': request.method,
+            'status': response.status_code
+        })
+        registry.observe(
+            'knards_http_request_duration_seconds',
+            {'route': route},
+            duration,
+            LATENCY_BUCKETS
+        )
+        registry.observe(
+            'knards_db_queries_per_request',
+            {'route': route},
+            queries.count,
+            QUERY_COUNT_BUCKETS
+        )
+        registry.flush(self.directory)
+        return response
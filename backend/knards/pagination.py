@@ -1,10 +1,14 @@
+import base64, binascii, datetime, hashlib, json
+from django.core.cache import cache
+from django.db.models import Q
 from rest_framework import pagination
+from rest_framework.exceptions import NotFound
 from rest_framework.response import Response
 
 
 class TanstackPagination(pagination.PageNumberPagination):
     page_size = 100
-    
+
     def get_paginated_response(self, data):
         return Response({
             'next': self.page.next_page_number()
@@ -13,4 +17,116 @@ class TanstackPagination(pagination.PageNumberPagination):
                 if self.page.has_previous() else None,
             'count': self.page.paginator.count,
             'results': data
-        })
\ No newline at end of file
+        })
+
+
+class TanstackKeysetPagination(pagination.BasePagination):
+    """
+    Keyset pagination over (created_at, id), newest first.
+
+    The cursor tokens are passed in the same `page` query parameter as the
+    page numbers of TanstackPagination, so the frontend's infinite query
+    works with both. The total count is only computed when requested with
+    `count=true` and is cached for a short while.
+    """
+    page_size = 100
+    page_query_param = 'page'
+    count_query_param = 'count'
+    count_cache_timeout = 60
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        position, reverse = self.decode_cursor(
+            request.query_params.get(self.page_query_param, None)
+        )
+
+        self.count = self.get_count(queryset, request, view)
+
+        if reverse:
+            queryset = queryset.order_by('created_at', 'pk')
+        else:
+            queryset = queryset.order_by('-created_at', '-pk')
+
+        if position is not None:
+            created_at, pk = position
+            # the redundant bound keeps this a single index range scan
+            if reverse:
+                queryset = queryset.filter(created_at__gte=created_at).filter(
+                    Q(created_at__gt=created_at)
+                    | Q(created_at=created_at, pk__gt=pk)
+                )
+            else:
+                queryset = queryset.filter(created_at__lte=created_at).filter(
+                    Q(created_at__lt=created_at)
+                    | Q(created_at=created_at, pk__lt=pk)
+                )
+
+        results = list(queryset[:self.page_size + 1])
+        has_more = len(results) > self.page_size
+        results = results[:self.page_size]
+        if reverse:
+            results.reverse()
+            self.has_next = position is not None
+            self.has_previous = has_more
+        else:
+            self.has_next = has_more
+            self.has_previous = position is not None
+
+        self.results = results
+        return results
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self.encode_cursor(self.results[-1], False)
+                if self.has_next and self.results else None,
+            'previous': self.encode_cursor(self.results[0], True)
+                if self.has_previous and self.results else None,
+            'count': self.count,
+            'results': data
+        })
+
+    def get_count(self, queryset, request, view=None):
+        if request.query_params.get(self.count_query_param) != 'true':
+            return None
+
+        params = sorted(
+            (key, value) for key, value in request.query_params.items()
+            if key != self.page_query_param
+        )
+        # the content versions of the view change with every write, so a
+        # count is never served for cards that were created or deleted since
+        versions = view.get_content_versions() \
+            if hasattr(view, 'get_content_versions') else []
+        key = 'keyset-count:{}:{}:{}'.format(
+            request.user.pk,
+            '.'.join(map(str, versions)),
+            hashlib.md5(json.dumps(params).encode()).hexdigest()
+        )
+        count = cache.get(key)
+        if count is None:
+            count = queryset.count()
+            cache.set(key, count, self.count_cache_timeout)
+        return count
+
+    def encode_cursor(self, obj, reverse):
+        return base64.urlsafe_b64encode(json.dumps({
+            'created_at': obj.created_at.isoformat(),
+            'id': obj.pk,
+            'reverse': reverse
+        }).encode()).decode()
+
+    def decode_cursor(self, cursor):
+        # `1` is the initial page param of the frontend's infinite query
+        if cursor in (None, '', '1'):
+            return None, False
+        try:
+            data = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+            return (
+                (
+                    datetime.datetime.fromisoformat(data['created_at']),
+                    int(data['id'])
+                ),
+                bool(data['reverse'])
+            )
+        except (binascii.Error, ValueError, TypeError, KeyError):
+            raise NotFound('Invalid cursor')
@@ -0,0 +1,112 @@
+import contextvars, random, time
+from django.conf import settings
+from django.core.cache import caches
+from django.db import DEFAULT_DB_ALIAS, OperationalError, connections
+from rest_framework.permissions import SAFE_METHODS
+
+# the replica the reads of the request being processed go to, if any
+read_alias = contextvars.ContextVar('read_alias', default=None)
+# replicas that couldn't be connected to and when to try them again
+unavailable_until = {}
+
+
+def get_sticky_key(user_id):
+    return f'replicas:sticky:{user_id}'
+
+def get_sticky_cache():
+    # the next request of the user may be served by any worker
+    return caches[getattr(settings, 'SHARED_CACHE_ALIAS', 'default')]
+
+def pin_to_primary(user_id):
+    # the replicas may lag behind, so users read their own writes from the
+    # primary for a while
+    if not getattr(settings, 'REPLICA_DATABASES', []):
+        return
+    get_sticky_cache().set(
+        get_sticky_key(user_id),
+        1,
+        getattr(settings, 'REPLICA_STICKY_SECONDS', 5)
+    )
+
+def is_pinned_to_primary(user_id):
+    return get_sticky_cache().get(get_sticky_key(user_id)) is not None
+
+def is_available(alias):
+    now = time.monotonic()
+    if unavailable_until.get(alias, 0) > now:
+        return False
+    try:
+        connections[alias].ensure_connection()
+    except OperationalError:
+        unavailable_until[alias] = now \
+            + getattr(settings, 'REPLICA_RETRY_SECONDS', 30)
+        return False
+    return True
+
+def get_read_alias(user):
+    # None reads from the primary
+    replicas = list(getattr(settings, 'REPLICA_DATABASES', []))
+    if not replicas:
+        return None
+    if user.is_authenticated and is_pinned_to_primary(user.pk):
+        return None
+
+    random.shuffle(replicas)
+    for alias in replicas:
+        if is_available(alias):
+            return alias
+    return None
+
+
+class ReplicaRouter:
+    """
+    Routes the reads to the replica chosen for the request, if any, and all
+    the writes to the primary.
+    """
+
+    def db_for_read(self, model, **hints):
+        # the database cache is shared by the workers, so it is read where
+        # it is written
+        if model._meta.app_label == 'django_cache':
+            return DEFAULT_DB_ALIAS
+        return read_alias.get()
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # the replicas hold the same rows as the primary
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # the replicas copy the schema of the primary
+        if db in getattr(settings, 'REPLICA_DATABASES', []):
+            return False
+        return None
+
+
+class ReplicaReadMixin:
+    """
+    Reads from a replica during the safe requests of a DRF view, and pins
+    the user to the primary after a successful write. Streamed content is
+    read after the view returns, so it comes from the primary.
+    """
+
+    read_alias_token = None
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        if request.method in SAFE_METHODS:
+            self.read_alias_token = read_alias.set(
+                get_read_alias(request.user)
+            )
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        if self.read_alias_token is not None:
+            read_alias.reset(self.read_alias_token)
+            self.read_alias_token = None
+        elif request.method not in SAFE_METHODS \
+                and request.user.is_authenticated \
+                and response.status_code < 400:
+            pin_to_primary(request.user.pk)
+        return super().finalize_response(request, response, *args, **kwargs)
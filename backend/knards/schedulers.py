@@ -0,0 +1,8 @@
+# the spaced repetition algorithms the users choose from, implemented in
+# cards.scheduler
+DEFAULT_SCHEDULER = 'knards'
+SCHEDULER_CHOICES = [
+    ('knards', 'Knards'),
+    ('sm2', 'SM-2'),
+    ('fsrs', 'FSRS'),
+]
@@ -12,10 +12,15 @@ db_name = os.environ.get('DB_NAME')
 db_user = os.environ.get('DB_USER')
 db_password = os.environ.get('DB_PASSWORD')
 db_host = os.environ.get('DB_HOST')
+db_replica_hosts = os.environ.get('DB_REPLICA_HOSTS')
 email_host = os.environ.get('EMAIL_HOST')
 email_port = os.environ.get('EMAIL_PORT')
 email_host_user = os.environ.get('EMAIL_HOST_USER')
 email_host_password = os.environ.get('EMAIL_HOST_PASSWORD')
+redis_url = os.environ.get('REDIS_URL')
+django_instrumentation = os.environ.get('DJANGO_INSTRUMENTATION')
+django_metrics_dir = os.environ.get('DJANGO_METRICS_DIR')
+django_metrics_token = os.environ.get('DJANGO_METRICS_TOKEN')
 
 SECRET_KEY = django_secret_key
 
@@ -36,6 +41,7 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',
     'rest_framework',
     'rest_framework_simplejwt.token_blacklist',
     'djoser',
@@ -45,9 +51,11 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'knards.metrics.MetricsMiddleware',
+    'knards.instrumentation.InstrumentationMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.security.SecurityMiddleware',
-    'whitenoise.middleware.WhiteNoiseMiddleware',
+    'knards.staticfiles.WhiteNoiseMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -56,6 +64,14 @@ MIDDLEWARE = [
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
 
+# per-request SQL and timing reports, the middleware removes itself when off
+INSTRUMENTATION = bool(django_instrumentation)
+INSTRUMENTATION_SLOWEST_QUERIES = 3
+
+# directory shared by all the workers, /metrics is only served if it is set
+METRICS_DIR = django_metrics_dir
+METRICS_TOKEN = django_metrics_token
+
 ROOT_URLCONF = 'knards.urls'
 
 TEMPLATES = [
@@ -86,6 +102,56 @@ DATABASES = {
     }
 }
 
+# read-only replicas of the default database as comma separated `host` or
+# `host:port`, the safe requests of the API read from them
+REPLICA_DATABASES = []
+for replica_host in filter(None, (db_replica_hosts or '').split(',')):
+    alias = f'replica{len(REPLICA_DATABASES) + 1}'
+    host, _, port = replica_host.strip().partition(':')
+    DATABASES[alias] = {
+        **DATABASES['default'],
+        'HOST': host,
+        'PORT': port,
+        # the tests read the test database of the primary through it
+        'TEST': {'MIRROR': 'default'},
+    }
+    REPLICA_DATABASES.append(alias)
+DATABASE_ROUTERS = ['knards.replicas.ReplicaRouter']
+# seconds the reads of a user go to the primary after they wrote something
+REPLICA_STICKY_SECONDS = 5
+# seconds a replica that couldn't be connected to is skipped
+REPLICA_RETRY_SECONDS = 30
+
+# a shared cache lets all the workers reuse the computed statistics, the
+# redis backend needs the redis package
+if redis_url:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': redis_url,
+        },
+        'shared': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': redis_url,
+        },
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        },
+        # without redis, the table made by createcachetable
+        'shared': {
+            'BACKEND': 'django.core.cache.backends.db.DatabaseCache',
+            'LOCATION': 'knards_cache',
+            'OPTIONS': {'MAX_ENTRIES': 10000},
+        },
+    }
+STATISTICS_CACHE_ALIAS = 'default'
+# what every worker must see whatever the default cache: the queues of the
+# revision sessions and the users pinned to the primary database
+SHARED_CACHE_ALIAS = 'shared'
+
 AUTH_PASSWORD_VALIDATORS = [
     {
         'NAME': 'django.contrib.auth.password_validation.UserAttributeSimilarityValidator',
@@ -144,6 +210,23 @@ SIMPLE_JWT = {
     'AUTH_COOKIE_HTTP_ONLY' : True,
 }
 
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {
+            'class': 'logging.StreamHandler',
+        },
+    },
+    'loggers': {
+        'knards.instrumentation': {
+            'handlers': ['console'],
+            'level': 'INFO',
+            'propagate': False,
+        },
+    },
+}
+
 X_FRAME_OPTIONS = 'SAMEORIGIN'
 SUMMERNOTE_THEME = 'bs4'
 
@@ -1,6 +1,7 @@
 from django.contrib import admin
 from django.urls import path, include, re_path
 from django.shortcuts import render
+from .metrics import metrics_view
 
 def render_react(request):
     return render(request, 'index.html')
@@ -12,6 +13,7 @@ urlpatterns = [
     path('api/cards/', include('cards.urls')),
     path('api-auth/', include('rest_framework.urls')),
     path('admin/', admin.site.urls),
+    path('metrics', metrics_view, name='metrics'),
     re_path(r'^$', render_react),
     re_path(r'^(?:.*)/?$', render_react),
 ]
\ No newline at end of file
@@ -47,7 +47,7 @@ export function getCardsQueryOptions(accessToken: string, queryParams: any) {
       );
 
       const response = await api.get<CardsPaginated>(
-        `api/cards/cards/?page=${meta.pageParam}`
+        `api/cards/cards/?pagination=keyset&page=${meta.pageParam}`
           + `${flattenedParams ? `&${flattenedParams}` : ''}`,
         {
           headers: {